@@ -0,0 +1,79 @@
+-- Row change log for delta sync (GET /api/sync/?since=<version>).
+-- Row-level triggers record every insert, update and delete on room_points and base_floor with the id of the
+-- writing transaction. A sync version is a transaction-id horizon (the xmin of a snapshot): every change made by
+-- a transaction below it is committed and visible, and every transaction that commits later is above it, so
+-- clients never miss a change that commits out of order.
+-- Run this once after creating the tables. If an import recreates a table (e.g. ogr2ogr -overwrite), re-run this
+-- file afterwards: the triggers are reinstalled and the horizon moves forward, so clients do a full reload.
+
+CREATE TABLE IF NOT EXISTS data_changelog (
+  seq bigserial PRIMARY KEY,
+  txid bigint NOT NULL DEFAULT txid_current(),
+  table_name text NOT NULL,
+  row_id bigint NOT NULL,
+  op char(1) NOT NULL CHECK (op IN ('I', 'U', 'D')),
+  changed_at timestamptz NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS data_changelog_table_txid_idx ON data_changelog (table_name, txid);
+
+-- Versions below the horizon can no longer be synced (pruned, or before the log existed): 410 Gone
+CREATE TABLE IF NOT EXISTS data_changelog_horizon (
+  id boolean PRIMARY KEY DEFAULT true CHECK (id),
+  txid bigint NOT NULL
+);
+INSERT INTO data_changelog_horizon (txid) VALUES (txid_current())
+ON CONFLICT (id) DO UPDATE SET txid = greatest(data_changelog_horizon.txid, EXCLUDED.txid);
+
+CREATE OR REPLACE FUNCTION log_data_change() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    INSERT INTO data_changelog (table_name, row_id, op) VALUES (TG_TABLE_NAME, OLD.ogc_fid, 'D');
+  ELSIF TG_OP = 'UPDATE' AND NEW.ogc_fid IS DISTINCT FROM OLD.ogc_fid THEN
+    INSERT INTO data_changelog (table_name, row_id, op)
+    VALUES (TG_TABLE_NAME, OLD.ogc_fid, 'D'), (TG_TABLE_NAME, NEW.ogc_fid, 'I');
+  ELSE
+    INSERT INTO data_changelog (table_name, row_id, op) VALUES (TG_TABLE_NAME, NEW.ogc_fid, left(TG_OP, 1));
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- TRUNCATE fires no row triggers: move the horizon past it so every client reloads
+CREATE OR REPLACE FUNCTION log_data_truncate() RETURNS trigger AS $$
+BEGIN
+  UPDATE data_changelog_horizon SET txid = greatest(txid, txid_current() + 1);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS room_points_changelog ON room_points;
+CREATE TRIGGER room_points_changelog
+  AFTER INSERT OR UPDATE OR DELETE ON room_points
+  FOR EACH ROW EXECUTE FUNCTION log_data_change();
+DROP TRIGGER IF EXISTS room_points_changelog_truncate ON room_points;
+CREATE TRIGGER room_points_changelog_truncate
+  AFTER TRUNCATE ON room_points
+  FOR EACH STATEMENT EXECUTE FUNCTION log_data_truncate();
+
+DROP TRIGGER IF EXISTS base_floor_changelog ON base_floor;
+CREATE TRIGGER base_floor_changelog
+  AFTER INSERT OR UPDATE OR DELETE ON base_floor
+  FOR EACH ROW EXECUTE FUNCTION log_data_change();
+DROP TRIGGER IF EXISTS base_floor_changelog_truncate ON base_floor;
+CREATE TRIGGER base_floor_changelog_truncate
+  AFTER TRUNCATE ON base_floor
+  FOR EACH STATEMENT EXECUTE FUNCTION log_data_truncate();
+
+-- Drop entries older than `keep` (see `manage.py prune_changelog`); returns the new horizon
+CREATE OR REPLACE FUNCTION prune_data_changelog(keep interval) RETURNS bigint AS $$
+DECLARE
+  cutoff bigint;
+BEGIN
+  SELECT max(txid) + 1 INTO cutoff FROM data_changelog WHERE changed_at < now() - keep;
+  IF cutoff IS NOT NULL THEN
+    DELETE FROM data_changelog WHERE txid < cutoff;
+    UPDATE data_changelog_horizon SET txid = greatest(txid, cutoff);
+  END IF;
+  RETURN (SELECT txid FROM data_changelog_horizon);
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,43 @@
+-- Data versions for conditional GET (ETag / Last-Modified / 304) on /api/rooms/ and /api/base-floor/, and the
+-- routing graph version (nav_edges_final) that keys the route cache, graph snapshot and contraction hierarchy.
+-- Every statement that changes room_points, base_floor or nav_edges_final bumps that table's version.
+-- Run this once after creating the tables. If an import recreates a table (e.g. ogr2ogr -overwrite), re-run
+-- this file afterwards: the triggers are reinstalled and the final UPDATE bumps the versions.
+
+CREATE TABLE IF NOT EXISTS data_version (
+  table_name text PRIMARY KEY,
+  version bigint NOT NULL DEFAULT 1,
+  updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO data_version (table_name, version, updated_at)
+  VALUES (TG_TABLE_NAME, 1, now())
+  ON CONFLICT (table_name) DO UPDATE
+    SET version = data_version.version + 1, updated_at = now();
+  -- Workers with DATA_VERSION_LISTEN=1 refresh their caches right away (delivered on commit)
+  PERFORM pg_notify('data_version', TG_TABLE_NAME);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS room_points_data_version ON room_points;
+CREATE TRIGGER room_points_data_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON room_points
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();
+
+DROP TRIGGER IF EXISTS base_floor_data_version ON base_floor;
+CREATE TRIGGER base_floor_data_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON base_floor
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();
+
+DROP TRIGGER IF EXISTS nav_edges_final_data_version ON nav_edges_final;
+CREATE TRIGGER nav_edges_final_data_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON nav_edges_final
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();
+
+INSERT INTO data_version (table_name) VALUES ('room_points'), ('base_floor'), ('nav_edges_final')
+ON CONFLICT (table_name) DO NOTHING;
+UPDATE data_version SET version = version + 1, updated_at = now()
+WHERE table_name IN ('room_points', 'base_floor', 'nav_edges_final');
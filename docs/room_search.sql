@@ -0,0 +1,7 @@
+-- Trigram index for GET /api/rooms/autocomplete/ when ROOM_SEARCH_INDEX=0 (pg_trgm fallback), and for
+-- `text ILIKE '%q%'` on /api/rooms/?q=, which pg_trgm GIN indexes can also serve.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS room_points_text_trgm ON room_points USING gin (text gin_trgm_ops);
+ANALYZE room_points;
@@ -28,3 +28,18 @@ WHERE ogc_fid = ANY(ARRAY[45,46,47]::int[]);
 
 -- Note: apply ST_Simplify if you need to reduce geometry vertex count:
 -- ST_Simplify(geom, tolerance) -- tolerance in geometry units (prefer metric)
+
+-- 4) Persistent route cache (written through by POST /api/route/, read by /api/route/cache/<id>/)
+-- Rows are keyed by graph_version (the nav_edges_final data version, see data_version.sql); rows
+-- from older graph versions are never served and are deleted by `python manage.py prune_route_cache`.
+CREATE TABLE IF NOT EXISTS route_result (
+  id bigserial PRIMARY KEY,
+  start_room_id integer NOT NULL,
+  end_room_id integer NOT NULL,
+  simplify_tolerance double precision NOT NULL DEFAULT 0,
+  graph_version text NOT NULL,
+  distance_meters double precision,
+  the_geom geometry,
+  created_at timestamptz NOT NULL DEFAULT now(),
+  UNIQUE (start_room_id, end_room_id, simplify_tolerance, graph_version)
+);
@@ -48,7 +48,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so it sees the whole request being cancelled on client disconnect
+    'interactive_maps_backend_main.cancellation.QueryCancellationMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'interactive_maps_backend_main.compression.StreamingCompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -101,12 +104,102 @@ DATABASES = {
     }
 }
 
+# Read each SSE stream from one server-side (named) cursor instead of one keyset query
+# per batch. Leave disabled behind pgbouncer in transaction pooling mode (named cursors
+# cannot survive across pooled transactions; see DISABLE_SERVER_SIDE_CURSORS).
+SSE_SERVER_SIDE_CURSORS = os.environ.get('SSE_SERVER_SIDE_CURSORS', '0') == '1'
+# Batches each SSE stream fetches ahead while the current one is being sent (0 = no read-ahead)
+SSE_PREFETCH_DEPTH = int(os.environ.get('SSE_PREFETCH_DEPTH', 1))
+# Batches /api/layers/stream/ fetches ahead in total, across all layers of one stream
+LAYERS_STREAM_MAX_IN_FLIGHT = int(os.environ.get('LAYERS_STREAM_MAX_IN_FLIGHT', 2))
+# EventSource reconnection delay sent as `retry:`, and the idle interval between `: keepalive` comments (0 = none)
+SSE_RETRY_MS = int(os.environ.get('SSE_RETRY_MS', 3000))
+SSE_HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+# Days of row changes kept for /api/sync/ by `manage.py prune_changelog`
+CHANGELOG_RETENTION_DAYS = int(os.environ.get('CHANGELOG_RETENTION_DAYS', 30))
+
+# Routing engine for POST /api/route/:
+#   'db'        -> call public.get_route_between_rooms (pgr_dijkstra rebuilds the graph per request)
+#   'inprocess' -> load nav_edges_final once per worker and run Dijkstra/A* in Python
+#   'ch'        -> answer from the contraction hierarchy built by `manage.py build_contraction_hierarchy`
+ROUTING_ENGINE = os.environ.get('ROUTING_ENGINE', 'db')
+# 'dijkstra' or 'astar' (A* needs geographic vertex coordinates; falls back to Dijkstra)
+ROUTING_ALGORITHM = os.environ.get('ROUTING_ALGORITHM', 'dijkstra')
+ROUTING_CH_PATH = os.environ.get('ROUTING_CH_PATH', str(BASE_DIR / 'var' / 'routing.ch.json.gz'))
+# Memory-mapped routing graph written by `manage.py build_graph_snapshot`, shared by all workers
+ROUTING_GRAPH_SNAPSHOT = os.environ.get('ROUTING_GRAPH_SNAPSHOT', str(BASE_DIR / 'var' / 'routing.graph.bin'))
+# Snap rooms / GPS positions to routing vertices with the in-memory grid index instead of a KNN query
+ROUTING_SNAP_INDEX = os.environ.get('ROUTING_SNAP_INDEX', '1') == '1'
+# Build per-worker indexes (snap index, room catalog and search index, routing graph) in a background thread at startup
+WARM_UP_ON_STARTUP = os.environ.get('WARM_UP_ON_STARTUP', '1') == '1'
+# Seconds between re-fingerprinting nav_edges_final to detect graph reloads (only without its data_version trigger)
+ROUTING_GRAPH_VERSION_TTL = int(os.environ.get('ROUTING_GRAPH_VERSION_TTL', 30))
+# Route result cache: per-worker LRU entries, plus write-through to the `route_result` table
+ROUTE_CACHE_SIZE = int(os.environ.get('ROUTE_CACHE_SIZE', 1024))
+ROUTE_CACHE_PERSISTENT = os.environ.get('ROUTE_CACHE_PERSISTENT', '1') == '1'
+# POST /api/route/matrix/: stream matrices larger than this many cells as SSE, N source rows per event
+ROUTE_MATRIX_STREAM_CELLS = int(os.environ.get('ROUTE_MATRIX_STREAM_CELLS', 2500))
+ROUTE_MATRIX_STREAM_ROWS = int(os.environ.get('ROUTE_MATRIX_STREAM_ROWS', 16))
+
+# Vector tiles (/api/tiles/<layer>/<z>/<x>/<y>.mvt)
+TILE_EXTENT = int(os.environ.get('TILE_EXTENT', 4096))
+TILE_BUFFER = int(os.environ.get('TILE_BUFFER', 64))
+# Line work is simplified to about one tile pixel below this zoom level
+TILE_SIMPLIFY_MAX_ZOOM = int(os.environ.get('TILE_SIMPLIFY_MAX_ZOOM', 20))
+TILE_CACHE_MAX_AGE = int(os.environ.get('TILE_CACHE_MAX_AGE', 3600))
+
+# `zoom=` on /api/rooms/ and /api/base-floor/: lines are simplified below this zoom level
+GEOJSON_SIMPLIFY_MAX_ZOOM = int(os.environ.get('GEOJSON_SIMPLIFY_MAX_ZOOM', 20))
+# `Accept: application/x-protobuf`: coordinates are quantized to this many decimals (7 = ~1 cm in degrees)
+BINARY_GEOMETRY_PRECISION = int(os.environ.get('BINARY_GEOMETRY_PRECISION', 7))
+
+# JSON encoder for all responses: auto (orjson > msgspec > json), orjson, msgspec or json
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'auto')
+
+# Precomputed base_floor snapshots (GET /api/base-floor/?snapshot=1, manage.py build_base_floor_snapshot)
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', str(BASE_DIR / 'var' / 'snapshots'))
+SNAPSHOT_CACHE_MAX_AGE = int(os.environ.get('SNAPSHOT_CACHE_MAX_AGE', 60))
+# Brotli quality of snapshots rebuilt on demand (the management command always uses 11)
+SNAPSHOT_BROTLI_QUALITY = int(os.environ.get('SNAPSHOT_BROTLI_QUALITY', 6))
+# nginx `internal` location aliased to SNAPSHOT_DIR; when set, nginx sends the files itself
+SNAPSHOT_X_ACCEL_REDIRECT = os.environ.get('SNAPSHOT_X_ACCEL_REDIRECT', '')
+
+# Conditional GET: seconds a worker trusts its cached data_version rows, and the
+# Cache-Control max-age of paginated/cacheable read responses
+DATA_VERSION_TTL = int(os.environ.get('DATA_VERSION_TTL', 5))
+# Keep a LISTEN data_version connection per worker to see changes immediately (needs psycopg 3)
+DATA_VERSION_LISTEN = os.environ.get('DATA_VERSION_LISTEN', '1') == '1'
+READ_CACHE_MAX_AGE = int(os.environ.get('READ_CACHE_MAX_AGE', 60))
+
+# Response compression (StreamingCompressionMiddleware); brotli is used when installed
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 5))
+# Non-streaming responses smaller than this are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+
+# Async psycopg 3 pool used by the async views (SSE streams, base-floor, tiles, matrix streaming).
+# Sized per uvicorn worker; requires psycopg and psycopg_pool.
+ASYNC_DB_POOL = os.environ.get('ASYNC_DB_POOL', '1') == '1'
+ASYNC_DB_POOL_MIN_SIZE = int(os.environ.get('ASYNC_DB_POOL_MIN_SIZE', 2))
+ASYNC_DB_POOL_MAX_SIZE = int(os.environ.get('ASYNC_DB_POOL_MAX_SIZE', 20))
+# Seconds to wait for a free connection before answering 503
+ASYNC_DB_POOL_TIMEOUT = float(os.environ.get('ASYNC_DB_POOL_TIMEOUT', 5))
+ASYNC_DB_POOL_MAX_IDLE = float(os.environ.get('ASYNC_DB_POOL_MAX_IDLE', 300))
+
+# Serve /api/rooms/, autocomplete and room lookups in routing from a per-worker in-memory copy of room_points
+ROOM_CATALOG = os.environ.get('ROOM_CATALOG', '1') == '1'
+# GET /api/rooms/autocomplete/: in-memory prefix/trigram index (off: pg_trgm query, see docs/room_search.sql),
+# per-request time budget and minimum trigram similarity of fuzzy matches
+ROOM_SEARCH_INDEX = os.environ.get('ROOM_SEARCH_INDEX', '1') == '1'
+ROOM_SEARCH_BUDGET_MS = float(os.environ.get('ROOM_SEARCH_BUDGET_MS', 50))
+ROOM_SEARCH_MIN_SIMILARITY = float(os.environ.get('ROOM_SEARCH_MIN_SIMILARITY', 0.3))
+
 # REST framework minimal config
 # Disable SessionAuthentication to avoid touching the `django_session` table for public API endpoints.
 # Use explicit authentication classes in production as needed (Token/JWT) and enforce permissions per-view.
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
+        'interactive_maps_backend_main.renderers.FastJSONRenderer',
     ),
     'DEFAULT_PARSER_CLASSES': (
         'rest_framework.parsers.JSONParser',
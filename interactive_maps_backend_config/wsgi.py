@@ -14,3 +14,13 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'interactive_maps_backend_config.settings')
 
 application = get_wsgi_application()
+
+# Build per-worker routing indexes in the background (settings.WARM_UP_ON_STARTUP)
+from interactive_maps_backend_main.warmup import start_warm_up  # noqa: E402
+
+start_warm_up()
+
+# Refresh cached data versions on NOTIFY instead of polling (settings.DATA_VERSION_LISTEN)
+from interactive_maps_backend_main.versioning import start_listener  # noqa: E402
+
+start_listener()
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class InteractiveMapsBackendMainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'interactive_maps_backend_main'
+
+    def ready(self):
+        from .cancellation import install
+        install()
@@ -0,0 +1,190 @@
+"""Async-native database access for the ASGI views, on a psycopg 3 connection pool.
+
+Django's ORM connections are per thread, so every `sync_to_async` query from an async
+view occupies a thread-pool slot and a thread-bound connection for its duration; the
+number of concurrent SSE streams is capped by the thread pool. This module talks to
+Postgres directly from the event loop through `psycopg_pool.AsyncConnectionPool`:
+
+- `fetch_all` / `fetch_value` borrow a connection for ONE query and return it, so a
+  keyset-paginated stream only holds a connection while a batch is being fetched and
+  thousands of idle-between-batches streams share `ASYNC_DB_POOL_MAX_SIZE` connections.
+- `stream_batches` reads a whole result from one server-side cursor (holds its
+  connection for the stream's lifetime; used with `SSE_SERVER_SIDE_CURSORS`).
+
+Queries use the same `%s` placeholders as the Django code paths, and rows are dicts like
+`_dictfetchall` returns. The pool is created lazily on the running event loop with the
+credentials of `DATABASES['default']`. If `psycopg_pool` is not installed or
+`ASYNC_DB_POOL` is off, `enabled()` is False and callers keep using `sync_to_async`.
+
+When the request task is cancelled (client disconnect) while a query runs, the statement
+is cancelled on the server before the connection goes back to the pool, and counted in
+`cancellation.query_stats`.
+"""
+import asyncio
+import logging
+import time
+import weakref
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Any, List, Optional
+
+from django.conf import settings
+
+from django.db import OperationalError
+
+from .cancellation import query_stats
+
+try:
+    import psycopg
+    from psycopg.conninfo import make_conninfo
+    from psycopg.rows import dict_row
+except ImportError:  # pragma: no cover - optional dependency
+    psycopg = None
+try:
+    from psycopg_pool import AsyncConnectionPool, PoolTimeout
+except ImportError:  # pragma: no cover - optional dependency
+    AsyncConnectionPool = None
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_loop = None
+# asyncio locks belong to one event loop
+_pool_locks = weakref.WeakKeyDictionary()
+
+
+def enabled() -> bool:
+    return psycopg is not None and AsyncConnectionPool is not None and getattr(settings, 'ASYNC_DB_POOL', False)
+
+
+@lru_cache(maxsize=None)
+def _libpq_keywords() -> frozenset:
+    # Every connection parameter the linked libpq accepts (sslmode, options, ...)
+    return frozenset(option.keyword.decode() for option in psycopg.pq.Conninfo.get_defaults())
+
+
+def conninfo() -> str:
+    """libpq connection string for `DATABASES['default']`.
+
+    `OPTIONS` also holds Django-only keys (`isolation_level`, `pool`, `server_side_binding`,
+    `assume_role`, `cursor_factory`, ...) that libpq rejects; only libpq parameters are kept.
+    """
+    db = settings.DATABASES['default']
+    params = {
+        'dbname': db.get('NAME'),
+        'user': db.get('USER'),
+        'password': db.get('PASSWORD'),
+        'host': db.get('HOST'),
+        'port': db.get('PORT'),
+    }
+    keywords = _libpq_keywords()
+    params.update((k, v) for k, v in db.get('OPTIONS', {}).items() if k in keywords)
+    return make_conninfo(**{k: v for k, v in params.items() if v not in (None, '')})
+
+
+async def get_pool() -> 'AsyncConnectionPool':
+    """Return the pool for the running event loop, opening it on first use."""
+    global _pool, _pool_loop
+    loop = asyncio.get_running_loop()
+    if _pool is not None and _pool_loop is loop:
+        return _pool
+    async with _pool_locks.setdefault(loop, asyncio.Lock()):
+        if _pool is None or _pool_loop is not loop:
+            db = settings.DATABASES['default']
+            # Behind pgbouncer in transaction pooling mode, prepared statements break too
+            pgbouncer = db.get('DISABLE_SERVER_SIDE_CURSORS', False)
+            pool = AsyncConnectionPool(
+                conninfo(),
+                min_size=getattr(settings, 'ASYNC_DB_POOL_MIN_SIZE', 2),
+                max_size=getattr(settings, 'ASYNC_DB_POOL_MAX_SIZE', 20),
+                timeout=getattr(settings, 'ASYNC_DB_POOL_TIMEOUT', 5.0),
+                max_idle=getattr(settings, 'ASYNC_DB_POOL_MAX_IDLE', 300.0),
+                kwargs={'autocommit': True, 'prepare_threshold': None if pgbouncer else 5},
+                name='interactive-maps',
+                open=False,
+            )
+            await pool.open(wait=False)
+            _pool, _pool_loop = pool, loop
+            logger.info('Opened async DB pool (min %d, max %d)', pool.min_size, pool.max_size)
+    return _pool
+
+
+@asynccontextmanager
+async def connection():
+    """Borrow a pooled connection. Connection failures and pool exhaustion surface as
+    Django's `OperationalError`, which the views already turn into 503."""
+    pool = await get_pool()
+    try:
+        async with pool.connection() as conn:
+            yield conn
+    except (PoolTimeout, psycopg.OperationalError) as e:
+        raise OperationalError(str(e)) from e
+
+
+async def _cancel(conn):
+    # psycopg >= 3.1 already cancels on CancelledError; this covers older versions
+    if conn.info.transaction_status != psycopg.pq.TransactionStatus.ACTIVE:
+        return
+    cancel_safe = getattr(conn, 'cancel_safe', None)
+    try:
+        if cancel_safe is not None:
+            await cancel_safe(timeout=5.0)
+        else:
+            conn.cancel()
+    except Exception:
+        logger.warning('Could not cancel query after client disconnect', exc_info=True)
+
+
+@asynccontextmanager
+async def cancel_on_disconnect(conn, sql: str):
+    """Time a query on `conn`; if the awaiting task is cancelled, cancel it on the server."""
+    started = time.monotonic()
+    try:
+        yield
+    except asyncio.CancelledError:
+        await _cancel(conn)
+        query_stats.record_cancel(sql, time.monotonic() - started)
+        raise
+    query_stats.record(sql, time.monotonic() - started)
+
+
+async def fetch_all(sql: str, params: Optional[List] = None) -> List[dict]:
+    """Run one query on a pooled connection and return all rows as dicts."""
+    async with connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cursor:
+            async with cancel_on_disconnect(conn, sql):
+                await cursor.execute(sql, params)
+                return await cursor.fetchall()
+
+
+async def fetch_value(sql: str, params: Optional[List] = None) -> Any:
+    """Run one query and return the first column of the first row (None if no rows)."""
+    async with connection() as conn:
+        async with cancel_on_disconnect(conn, sql):
+            cursor = await conn.execute(sql, params)
+            row = await cursor.fetchone()
+    return row[0] if row else None
+
+
+async def stream_batches(sql: str, params: Optional[List], batch_size: int):
+    """Yield row batches from one server-side cursor; the connection is returned when the
+    consumer stops iterating (end of data or client disconnect)."""
+    async with connection() as conn:
+        # Named cursors need a transaction block
+        async with conn.transaction():
+            async with conn.cursor(name='sse_stream', row_factory=dict_row) as cursor:
+                async with cancel_on_disconnect(conn, sql):
+                    await cursor.execute(sql, params)
+                while True:
+                    async with cancel_on_disconnect(conn, sql):
+                        rows = await cursor.fetchmany(batch_size)
+                    yield rows
+                    if len(rows) < batch_size:
+                        break
+
+
+def pool_stats() -> Optional[dict]:
+    """Pool counters (`pool_size`, `pool_available`, `requests_waiting`, ...) or None if unused."""
+    if _pool is None:
+        return None
+    return _pool.get_stats()
@@ -0,0 +1,339 @@
+"""Compact binary encoding of the GeoJSON responses (`Accept: application/x-protobuf`).
+
+`ST_AsGeoJSON` writes every coordinate as 10-20 characters of text, and `base_floor`
+geometries are 3D, so floor plans are large to send and slow for low-end phones to parse.
+`/api/base-floor/`, `/api/rooms/` and `/api/route/` answer in a Protocol Buffers encoding
+(docs/geometry.proto) instead when the client asks for `application/x-protobuf`; GeoJSON
+stays the default.
+
+- Coordinates are quantized to `10^-precision` (`BINARY_GEOMETRY_PRECISION` decimals,
+  fewer at low `zoom`, see `coordinate_precision`) and each one is written as the
+  zigzag varint of its difference from the previous coordinate on the same axis. Nearby
+  vertices of a floor plan typically differ by a few units, so a coordinate takes 1-3
+  bytes instead of ~15.
+- Only the geometry is re-encoded. The feature's other fields (id, name, layer, ...) are
+  kept as compact JSON in `properties`, so items have the same fields as the JSON API.
+- The body is a sequence of length-prefixed `Frame` messages (varint length + message,
+  as written by protobuf's `writeDelimitedTo`): one `Header`, then `Batch` frames. Every
+  frame can be decoded as soon as it has arrived, so the same framing works for paginated
+  responses (one batch), routes (one batch with one item) and streams (one batch per DB
+  batch, plus empty frames as keepalives).
+
+The encoder is written directly against the wire format; no protobuf runtime is needed
+on the server. `decode_frames` is the reference decoder, used by the tests.
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+from .serialization import dumps, loads
+from .spatial_filters import geojson_precision
+
+PROTOBUF_CONTENT_TYPE = 'application/x-protobuf'
+
+# An empty frame: decoders skip it; streams send it as a keepalive
+KEEPALIVE = b'\x00'
+
+GEOMETRY_TYPES = {
+    'Point': 0,
+    'LineString': 1,
+    'Polygon': 2,
+    'MultiPoint': 3,
+    'MultiLineString': 4,
+    'MultiPolygon': 5,
+    'GeometryCollection': 6,
+}
+_GEOMETRY_NAMES = {code: name for name, code in GEOMETRY_TYPES.items()}
+
+_VARINT = 0
+_LEN = 2
+
+
+def wants_protobuf(request) -> bool:
+    """Whether the request's `Accept` header prefers the binary encoding over JSON."""
+    preferred = request.get_preferred_type(['application/json', PROTOBUF_CONTENT_TYPE])
+    return preferred == PROTOBUF_CONTENT_TYPE
+
+
+def coordinate_precision(zoom: Optional[int] = None) -> int:
+    """Decimals kept when quantizing coordinates: `BINARY_GEOMETRY_PRECISION`, or fewer if
+    `zoom` can't display them (same rule as the GeoJSON precision, see spatial_filters.py)."""
+    precision = getattr(settings, 'BINARY_GEOMETRY_PRECISION', 7)
+    if zoom is not None:
+        precision = min(precision, geojson_precision(zoom))
+    return precision
+
+
+# Wire format
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+
+def _key(field: int, wire_type: int) -> bytes:
+    return _varint((field << 3) | wire_type)
+
+
+def _uint_field(field: int, value: int) -> bytes:
+    # proto3 omits default values
+    return _key(field, _VARINT) + _varint(value) if value else b''
+
+
+def _bytes_field(field: int, value: bytes) -> bytes:
+    return _key(field, _LEN) + _varint(len(value)) + value
+
+
+def _string_field(field: int, value: Optional[str]) -> bytes:
+    return _bytes_field(field, value.encode('utf-8')) if value else b''
+
+
+def _packed_field(field: int, values: Iterable[int]) -> bytes:
+    body = b''.join(_varint(v) for v in values)
+    return _bytes_field(field, body) if body else b''
+
+
+def delimited(message: bytes) -> bytes:
+    """A message with its varint length prefix."""
+    return _varint(len(message)) + message
+
+
+# Encoder
+
+def _flatten(kind: str, coordinates) -> Tuple[List[int], List]:
+    """Part lengths and the flat list of positions of a non-collection geometry.
+
+    Polygon / MultiLineString: the number of positions of each ring or line.
+    MultiPolygon: the number of polygons, then for each polygon its number of rings followed
+    by the length of each ring.
+    """
+    if kind == 'Point':
+        return [], [coordinates]
+    if kind in ('LineString', 'MultiPoint'):
+        return [], coordinates
+    if kind in ('Polygon', 'MultiLineString'):
+        return [len(part) for part in coordinates], [p for part in coordinates for p in part]
+    if kind == 'MultiPolygon':
+        lengths = [len(coordinates)]
+        points = []
+        for polygon in coordinates:
+            lengths.append(len(polygon))
+            for ring in polygon:
+                lengths.append(len(ring))
+                points.extend(ring)
+        return lengths, points
+    raise ValueError(f'Unsupported geometry type: {kind}')
+
+
+def encode_geometry(geometry: Dict[str, Any], factor: int) -> bytes:
+    """`Geometry` message for a GeoJSON geometry, coordinates multiplied by `factor`."""
+    kind = geometry['type']
+    if kind not in GEOMETRY_TYPES:
+        raise ValueError(f'Unsupported geometry type: {kind}')
+    body = _uint_field(1, GEOMETRY_TYPES[kind])
+    if kind == 'GeometryCollection':
+        return body + b''.join(_bytes_field(5, encode_geometry(g, factor)) for g in geometry['geometries'])
+
+    lengths, points = _flatten(kind, geometry['coordinates'])
+    dimensions = len(points[0]) if points else 2
+    deltas = []
+    previous = [0] * dimensions
+    for point in points:
+        for axis in range(dimensions):
+            value = round(point[axis] * factor)
+            deltas.append(_zigzag(value - previous[axis]))
+            previous[axis] = value
+    return (body + _packed_field(2, lengths) + _packed_field(3, deltas)
+            + _uint_field(4, 1 if dimensions == 3 else 0))
+
+
+def _is_geometry(value) -> bool:
+    return isinstance(value, dict) and value.get('type') in GEOMETRY_TYPES
+
+
+def encode_feature(item: Dict[str, Any], factor: int) -> bytes:
+    """`Feature` message for a JSON object: its first GeoJSON geometry value is encoded as
+    `geometry` (the key is kept in `geometry_key`), everything else goes to `properties`."""
+    geometry_key = next((key for key, value in item.items() if _is_geometry(value)), None)
+    properties = {key: value for key, value in item.items() if key != geometry_key}
+    body = _bytes_field(1, dumps(properties))
+    if geometry_key is not None:
+        body += _string_field(2, geometry_key) + _bytes_field(3, encode_geometry(item[geometry_key], factor))
+    return body
+
+
+def header_frame(precision: int, layer: Optional[str] = None) -> bytes:
+    """Delimited `Frame` carrying the `Header` that starts every response."""
+    header = _uint_field(1, precision) + _string_field(2, layer)
+    return delimited(_bytes_field(1, header))
+
+
+def batch_frame(items: Iterable, precision: int, batch: int = 1, fetched: int = 0, more_pending: bool = False,
+                cursor: Optional[str] = None) -> bytes:
+    """Delimited `Frame` with a `Batch` of features.
+
+    `items` are JSON objects, as dicts or as the JSON text the listing queries select.
+    """
+    factor = 10 ** precision
+    body = (_uint_field(1, batch) + _uint_field(2, fetched) + _uint_field(3, 1 if more_pending else 0)
+            + _string_field(4, cursor))
+    for item in items:
+        if not isinstance(item, dict):
+            item = loads(item)
+        body += _bytes_field(5, encode_feature(item, factor))
+    return delimited(_bytes_field(2, body))
+
+
+def encode_document(data, precision: int, layer: Optional[str] = None) -> bytes:
+    """Complete body for one JSON document (a route, an error): a header and one batch with
+    the object, or with each element of a list, as features."""
+    items = data if isinstance(data, list) else [data]
+    return header_frame(precision, layer) + batch_frame(items, precision, fetched=len(items))
+
+
+# Reference decoder
+
+def _read_varint(data: bytes, pos: int):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _fields(data: bytes):
+    """Yield `(field, value)` of a message; `value` is an int or bytes."""
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == _VARINT:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == _LEN:
+            length, pos = _read_varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        else:
+            raise ValueError(f'Unsupported wire type {wire_type}')
+        yield field, value
+
+
+def _unpack(data: bytes) -> List[int]:
+    values, pos = [], 0
+    while pos < len(data):
+        value, pos = _read_varint(data, pos)
+        values.append(value)
+    return values
+
+
+def _split(points: List, lengths: List[int]) -> List[List]:
+    parts, start = [], 0
+    for length in lengths:
+        parts.append(points[start:start + length])
+        start += length
+    return parts
+
+
+def decode_geometry(data: bytes, precision: int) -> Dict[str, Any]:
+    kind, lengths, deltas, has_z, members = 0, [], [], 0, []
+    for field, value in _fields(data):
+        if field == 1:
+            kind = value
+        elif field == 2:
+            lengths = _unpack(value)
+        elif field == 3:
+            deltas = _unpack(value)
+        elif field == 4:
+            has_z = value
+        elif field == 5:
+            members.append(decode_geometry(value, precision))
+    name = _GEOMETRY_NAMES[kind]
+    if name == 'GeometryCollection':
+        return {'type': name, 'geometries': members}
+
+    dimensions = 3 if has_z else 2
+    factor = 10 ** precision
+    points, previous = [], [0] * dimensions
+    for i in range(0, len(deltas), dimensions):
+        point = []
+        for axis in range(dimensions):
+            delta = deltas[i + axis]
+            previous[axis] += (delta >> 1) ^ -(delta & 1)
+            point.append(previous[axis] / factor)
+        points.append(point)
+
+    if name == 'Point':
+        coordinates = points[0]
+    elif name in ('LineString', 'MultiPoint'):
+        coordinates = points
+    elif name in ('Polygon', 'MultiLineString'):
+        coordinates = _split(points, lengths)
+    else:
+        coordinates, pos, start = [], 1, 0
+        for _ in range(lengths[0]):
+            rings = lengths[pos]
+            ring_lengths = lengths[pos + 1:pos + 1 + rings]
+            pos += 1 + rings
+            size = sum(ring_lengths)
+            coordinates.append(_split(points[start:start + size], ring_lengths))
+            start += size
+    return {'type': name, 'coordinates': coordinates}
+
+
+def decode_feature(data: bytes, precision: int) -> Dict[str, Any]:
+    item, geometry_key, geometry = {}, None, None
+    for field, value in _fields(data):
+        if field == 1:
+            item = loads(value)
+        elif field == 2:
+            geometry_key = value.decode('utf-8')
+        elif field == 3:
+            geometry = value
+    if geometry_key is not None:
+        item[geometry_key] = decode_geometry(geometry, precision)
+    return item
+
+
+def decode_frames(data: bytes) -> List[Dict[str, Any]]:
+    """Decode a response body into `{"header": {...}}` and `{"batch": {..., "items": [...]}}`
+    dicts, skipping keepalives; items are the JSON objects with GeoJSON geometries."""
+    frames, pos, precision = [], 0, 0
+    while pos < len(data):
+        length, pos = _read_varint(data, pos)
+        frame = data[pos:pos + length]
+        pos += length
+        for field, value in _fields(frame):
+            if field == 1:
+                header = {'precision': 0, 'layer': ''}
+                for f, v in _fields(value):
+                    if f == 1:
+                        header['precision'] = precision = v
+                    elif f == 2:
+                        header['layer'] = v.decode('utf-8')
+                frames.append({'header': header})
+            elif field == 2:
+                batch = {'batch': 0, 'fetched': 0, 'more_pending': False, 'cursor': '', 'items': []}
+                for f, v in _fields(value):
+                    if f == 1:
+                        batch['batch'] = v
+                    elif f == 2:
+                        batch['fetched'] = v
+                    elif f == 3:
+                        batch['more_pending'] = bool(v)
+                    elif f == 4:
+                        batch['cursor'] = v.decode('utf-8')
+                    elif f == 5:
+                        batch['items'].append(decode_feature(v, precision))
+                frames.append({'batch': batch})
+    return frames
@@ -0,0 +1,253 @@
+"""Cancel running PostgreSQL statements when the client goes away.
+
+Under ASGI, Django cancels the request task when the server reports `http.disconnect`,
+but that only stops the Python side: a statement running in a `sync_to_async` thread
+(e.g. `get_route_between_rooms` from `RouteAPIView`) keeps Postgres busy until it
+finishes, and the result is thrown away. This module turns the disconnect into a
+protocol-level cancel (libpq `PQcancel`, i.e. psycopg's `connection.cancel()`):
+
+- `QueryCancellationMiddleware` gives every request a `RequestQueries` tracker. It lives
+  in a context variable, so it follows the request into `sync_to_async` threads and into
+  the async generators of streaming responses.
+- An execute wrapper, installed on every Django connection by `install()` (called from
+  `AppConfig.ready()`), registers each statement with the current tracker while it runs.
+  Reads from a server-side cursor are registered with `track_query`.
+- When the request task is cancelled, or a streaming response is closed before its end,
+  the middleware cancels whatever is still registered. The statement then fails with
+  `QueryCanceled` in its thread and the error goes nowhere.
+- Queries on the async pool are cancelled by async_db itself (see `async_db.connection`).
+
+Cancelling is skipped while a `keep_running_while` guard holds, e.g. while other requests
+wait for the same single-flight route computation.
+
+`query_stats` counts cancelled statements, the time they had already run and an estimate
+of the DB time saved: the typical duration of the same statement (a moving average of its
+completed runs) minus the time it had run. `/api/stats/` reports it as `query_cancellation`.
+"""
+import asyncio
+import contextvars
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+logger = logging.getLogger(__name__)
+
+# Statement texts whose typical duration is remembered; the table is reset when full
+_MAX_KEYS = 1000
+_EMA_ALPHA = 0.2
+
+
+class QueryStats:
+    """Per-worker counters for cancelled statements and the DB time they saved."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._typical = {}
+        self.cancelled = 0
+        self.cancelled_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def record(self, key: str, elapsed: float):
+        """Fold the duration of a completed statement into its moving average."""
+        with self._lock:
+            typical = self._typical.get(key)
+            if typical is None:
+                if len(self._typical) >= _MAX_KEYS:
+                    self._typical.clear()
+                self._typical[key] = elapsed
+            else:
+                self._typical[key] = typical + _EMA_ALPHA * (elapsed - typical)
+
+    def record_cancel(self, key: str, elapsed: float):
+        with self._lock:
+            self.cancelled += 1
+            self.cancelled_seconds += elapsed
+            typical = self._typical.get(key)
+            if typical is not None and typical > elapsed:
+                self.saved_seconds += typical - elapsed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'cancelled_queries': self.cancelled,
+                'cancelled_elapsed_ms': round(self.cancelled_seconds * 1000, 1),
+                'estimated_saved_ms': round(self.saved_seconds * 1000, 1),
+            }
+
+
+query_stats = QueryStats()
+
+
+class RequestQueries:
+    """The statements one request has running right now, and how to cancel each of them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = {}
+        self._tokens = itertools.count()
+        self._guards = []
+        self.cancelled = False
+
+    def start(self, cancel: Callable[[], None], key: str) -> int:
+        with self._lock:
+            token = next(self._tokens)
+            self._running[token] = (cancel, key, time.monotonic())
+        return token
+
+    def finish(self, token: int):
+        with self._lock:
+            self._running.pop(token, None)
+
+    def cancel_all(self) -> int:
+        """Cancel every running statement (unless a guard holds); return how many were cancelled."""
+        with self._lock:
+            if not self._running or any(guard() for guard in self._guards):
+                return 0
+            running = list(self._running.values())
+            self._running.clear()
+            self.cancelled = True
+        now = time.monotonic()
+        for cancel, key, started in running:
+            try:
+                cancel()
+            except Exception:
+                logger.warning('Could not cancel query after client disconnect', exc_info=True)
+            else:
+                query_stats.record_cancel(key, now - started)
+        logger.info('Client disconnected; cancelled %d running quer%s', len(running), 'y' if len(running) == 1 else 'ies')
+        return len(running)
+
+
+_current: contextvars.ContextVar[Optional[RequestQueries]] = contextvars.ContextVar('request_queries', default=None)
+
+
+def request_cancelled() -> bool:
+    """True if the current request's queries were cancelled because its client went away."""
+    tracker = _current.get()
+    return tracker is not None and tracker.cancelled
+
+
+def _canceller(raw_connection) -> Optional[Callable[[], None]]:
+    # psycopg 3 (cancel_safe, 3.2+ / cancel) and psycopg2 (cancel); cancel() is thread-safe in both
+    return getattr(raw_connection, 'cancel_safe', None) or getattr(raw_connection, 'cancel', None)
+
+
+@contextmanager
+def track_query(raw_connection, key: str):
+    """Register work on `raw_connection` (e.g. `fetchmany` on a named cursor) with the
+    current request, so a disconnect cancels it."""
+    tracker = _current.get()
+    cancel = _canceller(raw_connection) if tracker is not None else None
+    if cancel is None:
+        yield
+        return
+    token = tracker.start(cancel, key)
+    try:
+        yield
+    finally:
+        tracker.finish(token)
+
+
+@contextmanager
+def keep_running_while(predicate: Callable[[], bool]):
+    """Don't cancel the current request's queries while `predicate()` is true."""
+    tracker = _current.get()
+    if tracker is None:
+        yield
+        return
+    with tracker._lock:
+        tracker._guards.append(predicate)
+    try:
+        yield
+    finally:
+        with tracker._lock:
+            tracker._guards.remove(predicate)
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    key = sql if isinstance(sql, str) else str(sql)
+    started = time.monotonic()
+    with track_query(context['connection'].connection, key):
+        result = execute(sql, params, many, context)
+    query_stats.record(key, time.monotonic() - started)
+    return result
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    if connection.vendor == 'postgresql' and _execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute_wrapper)
+
+
+def install():
+    """Hook the execute wrapper into every new Django database connection."""
+    from django.db.backends.signals import connection_created
+    connection_created.connect(_on_connection_created, dispatch_uid='interactive_maps_query_cancellation')
+
+
+async def _acancel(tracker: RequestQueries):
+    # libpq's cancel blocks on a new connection to the server; keep it off the event loop
+    # and off the thread-sensitive executor, which is busy running the query
+    await sync_to_async(tracker.cancel_all, thread_sensitive=False)()
+
+
+async def _cancel_on_close(content, tracker: RequestQueries):
+    """Re-yield an async streaming body; cancel the request's queries if it stops early.
+
+    `content` is the response's underlying iterator, not `streaming_content` (a new wrapper
+    on every access), so that closing this stream also closes the view's generator.
+    """
+    finished = False
+    try:
+        async for chunk in content:
+            yield chunk
+        finished = True
+    finally:
+        if not finished:
+            await _acancel(tracker)
+        aclose = getattr(content, 'aclose', None)
+        if aclose is not None:
+            await aclose()
+
+
+class QueryCancellationMiddleware:
+    """Cancel a request's running statements when its client disconnects (see module docstring).
+
+    Place it first in `MIDDLEWARE` so it sees the cancellation of the whole request. Under
+    WSGI there is no disconnect notification; the middleware only sets up the tracker.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = _current.set(RequestQueries())
+        try:
+            return self.get_response(request)
+        finally:
+            _current.reset(token)
+
+    async def __acall__(self, request):
+        tracker = RequestQueries()
+        # Not reset afterwards: the streaming body is consumed later in this same task
+        _current.set(tracker)
+        try:
+            response = await self.get_response(request)
+        except asyncio.CancelledError:
+            await _acancel(tracker)
+            raise
+        if response.streaming and response.is_async:
+            response.streaming_content = _cancel_on_close(response._iterator, tracker)
+        return response
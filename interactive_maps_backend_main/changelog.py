@@ -0,0 +1,71 @@
+"""Row change log behind delta sync (`GET /api/sync/?since=<version>`).
+
+Clients cache `room_points` and `base_floor`, and used to refresh by downloading them
+again. Row-level triggers (docs/changelog.sql) now record every insert, update and
+delete in `data_changelog`, together with the id of the writing transaction.
+
+A sync version is a transaction-id horizon: the xmin of the snapshot taken when a sync
+starts. Every transaction below it has finished, and every transaction that commits later
+is at or above it. A sync from `since` to `until` therefore returns exactly the changes of
+transactions in `[since, until)`, even when transactions commit out of order, and the next
+sync starts at `until`. (A sequence number alone would skip a change whose transaction
+commits after a later-numbered one has been synced.)
+
+Several changes to one row collapse into one op that reflects its current state: `insert`
+or `update` with the row's current item (same JSON shape as the layer's stream), or
+`delete`. A row inserted and deleted within the window is left out. Versions below
+`data_changelog_horizon` were pruned (`manage.py prune_changelog`) or predate the log;
+they get `410 Gone`, and the client reloads the layer.
+"""
+from typing import NamedTuple
+
+from django.db import connection
+
+from .pagination import KeysetQuery
+
+
+class SyncWindow(NamedTuple):
+    horizon: int
+    until: int
+
+
+def sync_window() -> SyncWindow:
+    """The oldest version that can still be synced, and the version a sync started now ends at.
+
+    Raises ProgrammingError if docs/changelog.sql has not been run.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT (SELECT txid FROM data_changelog_horizon), txid_snapshot_xmin(txid_current_snapshot())"
+        )
+        horizon, until = cursor.fetchone()
+    return SyncWindow(int(horizon), int(until))
+
+
+def changes_query(table: str, layer_query: KeysetQuery, since: int, until: int) -> KeysetQuery:
+    """Keyset query over the rows of `table` changed in `[since, until)`, ordered by `ogc_fid`.
+
+    `layer_query` is the layer's own query (e.g. `_base_floor_query()`); its `item` is
+    embedded in each change:
+    `{"op": "insert" | "update" | "delete", "ogc_fid": ..., "item": {...} | null}`.
+    """
+    select_sql = f"""
+    SELECT ogc_fid, item FROM (
+        SELECT c.row_id AS ogc_fid,
+            json_build_object(
+                'op', CASE WHEN t.ogc_fid IS NULL THEN 'delete' WHEN c.first_op = 'I' THEN 'insert' ELSE 'update' END,
+                'ogc_fid', c.row_id,
+                'item', t.item::json
+            )::text AS item
+        FROM (
+            SELECT row_id, (array_agg(op ORDER BY seq))[1] AS first_op
+            FROM data_changelog
+            WHERE table_name = %s AND txid >= %s AND txid < %s
+            GROUP BY row_id
+        ) c
+        LEFT JOIN ({layer_query.select_sql}) t ON t.ogc_fid = c.row_id
+        -- Inserted and deleted again within the window: nothing to tell the client
+        WHERE NOT (t.ogc_fid IS NULL AND c.first_op = 'I')
+    ) changes
+    """
+    return KeysetQuery(select_sql, ['ogc_fid'], select_params=[table, since, until, *layer_query.select_params])
@@ -0,0 +1,380 @@
+"""Contraction hierarchy (CH) speedup index for the routing graph.
+
+The campus graph only changes between data loads, so most of the work of a shortest-path
+query can be done ahead of time. `build_contraction_hierarchy` contracts vertices one by
+one (cheapest first, by edge difference) and adds shortcut edges that preserve shortest
+path distances between the remaining vertices. A query then only relaxes "upward" edges
+(towards higher-ranked vertices) from both ends, which settles a tiny fraction of the
+graph. Shortcuts remember the two edges they replace, so a path is unpacked back into the
+original `nav_edges_final` edge ids and `_assemble_route_geometry` keeps working.
+
+The index is saved as a versioned, gzip-compressed JSON file by the
+`build_contraction_hierarchy` management command and loaded once per worker.
+"""
+import gzip
+import heapq
+import json
+import logging
+import math
+import threading
+import zlib
+from array import array
+from bisect import bisect_left
+from typing import Optional
+
+from django.conf import settings
+
+from .routing import RoutePath, RoutingGraph, current_graph_version, on_graph_version_change
+
+logger = logging.getLogger(__name__)
+
+CH_FORMAT = 'interactive-maps-ch'
+CH_FORMAT_VERSION = 1
+
+# Bounds on the witness search run while contracting a vertex. A witness search that gives
+# up early only adds an unnecessary (but correct) shortcut.
+WITNESS_SETTLE_LIMIT = 200
+
+
+class ContractionHierarchy:
+    """Query side of a contraction hierarchy over an undirected graph.
+
+    Vertices are dense indices into the sorted `vertex_ids`. Every CH edge (original or
+    shortcut) is a record `e` with endpoints `edge_src[e]`/`edge_dst[e]` and `edge_cost[e]`.
+    Original edges carry their `nav_edges_final` id in `edge_orig[e]` (-1 for shortcuts);
+    shortcuts carry the contracted vertex `edge_mid[e]` and the records of the two halves
+    `edge_child1[e]` (src-mid) and `edge_child2[e]` (mid-dst).
+
+    `up_offsets`/`up_targets`/`up_edges` is the CSR adjacency of upward edges: for each
+    vertex, the edges to higher-ranked neighbours.
+    """
+
+    def __init__(self, vertex_ids, up_offsets, up_targets, up_edges,
+                 edge_src, edge_dst, edge_cost, edge_orig, edge_mid, edge_child1, edge_child2,
+                 graph_version: Optional[str] = None):
+        self.vertex_ids = vertex_ids
+        self.up_offsets = up_offsets
+        self.up_targets = up_targets
+        self.up_edges = up_edges
+        self.edge_src = edge_src
+        self.edge_dst = edge_dst
+        self.edge_cost = edge_cost
+        self.edge_orig = edge_orig
+        self.edge_mid = edge_mid
+        self.edge_child1 = edge_child1
+        self.edge_child2 = edge_child2
+        self.graph_version = graph_version
+
+    @property
+    def vertex_count(self) -> int:
+        return len(self.vertex_ids)
+
+    @property
+    def shortcut_count(self) -> int:
+        return sum(1 for e in self.edge_orig if e < 0)
+
+    def index_of(self, vertex_id: int) -> Optional[int]:
+        i = bisect_left(self.vertex_ids, vertex_id)
+        if i < len(self.vertex_ids) and self.vertex_ids[i] == vertex_id:
+            return i
+        return None
+
+    def shortest_path(self, start_vid: int, end_vid: int, algorithm: str = 'ch') -> Optional[RoutePath]:
+        """Bidirectional upward search; same result contract as `RoutingGraph.shortest_path`."""
+        start = self.index_of(start_vid)
+        goal = self.index_of(end_vid)
+        if start is None or goal is None:
+            return None
+        if start == goal:
+            return RoutePath(0.0, [], [start_vid])
+
+        offsets, targets, up_edges, edge_cost = self.up_offsets, self.up_targets, self.up_edges, self.edge_cost
+        dist = ({start: 0.0}, {goal: 0.0})
+        # prev[side][v] = (previous vertex, CH edge record used to reach v)
+        prev = ({}, {})
+        settled = (set(), set())
+        heaps = ([(0.0, start)], [(0.0, goal)])
+        best = math.inf
+        meet = None
+
+        while True:
+            # Each side may stop once its smallest tentative distance can't improve `best`
+            active = [side for side in (0, 1) if heaps[side] and heaps[side][0][0] < best]
+            if not active:
+                break
+            side = min(active, key=lambda s: heaps[s][0][0])
+            du, u = heapq.heappop(heaps[side])
+            if u in settled[side] or du > dist[side][u]:
+                continue
+            settled[side].add(u)
+
+            other = dist[1 - side].get(u)
+            if other is not None and du + other < best:
+                best = du + other
+                meet = u
+
+            for pos in range(offsets[u], offsets[u + 1]):
+                v = targets[pos]
+                e = up_edges[pos]
+                nd = du + edge_cost[e]
+                if nd < dist[side].get(v, math.inf):
+                    dist[side][v] = nd
+                    prev[side][v] = (u, e)
+                    heapq.heappush(heaps[side], (nd, v))
+
+        if meet is None:
+            return None
+
+        # CH edges from start up to the meeting vertex, then from there down to the goal
+        forward = []
+        v = meet
+        while v != start:
+            u, e = prev[0][v]
+            forward.append((e, u))
+            v = u
+        forward.reverse()
+        v = meet
+        while v != goal:
+            u, e = prev[1][v]
+            forward.append((e, v))
+            v = u
+
+        edge_ids = []
+        vertices = [start]
+        for e, from_vertex in forward:
+            self._unpack(e, from_vertex, edge_ids, vertices)
+        return RoutePath(best, edge_ids, [self.vertex_ids[i] for i in vertices])
+
+    def _unpack(self, e: int, from_vertex: int, edge_ids: list, vertices: list):
+        """Expand CH edge `e`, traversed starting at `from_vertex`, into original edges."""
+        src, dst, orig, mid = self.edge_src, self.edge_dst, self.edge_orig, self.edge_mid
+        child1, child2 = self.edge_child1, self.edge_child2
+        stack = [(e, from_vertex)]
+        while stack:
+            e, a = stack.pop()
+            if orig[e] >= 0:
+                edge_ids.append(orig[e])
+                vertices.append(dst[e] if src[e] == a else src[e])
+                continue
+            # Push the second half first so the first half is expanded first
+            if a == src[e]:
+                stack.append((child2[e], mid[e]))
+                stack.append((child1[e], a))
+            else:
+                stack.append((child1[e], mid[e]))
+                stack.append((child2[e], a))
+
+    def to_dict(self) -> dict:
+        return {
+            'format': CH_FORMAT,
+            'version': CH_FORMAT_VERSION,
+            'graph_version': self.graph_version,
+            'vertex_ids': list(self.vertex_ids),
+            'up_offsets': list(self.up_offsets),
+            'up_targets': list(self.up_targets),
+            'up_edges': list(self.up_edges),
+            'edge_src': list(self.edge_src),
+            'edge_dst': list(self.edge_dst),
+            'edge_cost': list(self.edge_cost),
+            'edge_orig': list(self.edge_orig),
+            'edge_mid': list(self.edge_mid),
+            'edge_child1': list(self.edge_child1),
+            'edge_child2': list(self.edge_child2),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'ContractionHierarchy':
+        if data.get('format') != CH_FORMAT or data.get('version') != CH_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported contraction hierarchy file (format={data.get('format')!r}, "
+                f"version={data.get('version')!r}); rebuild it with `manage.py build_contraction_hierarchy`."
+            )
+        return cls(
+            array('q', data['vertex_ids']),
+            array('q', data['up_offsets']),
+            array('q', data['up_targets']),
+            array('q', data['up_edges']),
+            array('q', data['edge_src']),
+            array('q', data['edge_dst']),
+            array('d', data['edge_cost']),
+            array('q', data['edge_orig']),
+            array('q', data['edge_mid']),
+            array('q', data['edge_child1']),
+            array('q', data['edge_child2']),
+            graph_version=data.get('graph_version'),
+        )
+
+    def save(self, path):
+        with gzip.open(path, 'wt', encoding='utf-8') as fh:
+            json.dump(self.to_dict(), fh, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path) -> 'ContractionHierarchy':
+        with gzip.open(path, 'rt', encoding='utf-8') as fh:
+            return cls.from_dict(json.load(fh))
+
+
+def build_contraction_hierarchy(graph: RoutingGraph, graph_version: Optional[str] = None,
+                                witness_settle_limit: int = WITNESS_SETTLE_LIMIT) -> ContractionHierarchy:
+    """Contract every vertex of `graph` and return the resulting hierarchy."""
+    n = graph.vertex_count
+    edge_src, edge_dst, edge_cost = [], [], []
+    edge_orig, edge_mid, edge_child1, edge_child2 = [], [], [], []
+
+    def add_edge(a, b, cost, orig=-1, mid=-1, c1=-1, c2=-1):
+        edge_src.append(a)
+        edge_dst.append(b)
+        edge_cost.append(cost)
+        edge_orig.append(orig)
+        edge_mid.append(mid)
+        edge_child1.append(c1)
+        edge_child2.append(c2)
+        return len(edge_src) - 1
+
+    # adj[v][u] = (cost, edge record) of the cheapest remaining edge between v and u
+    adj = [dict() for _ in range(n)]
+    for u in range(n):
+        for pos in range(graph.offsets[u], graph.offsets[u + 1]):
+            v = graph.targets[pos]
+            if v <= u:
+                # Each undirected edge appears once per direction; self-loops never help
+                continue
+            cost = graph.costs[pos]
+            current = adj[u].get(v)
+            if current is None or cost < current[0]:
+                e = add_edge(u, v, cost, orig=graph.edge_ids[pos])
+                adj[u][v] = (cost, e)
+                adj[v][u] = (cost, e)
+
+    def witness_distances(source, excluded, limit):
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+        settled = 0
+        while heap and settled < witness_settle_limit:
+            d, x = heapq.heappop(heap)
+            if d > dist[x]:
+                continue
+            if d > limit:
+                break
+            settled += 1
+            for y, (c, _) in adj[x].items():
+                if y == excluded:
+                    continue
+                nd = d + c
+                if nd < dist.get(y, math.inf):
+                    dist[y] = nd
+                    heapq.heappush(heap, (nd, y))
+        return dist
+
+    def needed_shortcuts(v):
+        neighbours = list(adj[v].items())
+        shortcuts = []
+        if len(neighbours) < 2:
+            return shortcuts
+        max_out = max(c for _, (c, _) in neighbours)
+        for i, (u, (cu, eu)) in enumerate(neighbours):
+            dist = witness_distances(u, v, cu + max_out)
+            for w, (cw, ew) in neighbours[i + 1:]:
+                via = cu + cw
+                if dist.get(w, math.inf) > via:
+                    shortcuts.append((u, w, via, eu, ew))
+        return shortcuts
+
+    contracted_neighbours = [0] * n
+
+    def priority(v):
+        return len(needed_shortcuts(v)) - len(adj[v]) + contracted_neighbours[v]
+
+    heap = [(priority(v), v) for v in range(n)]
+    heapq.heapify(heap)
+    rank = [-1] * n
+    up = [None] * n
+    next_rank = 0
+    while heap:
+        _, v = heapq.heappop(heap)
+        if rank[v] >= 0:
+            continue
+        # Lazy update: re-evaluate and postpone if the vertex is no longer the cheapest
+        p = priority(v)
+        if heap and p > heap[0][0]:
+            heapq.heappush(heap, (p, v))
+            continue
+
+        for u, w, via, eu, ew in needed_shortcuts(v):
+            current = adj[u].get(w)
+            if current is not None and current[0] <= via:
+                continue
+            e = add_edge(u, w, via, mid=v, c1=eu, c2=ew)
+            adj[u][w] = (via, e)
+            adj[w][u] = (via, e)
+
+        rank[v] = next_rank
+        next_rank += 1
+        up[v] = [(u, e) for u, (_, e) in adj[v].items()]
+        for u in adj[v]:
+            del adj[u][v]
+            contracted_neighbours[u] += 1
+        adj[v] = {}
+
+    up_offsets = array('q', [0] * (n + 1))
+    up_targets = array('q')
+    up_edges = array('q')
+    for v in range(n):
+        for u, e in up[v]:
+            up_targets.append(u)
+            up_edges.append(e)
+        up_offsets[v + 1] = len(up_targets)
+
+    return ContractionHierarchy(
+        array('q', graph.vertex_ids), up_offsets, up_targets, up_edges,
+        array('q', edge_src), array('q', edge_dst), array('d', edge_cost),
+        array('q', edge_orig), array('q', edge_mid), array('q', edge_child1), array('q', edge_child2),
+        graph_version=graph_version,
+    )
+
+
+_ch_lock = threading.Lock()
+_ch = None
+
+
+def get_contraction_hierarchy() -> Optional[ContractionHierarchy]:
+    """Return the worker-wide hierarchy loaded from `settings.ROUTING_CH_PATH`.
+
+    Returns None (and logs) when the file is missing, unreadable or corrupt, or was built
+    from a different graph version than the one currently in `nav_edges_final`, so callers
+    can fall back to plain Dijkstra on the in-process graph.
+    """
+    global _ch
+    if _ch is None:
+        with _ch_lock:
+            if _ch is None:
+                path = getattr(settings, 'ROUTING_CH_PATH', None)
+                try:
+                    _ch = ContractionHierarchy.load(path)
+                    logger.info('Loaded contraction hierarchy from %s (%d vertices, %d shortcuts)',
+                                path, _ch.vertex_count, _ch.shortcut_count)
+                except (FileNotFoundError, TypeError):
+                    logger.warning('Contraction hierarchy %s not found; run `manage.py build_contraction_hierarchy`. '
+                                   'Falling back to Dijkstra.', path)
+                    _ch = False
+                except (OSError, EOFError, ValueError, KeyError, zlib.error):
+                    # Truncated or corrupt file (bad gzip stream, invalid JSON, unknown format)
+                    logger.warning('Could not load contraction hierarchy %s; rebuild it with '
+                                   '`manage.py build_contraction_hierarchy`. Falling back to Dijkstra.', path,
+                                   exc_info=True)
+                    _ch = False
+    if not _ch:
+        return None
+    if _ch.graph_version != current_graph_version():
+        logger.warning('Contraction hierarchy is stale (built for graph %s); rebuild it with '
+                       '`manage.py build_contraction_hierarchy`. Falling back to Dijkstra.', _ch.graph_version)
+        return None
+    return _ch
+
+
+@on_graph_version_change
+def _reset_contraction_hierarchy(version):
+    # Pick up a rebuilt file after the next data load
+    global _ch
+    with _ch_lock:
+        _ch = None
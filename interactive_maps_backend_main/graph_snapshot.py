@@ -0,0 +1,223 @@
+"""Memory-mapped binary snapshot of the routing graph, shared by all workers on a host.
+
+Loading `nav_edges_final` into a `RoutingGraph` costs every gunicorn/uvicorn worker the
+same queries and CPU at startup, and the same memory for as long as it runs.
+`manage.py build_graph_snapshot` writes the graph once to `ROUTING_GRAPH_SNAPSHOT`:
+
+    b'IMGRAPH1' | u32 header length | JSON header | sections, each 64-byte aligned
+
+The header holds the graph version, the vertex SRID and `{name: [typecode, offset,
+count]}` for the little-endian sections: the CSR arrays of `RoutingGraph`
+(`vertex_ids`, `offsets`, `targets`, `costs`, `edge_ids`), vertex coordinates `xs` /
+`ys`, and the room -> vertex table of the snap index (`room_ids`, sorted, and
+`room_vertices`). It also records the `room_points` data version the room table was built
+from; the snap index re-snaps the rooms itself once `room_points` has moved on.
+
+`load_graph_snapshot` maps the file read-only and wraps each section in a
+`memoryview.cast`, so the arrays are never copied: the pages live once in the OS page
+cache however many workers map them, and opening the snapshot takes milliseconds.
+Memoryviews are used rather than NumPy arrays because Dijkstra reads one element at a
+time from Python, where NumPy scalars are slower; `GraphSnapshot.numpy` offers read-only
+NumPy views of the same memory when NumPy is installed.
+
+The snapshot is only used while its graph version matches `nav_edges_final`; otherwise
+the worker falls back to loading the graph from the database. The file is replaced
+atomically, and workers remap it after the next graph version change.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Dict, Optional
+
+from django.conf import settings
+
+from .routing import RoutingGraph, current_graph_version, on_graph_version_change
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - optional dependency
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'IMGRAPH1'
+_ALIGN = 64
+_SECTIONS = (
+    ('vertex_ids', 'q'), ('offsets', 'q'), ('targets', 'q'), ('costs', 'd'), ('edge_ids', 'q'),
+    ('xs', 'd'), ('ys', 'd'), ('room_ids', 'q'), ('room_vertices', 'q'),
+)
+_NUMPY_DTYPES = {'q': '<i8', 'd': '<f8'}
+
+
+class RoomVertexTable:
+    """Read-only room id -> vertex id lookup over two sorted, mapped arrays (dict-like `get`)."""
+
+    def __init__(self, room_ids, vertex_ids):
+        self.room_ids = room_ids
+        self.vertex_ids = vertex_ids
+
+    def __len__(self):
+        return len(self.room_ids)
+
+    def get(self, room_id: int, default=None):
+        i = bisect_left(self.room_ids, room_id)
+        if i < len(self.room_ids) and self.room_ids[i] == room_id:
+            return self.vertex_ids[i]
+        return default
+
+
+class GraphSnapshot:
+    """An opened snapshot: a `RoutingGraph` and room table backed by the mapped file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as fh:
+            self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError(f'{path} is not a routing graph snapshot')
+        (header_len,) = struct.unpack_from('<I', self._mmap, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.header = json.loads(self._mmap[start:start + header_len])
+        self.graph_version = self.header['graph_version']
+
+        buffer = memoryview(self._mmap)
+        self._sections = {}
+        for name, (typecode, offset, count) in self.header['sections'].items():
+            self._sections[name] = buffer[offset:offset + count * 8].cast(typecode)
+
+        s = self._sections
+        has_coords = self.header.get('has_coords', False)
+        self.graph = RoutingGraph(
+            s['vertex_ids'], s['offsets'], s['targets'], s['costs'], s['edge_ids'],
+            xs=s['xs'] if has_coords else None, ys=s['ys'] if has_coords else None, srid=self.header.get('srid'),
+        )
+        self.room_vertices = RoomVertexTable(s['room_ids'], s['room_vertices'])
+        # `room_points` data version the room table was built from (see spatial_index.py)
+        self.rooms_version = self.header.get('rooms_version')
+
+    def numpy(self, name: str):
+        """Read-only NumPy view of a section (None without NumPy)."""
+        if numpy is None:
+            return None
+        typecode, offset, count = self.header['sections'][name]
+        return numpy.frombuffer(self._mmap, dtype=_NUMPY_DTYPES[typecode], count=count, offset=offset)
+
+
+def write_graph_snapshot(path: str, graph: RoutingGraph, room_vertices: Dict[int, int], graph_version: str,
+                         rooms_version: Optional[int] = None) -> dict:
+    """Write `graph` and the room -> vertex table (built from `room_points` data version
+    `rooms_version`) to `path` and return the header.
+
+    Callers replacing a live snapshot write to a temporary file and `os.replace` it.
+    """
+    if sys.byteorder != 'little':  # pragma: no cover - every supported platform is little-endian
+        raise RuntimeError('Graph snapshots are written in little-endian byte order')
+    n = graph.vertex_count
+    has_coords = graph.xs is not None
+    rooms = sorted(room_vertices.items())
+    data = {
+        'vertex_ids': graph.vertex_ids,
+        'offsets': graph.offsets,
+        'targets': graph.targets,
+        'costs': graph.costs,
+        'edge_ids': graph.edge_ids,
+        'xs': graph.xs if has_coords else [],
+        'ys': graph.ys if has_coords else [],
+        'room_ids': [room for room, _ in rooms],
+        'room_vertices': [vertex for _, vertex in rooms],
+    }
+    arrays = {name: array(typecode, data[name]) for name, typecode in _SECTIONS}
+
+    def header_bytes(sections):
+        return json.dumps({
+            'graph_version': graph_version,
+            'srid': graph.srid,
+            'has_coords': has_coords,
+            'vertices': n,
+            'arcs': graph.arc_count,
+            'rooms': len(rooms),
+            'rooms_version': rooms_version,
+            'sections': sections,
+        }).encode('utf-8')
+
+    def layout(data_start):
+        sections, offset = {}, data_start
+        for name, typecode in _SECTIONS:
+            offset = -(-offset // _ALIGN) * _ALIGN
+            sections[name] = [typecode, offset, len(arrays[name])]
+            offset += len(arrays[name]) * 8
+        return sections
+
+    # Offsets depend on the header length and vice versa; settle it with generous padding
+    sections = layout(0)
+    header = header_bytes(sections)
+    data_start = -(-(len(MAGIC) + 4 + len(header) + 256) // _ALIGN) * _ALIGN
+    sections = layout(data_start)
+    header = header_bytes(sections)
+    assert len(MAGIC) + 4 + len(header) <= data_start
+
+    with open(path, 'wb') as fh:
+        fh.write(MAGIC + struct.pack('<I', len(header)) + header)
+        for name, _ in _SECTIONS:
+            fh.seek(sections[name][1])
+            arrays[name].tofile(fh)
+    return json.loads(header)
+
+
+def load_graph_snapshot(path: Optional[str]) -> Optional[GraphSnapshot]:
+    """Map the snapshot at `path`, or return None if there is none (or it is unreadable)."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        snapshot = GraphSnapshot(path)
+    except (OSError, ValueError, KeyError):
+        logger.warning('Could not map routing graph snapshot %s', path, exc_info=True)
+        return None
+    logger.info('Mapped routing graph snapshot %s (%d vertices, %d arcs, %d rooms)', path,
+                snapshot.graph.vertex_count, snapshot.graph.arc_count, len(snapshot.room_vertices))
+    return snapshot
+
+
+_snapshot_lock = threading.Lock()
+_snapshot: Optional[GraphSnapshot] = None
+
+
+def get_graph_snapshot() -> Optional[GraphSnapshot]:
+    """Return the mapped `ROUTING_GRAPH_SNAPSHOT` if it matches the current graph version.
+
+    Returns None when there is no snapshot or it is stale, and callers load from the DB.
+    """
+    global _snapshot
+    path = getattr(settings, 'ROUTING_GRAPH_SNAPSHOT', None)
+    if not path or not os.path.exists(path):
+        return None
+    # Outside the lock: a version change runs `_reset_graph_snapshot`
+    version = current_graph_version()
+    with _snapshot_lock:
+        snapshot = _snapshot
+        if snapshot is None or snapshot.path != path:
+            snapshot = load_graph_snapshot(path)
+            if snapshot is None:
+                return None
+            if snapshot.graph_version != version:
+                logger.warning('Routing graph snapshot %s is stale (graph version %s, snapshot %s); '
+                               'loading the graph from the database. Re-run build_graph_snapshot.',
+                               path, version, snapshot.graph_version)
+                return None
+            _snapshot = snapshot
+    return snapshot
+
+
+@on_graph_version_change
+def _reset_graph_snapshot(version):
+    global _snapshot
+    # Not closed: requests may still be routing on the old mapping; it is unmapped once unused
+    with _snapshot_lock:
+        _snapshot = None
@@ -0,0 +1,64 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from interactive_maps_backend_main import compression
+from interactive_maps_backend_main.compression import StreamCompressor, compress_bytes
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare bytes on the wire and CPU time of gzip/brotli levels on a base-floor SSE "
+        "stream (flushed per event, as StreamingCompressionMiddleware does) and on one large JSON body."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batches', type=int, default=10, help='SSE events in the stream')
+        parser.add_argument('--features', type=int, default=500, help='Features per event')
+        parser.add_argument('--points', type=int, default=40, help='Vertices per LineString')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        fid = 0
+        frames = []
+        for batch in range(1, options['batches'] + 1):
+            items = []
+            for _ in range(options['features']):
+                fid += 1
+                x, y = 39.2 + rng.random() / 100, -6.8 + rng.random() / 100
+                coords = [[round(x + i * 1e-5, 9), round(y + rng.random() * 1e-5, 9)] for i in range(options['points'])]
+                items.append({'ogc_fid': fid, 'layer': 'WALLS', 'paperspace': False, 'text': f'wall {fid}',
+                              'geometry': {'type': 'LineString', 'coordinates': coords}})
+            payload = {'batch': batch, 'fetched': fid, 'more_pending': True, 'cursor': None, 'items': items}
+            frames.append(f"data: {json.dumps(payload, separators=(',', ':'))}\n\n".encode('utf-8'))
+        body = frames[0][len(b'data: '):-2]
+        raw_stream = sum(len(f) for f in frames)
+
+        settings_levels = [('gzip', 'COMPRESSION_GZIP_LEVEL', level) for level in (1, 6, 9)]
+        if compression.brotli is not None:
+            settings_levels += [('br', 'COMPRESSION_BROTLI_QUALITY', q) for q in (1, 5, 9, 11)]
+        else:
+            self.stdout.write('brotli is not installed; only gzip is measured')
+
+        self.stdout.write(f"SSE stream: {len(frames)} events, {raw_stream / 1024:.0f} KiB raw; "
+                          f"JSON body: {len(body) / 1024:.0f} KiB raw")
+        self.stdout.write(f"{'encoding':14s} {'stream KiB':>10s} {'ratio':>6s} {'ms/event':>9s}   "
+                          f"{'body KiB':>8s} {'ratio':>6s} {'ms':>8s}")
+        for encoding, setting, level in settings_levels:
+            with override_settings(**{setting: level}):
+                started = time.process_time()
+                compressor = StreamCompressor(encoding)
+                wire = sum(len(compressor.compress(f)) for f in frames) + len(compressor.finish())
+                stream_ms = (time.process_time() - started) * 1000.0 / len(frames)
+
+                started = time.process_time()
+                compressed_body = compress_bytes(body, encoding)
+                body_ms = (time.process_time() - started) * 1000.0
+
+            self.stdout.write(
+                f"{encoding + ' ' + str(level):14s} {wire / 1024:10.0f} {raw_stream / wire:6.1f} {stream_ms:9.2f}   "
+                f"{len(compressed_body) / 1024:8.0f} {len(body) / len(compressed_body):6.1f} {body_ms:8.2f}"
+            )
@@ -0,0 +1,83 @@
+import json
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from interactive_maps_backend_main.serialization import dumps
+from interactive_maps_backend_main.views import _base_floor_query, _fetch_rows, _json_array
+
+
+def _legacy_frame(rows, batch_num, fetched, more_pending, cursor):
+    """How an SSE frame was built before items were serialized in SQL."""
+    for r in rows:
+        if r.get('geometry'):
+            r['geometry'] = json.loads(r['geometry'])
+    payload = {'batch': batch_num, 'fetched': fetched, 'more_pending': more_pending, 'cursor': cursor, 'items': rows}
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def _spliced_frame(rows, batch_num, fetched, more_pending, cursor):
+    """The current frame: metadata encoded in Python, items joined as pre-serialized text."""
+    meta = dumps({'batch': batch_num, 'fetched': fetched, 'more_pending': more_pending, 'cursor': cursor})
+    return b'data: ' + meta[:-1] + b',"items":' + _json_array(rows) + b'}\n\n'
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure worker CPU per SSE batch for base_floor: decoding ST_AsGeoJSON text and "
+        "re-encoding the batch in Python versus splicing items serialized by Postgres."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500, help='Rows per batch')
+        parser.add_argument('--points', type=int, default=40, help='Vertices per synthetic LineString')
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--db', action='store_true', help='Use the first batch of base_floor instead of synthetic rows')
+
+    def handle(self, *args, **options):
+        if options['db']:
+            legacy_rows, spliced_rows = self._db_rows(options['rows'])
+        else:
+            legacy_rows, spliced_rows = self._synthetic_rows(options['rows'], options['points'])
+
+        self.stdout.write(f"{len(legacy_rows)} rows per batch, {options['iterations']} iterations")
+        results = {}
+        for name, build, rows in (
+            ('decode + re-encode', _legacy_frame, legacy_rows),
+            ('splice SQL json', _spliced_frame, spliced_rows),
+        ):
+            timings = []
+            for _ in range(options['iterations']):
+                # The legacy path mutates its rows, so every iteration gets fresh copies
+                batch = [dict(r) for r in rows]
+                started = time.process_time()
+                frame = build(batch, 1, len(batch), True, 'WzUwMF0')
+                timings.append((time.process_time() - started) * 1000.0)
+            results[name] = statistics.median(timings)
+            self.stdout.write(f"{name:20s} median {results[name]:8.3f} ms CPU/batch   {len(frame)} bytes")
+
+        speedup = results['decode + re-encode'] / max(results['splice SQL json'], 1e-9)
+        self.stdout.write(self.style.SUCCESS(f"Splicing uses {speedup:.1f}x less CPU per batch"))
+
+    def _synthetic_rows(self, count, points):
+        rng = random.Random(0)
+        legacy, spliced = [], []
+        for fid in range(1, count + 1):
+            x, y = 39.2 + rng.random() / 100, -6.8 + rng.random() / 100
+            coords = [[x + i * 1e-5, y + rng.random() * 1e-5] for i in range(points)]
+            geometry = json.dumps({'type': 'LineString', 'coordinates': coords})
+            row = {'ogc_fid': fid, 'layer': 'WALLS', 'paperspace': False, 'text': f'wall {fid}'}
+            legacy.append(dict(row, geometry=geometry))
+            spliced.append({'ogc_fid': fid, 'item': json.dumps(dict(row, geometry=json.loads(geometry)))})
+        return legacy, spliced
+
+    def _db_rows(self, count):
+        legacy = _fetch_rows(
+            "SELECT ogc_fid, layer, paperspace, text, ST_AsGeoJSON(wkb_geometry) AS geometry "
+            "FROM base_floor ORDER BY ogc_fid LIMIT %s",
+            [count],
+        )
+        sql, params = _base_floor_query().page(limit=count)
+        return legacy, _fetch_rows(sql, params)
@@ -0,0 +1,68 @@
+import json
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import JSONRenderer
+
+from interactive_maps_backend_main import serialization
+from interactive_maps_backend_main.renderers import FastJSONRenderer
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure JSON encoding throughput on realistic LineString payloads (a base-floor SSE "
+        "batch and a long route) for the stdlib encoder, DRF's JSONRenderer and serialization.dumps."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--features', type=int, default=500, help='Features per batch')
+        parser.add_argument('--points', type=int, default=40, help='Vertices per feature LineString')
+        parser.add_argument('--route-points', type=int, default=5000, help='Vertices of the route LineString')
+        parser.add_argument('--iterations', type=int, default=50)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+
+        def line(n):
+            x, y = 39.2 + rng.random() / 100, -6.8 + rng.random() / 100
+            return {'type': 'LineString', 'coordinates': [[x + i * 1e-5, y + rng.random() * 1e-5] for i in range(n)]}
+
+        payloads = {
+            'base-floor batch': {
+                'batch': 1, 'fetched': options['features'], 'more_pending': True, 'cursor': 'WzUwMF0',
+                'items': [
+                    {'ogc_fid': i, 'layer': 'WALLS', 'paperspace': False, 'text': f'wall {i}', 'geometry': line(options['points'])}
+                    for i in range(options['features'])
+                ],
+            },
+            'route': {'distance_meters': 1234.5, 'route': line(options['route_points']), 'cache_id': 42},
+        }
+
+        drf = JSONRenderer()
+        fast = FastJSONRenderer()
+        encoders = [
+            ('json.dumps', lambda obj: json.dumps(obj).encode('utf-8')),
+            ('JsonResponse encoder', lambda obj: json.dumps(obj, cls=DjangoJSONEncoder).encode('utf-8')),
+            ('DRF JSONRenderer', lambda obj: drf.render(obj)),
+            (f'serialization.dumps ({serialization.BACKEND})', serialization.dumps),
+            ('FastJSONRenderer', lambda obj: fast.render(obj)),
+        ]
+
+        for payload_name, payload in payloads.items():
+            self.stdout.write(f"\n{payload_name}:")
+            baseline = None
+            for name, encode in encoders:
+                timings = []
+                for _ in range(options['iterations']):
+                    started = time.perf_counter()
+                    body = encode(payload)
+                    timings.append(time.perf_counter() - started)
+                median = statistics.median(timings)
+                baseline = baseline or median
+                mb_per_s = len(body) / median / 1e6
+                self.stdout.write(
+                    f"  {name:32s} {median * 1000:8.3f} ms  {mb_per_s:8.1f} MB/s  {baseline / median:5.1f}x"
+                )
@@ -0,0 +1,80 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from interactive_maps_backend_main.room_search import RoomSearchIndex, normalize, search_rooms_db
+
+
+BUILDINGS = ['Main', 'Science', 'Library', 'Admin', 'Engineering', 'Medical', 'Arts', 'Student Centre']
+KINDS = ['Lecture Hall', 'Lab', 'Office', 'Seminar Room', 'Toilet', 'Store', 'Computer Lab', 'Studio', 'Meeting Room']
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure /api/rooms/autocomplete/ search latency on a synthetic room dataset: the "
+        "in-memory prefix/trigram index vs a linear substring scan (what `text ILIKE '%q%' "
+        "ORDER BY text` does), and optionally the pg_trgm query on the real room_points table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=100_000, help='Synthetic rooms in the index')
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--budget-ms', type=float, default=50.0)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--db', action='store_true', help='Also time the pg_trgm query on room_points')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        names = [
+            f"{rng.choice(BUILDINGS)} {rng.choice(KINDS)} {rng.choice('ABCDEFG')}{rng.randint(1, 999)}"
+            for _ in range(options['rooms'])
+        ]
+
+        started = time.perf_counter()
+        index = RoomSearchIndex(range(len(names)), names)
+        self.stdout.write(f"Built index over {len(names)} rooms in {time.perf_counter() - started:.2f}s")
+
+        queries = []
+        for _ in range(options['queries']):
+            name = rng.choice(names)
+            kind = rng.random()
+            if kind < 0.5:
+                # Typing the start of a name or of one of its words
+                word_starts = [0] + [i + 1 for i, c in enumerate(name) if c == ' ']
+                start = rng.choice(word_starts)
+                queries.append(name[start:start + rng.randint(1, 10)])
+            else:
+                # A misspelling: two adjacent letters swapped
+                i = rng.randrange(len(name) - 1)
+                queries.append(name[:i] + name[i + 1] + name[i] + name[i + 2:])
+
+        normalized = [normalize(n) for n in names]
+
+        def linear_scan(q):
+            q = normalize(q)
+            return sorted(n for n in normalized if q in n)[:options['limit']]
+
+        engines = [
+            ('linear substring scan', linear_scan),
+            ('prefix/trigram index', lambda q: index.search(q, options['limit'], budget_ms=options['budget_ms'])),
+        ]
+        if options['db']:
+            engines.append(('pg_trgm (room_points)', lambda q: search_rooms_db(q, options['limit'], options['budget_ms'])))
+
+        for name, run in engines:
+            timings = []
+            truncated = 0
+            for q in queries:
+                started = time.perf_counter()
+                result = run(q)
+                timings.append((time.perf_counter() - started) * 1000.0)
+                truncated += bool(getattr(result, 'truncated', False))
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            line = f"{name:24s} median {statistics.median(timings):8.3f} ms   p95 {p95:8.3f} ms   max {timings[-1]:8.3f} ms"
+            if truncated:
+                line += f"   ({truncated} over budget)"
+            self.stdout.write(line)
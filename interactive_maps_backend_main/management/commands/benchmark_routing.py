@@ -0,0 +1,65 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from interactive_maps_backend_main.contraction import build_contraction_hierarchy, get_contraction_hierarchy
+from interactive_maps_backend_main.routing import fetch_graph_version, load_routing_graph
+from interactive_maps_backend_main.views import RouteAPIView
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare shortest-path query latency of the contraction hierarchy, in-process "
+        "Dijkstra/A* and pgr_dijkstra on random vertex pairs of nav_edges_final."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pairs', type=int, default=100, help='Number of random vertex pairs')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--skip-db', action='store_true', help='Do not benchmark pgr_dijkstra')
+
+    def handle(self, *args, **options):
+        graph = load_routing_graph()
+        ch = get_contraction_hierarchy()
+        graph_version = fetch_graph_version()
+        if ch is None or ch.graph_version != graph_version:
+            self.stdout.write('Saved contraction hierarchy is missing or stale; building one in memory...')
+            ch = build_contraction_hierarchy(graph, graph_version=graph_version)
+
+        rng = random.Random(options['seed'])
+        vertex_ids = list(graph.vertex_ids)
+        pairs = [tuple(rng.sample(vertex_ids, 2)) for _ in range(options['pairs'])]
+
+        engines = [
+            ('contraction hierarchy', lambda s, t: ch.shortest_path(s, t)),
+            ('in-process dijkstra', lambda s, t: graph.shortest_path(s, t)),
+            ('in-process a*', lambda s, t: graph.shortest_path(s, t, algorithm='astar')),
+        ]
+        if not options['skip_db']:
+            view = RouteAPIView()
+            engines.append(('pgr_dijkstra', lambda s, t: view._compute_route_edges(s, t)))
+
+        mismatches = 0
+        for s, t in pairs:
+            ref = graph.shortest_path(s, t)
+            got = ch.shortest_path(s, t)
+            if (got is None) != (ref is None) or (ref is not None and abs(got.cost - ref.cost) > 1e-6):
+                mismatches += 1
+
+        self.stdout.write(f"{len(pairs)} pairs on {graph.vertex_count} vertices / {graph.arc_count} arcs")
+        for name, run in engines:
+            timings = []
+            for s, t in pairs:
+                started = time.perf_counter()
+                run(s, t)
+                timings.append((time.perf_counter() - started) * 1000.0)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            self.stdout.write(f"{name:24s} median {statistics.median(timings):8.3f} ms   p95 {p95:8.3f} ms")
+
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f"{mismatches} pairs where the CH cost differs from Dijkstra"))
+        else:
+            self.stdout.write(self.style.SUCCESS('CH costs match Dijkstra on every pair'))
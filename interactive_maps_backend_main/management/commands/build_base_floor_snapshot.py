@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from interactive_maps_backend_main.snapshots import build_base_floor_snapshot, build_lock, snapshot_dir
+
+
+class Command(BaseCommand):
+    help = (
+        "Materialize base_floor as a versioned, pre-compressed GeoJSON snapshot in SNAPSHOT_DIR "
+        "(served by GET /api/base-floor/?snapshot=1). Re-run after every CAD re-import."
+    )
+
+    def handle(self, *args, **options):
+        # Waits for a rebuild a web worker may have started
+        with build_lock():
+            manifest = build_base_floor_snapshot(brotli_quality=11)
+        sizes = ', '.join(f"{enc} {size / 1024:.0f} KiB" for enc, size in manifest['sizes'].items())
+        self.stdout.write(self.style.SUCCESS(
+            f"Snapshot {manifest['version']}: {manifest['features']} features ({sizes}) in {snapshot_dir()}"
+        ))
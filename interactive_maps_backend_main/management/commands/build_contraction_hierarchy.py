@@ -0,0 +1,42 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from interactive_maps_backend_main.contraction import WITNESS_SETTLE_LIMIT, build_contraction_hierarchy
+from interactive_maps_backend_main.routing import fetch_graph_version, load_routing_graph
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the contraction hierarchy used by ROUTING_ENGINE='ch' from nav_edges_final "
+        "and save it to ROUTING_CH_PATH. Re-run after every load of the routing graph."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help='Output file (defaults to settings.ROUTING_CH_PATH)')
+        parser.add_argument('--witness-limit', type=int, default=WITNESS_SETTLE_LIMIT,
+                            help='Max vertices settled per witness search while contracting')
+
+    def handle(self, *args, **options):
+        output = options['output'] or settings.ROUTING_CH_PATH
+
+        started = time.perf_counter()
+        graph = load_routing_graph()
+        graph_version = fetch_graph_version()
+        self.stdout.write(f"Loaded graph: {graph.vertex_count} vertices, {graph.arc_count} arcs "
+                          f"(version {graph_version}) in {time.perf_counter() - started:.2f}s")
+
+        started = time.perf_counter()
+        ch = build_contraction_hierarchy(graph, graph_version=graph_version,
+                                         witness_settle_limit=options['witness_limit'])
+        self.stdout.write(f"Contracted {ch.vertex_count} vertices, added {ch.shortcut_count} shortcuts "
+                          f"in {time.perf_counter() - started:.2f}s")
+
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        # Write next to the target and rename so running workers never read a partial file
+        tmp_path = f"{output}.tmp"
+        ch.save(tmp_path)
+        os.replace(tmp_path, output)
+        self.stdout.write(self.style.SUCCESS(f"Saved contraction hierarchy to {output}"))
@@ -0,0 +1,44 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from interactive_maps_backend_main.graph_snapshot import load_graph_snapshot, write_graph_snapshot
+from interactive_maps_backend_main.routing import fetch_graph_version, load_routing_graph
+from interactive_maps_backend_main.spatial_index import build_vertex_snap_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the routing graph and the room -> vertex table to the memory-mapped snapshot "
+        "at ROUTING_GRAPH_SNAPSHOT, shared by every worker on the host. Re-run after every "
+        "load of the routing graph."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help='Output file (defaults to settings.ROUTING_GRAPH_SNAPSHOT)')
+
+    def handle(self, *args, **options):
+        output = options['output'] or settings.ROUTING_GRAPH_SNAPSHOT
+
+        started = time.perf_counter()
+        # Version first: edges changed during the load make the snapshot stale, not wrong
+        graph_version = fetch_graph_version()
+        graph = load_routing_graph()
+        snap_index = build_vertex_snap_index(use_snapshot=False)
+        self.stdout.write(f"Loaded graph: {graph.vertex_count} vertices, {graph.arc_count} arcs, "
+                          f"{len(snap_index.room_vertices)} rooms (version {graph_version}) "
+                          f"in {time.perf_counter() - started:.2f}s")
+
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        # Write next to the target and rename: workers keep their mapping of the old file
+        tmp_path = f"{output}.tmp"
+        write_graph_snapshot(tmp_path, graph, snap_index.room_vertices, graph_version,
+                             snap_index.rooms_version)
+        os.replace(tmp_path, output)
+
+        started = time.perf_counter()
+        load_graph_snapshot(output)
+        self.stdout.write(f"Mapped {os.path.getsize(output)} bytes in {(time.perf_counter() - started) * 1000:.1f} ms")
+        self.stdout.write(self.style.SUCCESS(f"Saved routing graph snapshot to {output}"))
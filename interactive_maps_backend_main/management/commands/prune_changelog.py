@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete data_changelog entries older than the retention period (docs/changelog.sql). "
+        "Clients last synced before the new horizon get 410 from /api/sync/ and reload. Run daily."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, default=getattr(settings, 'CHANGELOG_RETENTION_DAYS', 30),
+                            help='Days of changes to keep (defaults to settings.CHANGELOG_RETENTION_DAYS)')
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM data_changelog")
+            before = cursor.fetchone()[0]
+            cursor.execute("SELECT prune_data_changelog(make_interval(days => %s))", [options['keep_days']])
+            horizon = cursor.fetchone()[0]
+            cursor.execute("SELECT count(*) FROM data_changelog")
+            after = cursor.fetchone()[0]
+        self.stdout.write(self.style.SUCCESS(
+            f"Pruned {before - after} changelog entries ({after} kept); syncs from version {horizon} on still work"
+        ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from interactive_maps_backend_main.route_cache import prune_persistent
+from interactive_maps_backend_main.routing import fetch_graph_version
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete route_result rows computed for older versions of nav_edges_final (docs/routing.sql). "
+        "They are never served; run after each graph import, or daily."
+    )
+
+    def handle(self, *args, **options):
+        graph_version = fetch_graph_version()
+        deleted = prune_persistent(graph_version)
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} cached routes from older graph versions (current: {graph_version})"
+        ))
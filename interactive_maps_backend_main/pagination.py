@@ -0,0 +1,85 @@
+import base64
+import json
+from typing import List, Optional, Sequence, Tuple
+
+
+def encode_cursor(values: Sequence) -> str:
+    """Encode the sort key of the last row seen into an opaque, URL-safe token."""
+    raw = json.dumps(list(values), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: str, width: int) -> List:
+    """Decode a token produced by `encode_cursor`.
+
+    Raises ValueError if the token is malformed or does not carry `width` key values,
+    so views can answer with 400 instead of running a broken query.
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != width:
+        raise ValueError('Invalid cursor')
+    return values
+
+
+class KeysetQuery:
+    """Builds keyset (seek) pages for a single-table SELECT.
+
+    Instead of `LIMIT %s OFFSET %s`, every page is fetched with
+    `WHERE (k1, k2, ...) > (%s, %s, ...) ORDER BY k1, k2, ... LIMIT %s`, so Postgres
+    can start from the last seen key via the index and each page costs the same no
+    matter how deep into the table it is.
+
+    `key_columns` must be unique together (end with the primary key) and must be
+    part of the selected columns, because the next cursor is read from the last row.
+    `select_params` fill placeholders in `select_sql`; `params` fill those in `where`.
+    """
+
+    def __init__(self, select_sql: str, key_columns: Sequence[str],
+                 where: Optional[Sequence[str]] = None, params: Optional[Sequence] = None,
+                 select_params: Optional[Sequence] = None):
+        self.select_sql = select_sql.strip()
+        self.key_columns = list(key_columns)
+        self.where = list(where or [])
+        self.params = list(params or [])
+        self.select_params = list(select_params or [])
+
+    def page(self, after: Optional[Sequence] = None, limit: Optional[int] = None,
+             offset: Optional[int] = None) -> Tuple[str, List]:
+        """Return `(sql, params)` for the page that starts right after key `after`.
+
+        `offset` is only kept for the legacy `limit`/`offset` pagination mode; it is
+        ignored when `after` is given.
+        """
+        clauses = list(self.where)
+        params = self.select_params + self.params
+        if after is not None:
+            columns = ', '.join(self.key_columns)
+            placeholders = ', '.join(['%s'] * len(self.key_columns))
+            clauses.append(f"({columns}) > ({placeholders})")
+            params.extend(after)
+
+        sql = self.select_sql
+        if clauses:
+            sql += "\nWHERE " + " AND ".join(clauses)
+        sql += "\nORDER BY " + ', '.join(self.key_columns)
+        if limit is not None:
+            sql += "\nLIMIT %s"
+            params.append(limit)
+        if offset and after is None:
+            sql += " OFFSET %s"
+            params.append(offset)
+        return sql, params
+
+    def key_of(self, row: dict) -> List:
+        """Return the sort key of a fetched row (a dict as built by `_dictfetchall`)."""
+        return [row[c] for c in self.key_columns]
+
+    def cursor_after(self, row: dict) -> str:
+        return encode_cursor(self.key_of(row))
+
+    def decode(self, token: str) -> List:
+        return decode_cursor(token, len(self.key_columns))
@@ -0,0 +1,102 @@
+"""Bounded read-ahead for async batch sources (SSE streams).
+
+`_sse_batch_stream` used to alternate strictly between the database and the client: fetch
+a batch, send it, wait until the server has written it, then start the next query, so a
+stream took the sum of every batch's DB time and network time. `prefetch(batches, depth)`
+runs the source in a background task that fetches up to `depth` batches ahead while the
+consumer sends the current one. `merge(sources, max_in_flight)` does the same for several
+sources at once (`/api/layers/stream/`), interleaving their batches as they arrive.
+
+- Backpressure: a producer takes one of the shared slots before each fetch and the
+  consumer frees it when it takes the batch, so at most `depth` / `max_in_flight` batches
+  are fetched or being fetched beyond the one being sent, however slow the client.
+- Cancellation: when the consumer stops (client disconnect, `aclose()`), the producer tasks
+  are cancelled. Each source is closed inside its task, which runs its `finally` blocks
+  (server-side cursor closed, pooled connection returned), and the query it was running is
+  cancelled by `QueryCancellationMiddleware`.
+- Errors raised by a source are re-raised in the consumer, after the batches before them.
+
+Producer tasks copy the request's context, so `sync_to_async` calls keep using the
+request's thread (and Django connection) and queries stay tracked for cancellation.
+"""
+import asyncio
+from typing import AsyncIterator, Dict, Hashable, Tuple, TypeVar
+
+T = TypeVar('T')
+
+_DONE = object()
+
+
+class _Failed:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+async def _aclose(source):
+    aclose = getattr(source, 'aclose', None)
+    if aclose is not None:
+        await aclose()
+
+
+async def _produce(key: Hashable, source: AsyncIterator[T], queue: asyncio.Queue, slots: asyncio.Semaphore):
+    try:
+        while True:
+            await slots.acquire()
+            try:
+                item = await source.__anext__()
+            except StopAsyncIteration:
+                slots.release()
+                queue.put_nowait((key, _DONE))
+                return
+            queue.put_nowait((key, item))
+    except Exception as e:
+        queue.put_nowait((key, _Failed(e)))
+    finally:
+        await _aclose(source)
+
+
+async def merge(sources: Dict[Hashable, AsyncIterator[T]], max_in_flight: int = 1) -> AsyncIterator[Tuple[Hashable, T]]:
+    """Yield `(key, item)` from all `sources` concurrently, in arrival order (each source's
+    own items stay in order), with at most `max_in_flight` items fetched ahead in total."""
+    queue: asyncio.Queue = asyncio.Queue()
+    slots = asyncio.Semaphore(max(1, max_in_flight))
+    producers = [asyncio.create_task(_produce(key, source, queue, slots)) for key, source in sources.items()]
+    remaining = len(producers)
+    try:
+        while remaining:
+            key, item = await queue.get()
+            if item is _DONE:
+                remaining -= 1
+                continue
+            if isinstance(item, _Failed):
+                raise item.error
+            # Let a producer start its next fetch while this item is being sent
+            slots.release()
+            yield key, item
+    finally:
+        for producer in producers:
+            producer.cancel()
+        # Wait for the sources to be closed; raises only if this task itself is cancelled
+        if producers:
+            await asyncio.wait(producers)
+
+
+async def prefetch(source: AsyncIterator[T], depth: int = 1) -> AsyncIterator[T]:
+    """Re-yield `source`, fetching up to `depth` items ahead in a background task.
+
+    `depth` < 1 iterates `source` directly, one item at a time.
+    """
+    if depth < 1:
+        try:
+            async for item in source:
+                yield item
+        finally:
+            await _aclose(source)
+        return
+
+    merged = merge({None: source}, depth)
+    try:
+        async for _, item in merged:
+            yield item
+    finally:
+        await merged.aclose()
@@ -0,0 +1,35 @@
+from rest_framework.renderers import BaseRenderer
+
+from .binary_geometry import PROTOBUF_CONTENT_TYPE, coordinate_precision, encode_document
+from .serialization import JSON_CONTENT_TYPE, dumps
+
+
+class FastJSONRenderer(BaseRenderer):
+    """DRF renderer writing bytes from `serialization.dumps` (orjson/msgspec when available).
+
+    Drop-in replacement for `rest_framework.renderers.JSONRenderer`; output is compact.
+    """
+    media_type = JSON_CONTENT_TYPE
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return dumps(data)
+
+
+class ProtobufRenderer(BaseRenderer):
+    """DRF renderer for `Accept: application/x-protobuf` (see binary_geometry.py).
+
+    Renders the response data (a route, or an error's `detail`) as one batch of features,
+    with coordinates quantized to `BINARY_GEOMETRY_PRECISION`.
+    """
+    media_type = PROTOBUF_CONTENT_TYPE
+    format = 'protobuf'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return encode_document(data, coordinate_precision())
@@ -0,0 +1,170 @@
+"""Per-worker, in-memory catalog of `room_points`.
+
+`room_points` is small and only changes when rooms are re-imported, yet every
+`/api/rooms/` page, every autocomplete index build and every room-to-vertex fallback in
+routing queried it. `RoomCatalog` holds the whole table in compact arrays, in the
+`(text, ogc_fid)` order Postgres sorts it in, with each room's JSON item already
+serialized to bytes in both shapes the rooms endpoint emits:
+
+- `/api/rooms/` (both modes) filters (`q`, `bbox`), pages (keyset cursors stay
+  compatible with the SQL path) and joins the prebuilt bytes, without a query;
+- `room_search.build_room_search_index` takes ids and names from it;
+- `RouteAPIView` validates room ids and snaps rooms missing from the snap index.
+
+The catalog is built at worker startup (`warmup.py`) and rebuilt when the `room_points`
+data version changes: right away via `LISTEN data_version` (see versioning.py), otherwise
+at the next request after `DATA_VERSION_TTL`. Requests keep using the previous catalog
+while a rebuild runs. `ROOM_CATALOG=0` sends everything back to SQL.
+"""
+import logging
+import math
+import threading
+import time
+from array import array
+from itertools import islice
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from django.db import connection
+
+from .serialization import dumps
+from .spatial_filters import BBox, geojson_precision
+from .versioning import get_data_version, on_data_version_change
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'room_points'
+
+
+class RoomCatalog:
+    """All rooms, sorted by `(text, ogc_fid)`, with prebuilt JSON items."""
+
+    def __init__(self, rows: Sequence[Tuple[int, Optional[str], Optional[float], Optional[float], Optional[str]]],
+                 version: Optional[int] = None):
+        """`rows` are `(ogc_fid, text, lon, lat, location GeoJSON)` in `(text, ogc_fid)` order."""
+        self.version = version
+        self.ids = array('q', (int(r[0]) for r in rows))
+        self.names = [r[1] for r in rows]
+        self.lons = array('d', (r[2] if r[2] is not None else float('nan') for r in rows))
+        self.lats = array('d', (r[3] if r[3] is not None else float('nan') for r in rows))
+        self._lower = [name.lower() if name is not None else None for name in self.names]
+        self._positions = {room_id: pos for pos, room_id in enumerate(self.ids)}
+        self._items = []
+        self._api_items = []
+        for room_id, name, _, _, location in rows:
+            room_id, name = dumps(int(room_id)), dumps(name)
+            location = (location or 'null').encode('utf-8')
+            self._items.append(b'{"ogc_fid":' + room_id + b',"text":' + name + b',"location":' + location + b'}')
+            self._api_items.append(b'{"id":' + room_id + b',"name":' + name + b',"location":' + location + b'}')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, room_id: int) -> bool:
+        return room_id in self._positions
+
+    def lonlat(self, room_id: int) -> Optional[Tuple[float, float]]:
+        pos = self._positions.get(room_id)
+        if pos is None or math.isnan(self.lons[pos]):
+            return None
+        return self.lons[pos], self.lats[pos]
+
+    def start_after(self, after: Optional[Sequence]) -> Optional[int]:
+        """Position following keyset cursor `after` (`[text, ogc_fid]`), or None if that room is gone."""
+        if after is None:
+            return 0
+        pos = self._positions.get(after[1])
+        if pos is None or self.names[pos] != after[0]:
+            return None
+        return pos + 1
+
+    def _matches(self, pos: int, q: str, bbox: Optional[BBox]) -> bool:
+        if q and (self._lower[pos] is None or q not in self._lower[pos]):
+            return False
+        if bbox is not None:
+            minx, miny, maxx, maxy = bbox
+            if not (minx <= self.lons[pos] <= maxx and miny <= self.lats[pos] <= maxy):
+                return False
+        return True
+
+    def _item(self, pos: int, zoom: Optional[int], api_keys: bool) -> bytes:
+        if zoom is None:
+            return self._api_items[pos] if api_keys else self._items[pos]
+        # Same rounding as ST_AsGeoJSON(geom, digits)
+        digits = geojson_precision(zoom)
+        location = {'type': 'Point', 'coordinates': [round(self.lons[pos], digits), round(self.lats[pos], digits)]}
+        id_key, name_key = ('id', 'name') if api_keys else ('ogc_fid', 'text')
+        return dumps({id_key: self.ids[pos], name_key: self.names[pos], 'location': location})
+
+    def rows(self, q: str = '', bbox: Optional[BBox] = None, zoom: Optional[int] = None, start: int = 0,
+             api_keys: bool = False) -> Iterator[dict]:
+        """Rows from position `start` on, shaped like `_rooms_query`'s (`ogc_fid`, `text`, `item`).
+
+        `q` is matched like `text ILIKE '%q%'`.
+        """
+        q = q.lower()
+        for pos in range(start, len(self.ids)):
+            if self._matches(pos, q, bbox):
+                yield {'ogc_fid': self.ids[pos], 'text': self.names[pos],
+                       'item': self._item(pos, zoom, api_keys)}
+
+    def page(self, q: str, bbox: Optional[BBox], zoom: Optional[int], after: Optional[Sequence], limit: int,
+             offset: int = 0, api_keys: bool = False) -> Optional[List[dict]]:
+        """One page like `KeysetQuery.page` (`offset` is ignored with `after`); None if the
+        room of cursor `after` no longer exists, so the caller can fall back to SQL."""
+        start = self.start_after(after)
+        if start is None:
+            return None
+        skip = 0 if after is not None else offset
+        return list(islice(self.rows(q, bbox, zoom, start, api_keys), skip, skip + limit))
+
+
+def build_room_catalog() -> RoomCatalog:
+    data_version = get_data_version(TABLE)
+    started = time.perf_counter()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT ogc_fid, text,
+                -- lon/lat only where the stored SRID says so (SRID 0 rows are in the vertex CRS)
+                CASE WHEN ST_SRID(wkb_geometry) = 4326 THEN ST_X(wkb_geometry) END,
+                CASE WHEN ST_SRID(wkb_geometry) = 4326 THEN ST_Y(wkb_geometry) END,
+                ST_AsGeoJSON(wkb_geometry)
+            FROM room_points
+            ORDER BY text, ogc_fid
+            """
+        )
+        rows = cursor.fetchall()
+    catalog = RoomCatalog(rows, data_version.version if data_version else None)
+    logger.info('Built room catalog: %d rooms in %.2fs', len(catalog), time.perf_counter() - started)
+    return catalog
+
+
+_catalog_lock = threading.Lock()
+_catalog: Optional[RoomCatalog] = None
+
+
+def get_room_catalog() -> RoomCatalog:
+    """Return the worker-wide catalog, rebuilding it when `room_points` has a new data version."""
+    global _catalog
+    catalog = _catalog
+    if catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = build_room_catalog()
+            return _catalog
+    data_version = get_data_version(TABLE)
+    if data_version is not None and catalog.version != data_version.version and _catalog_lock.acquire(blocking=False):
+        try:
+            if _catalog is catalog:
+                _catalog = build_room_catalog()
+        finally:
+            _catalog_lock.release()
+    return _catalog
+
+
+@on_data_version_change
+def _rebuild_room_catalog(table, data_version):
+    # Only refresh a catalog this worker actually uses; the listener thread pays for the rebuild
+    if table == TABLE and _catalog is not None:
+        get_room_catalog()
+
@@ -0,0 +1,298 @@
+"""Room-name autocomplete: an in-memory prefix + trigram index over `room_points.text`.
+
+`/api/rooms/?q=` filters with `text ILIKE '%q%' ORDER BY text`, which no btree index can
+serve, so every keystroke in the search box scans the table. `GET /api/rooms/autocomplete/`
+answers from `RoomSearchIndex` instead, built once per worker:
+
+- Prefix matches: normalized names, and their suffixes starting at every later word, are
+  kept in sorted lists, so "lab" finds "Lab 204" and "Computer Lab 2" with two `bisect`s.
+- Fuzzy matches, when prefixes don't fill the page: each query word is matched against the
+  (small) vocabulary of distinct words, by prefix or by trigram similarity, and the rooms
+  containing a match for every query word are scored with pg_trgm's `similarity()` on the
+  whole name. Trigrams are extracted the way pg_trgm does (each word padded with two
+  spaces in front and one behind), and only the rarest trigram posting lists are scanned
+  (a word that reaches `ROOM_SEARCH_MIN_SIMILARITY` must be in at least one of them).
+
+Results are ranked exact name > name prefix > word prefix > similarity (the `score` of a
+fuzzy match is its similarity, prefix classes score 1-3), then shorter names first. The
+search stops at `ROOM_SEARCH_BUDGET_MS` and returns the best results found so far
+(`truncated: true`).
+
+Names come from the room catalog (room_catalog.py) when it is enabled. The index is
+rebuilt when the `room_points` data version changes (see versioning.py);
+requests keep using the previous index while a rebuild is running. With
+`ROOM_SEARCH_INDEX` off, `search_rooms_db` uses the pg_trgm GIN index from
+docs/room_search.sql with a `statement_timeout` of the same budget.
+`manage.py benchmark_room_search` measures both on a synthetic 100k-room dataset.
+"""
+import bisect
+import heapq
+import logging
+import math
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+
+from .room_catalog import get_room_catalog
+from .versioning import get_data_version, on_data_version_change
+
+logger = logging.getLogger(__name__)
+
+# Match classes, best first
+EXACT, NAME_PREFIX, WORD_PREFIX, SIMILAR = 3, 2, 1, 0
+
+_WORD = re.compile(r'\w+')
+# Budget is checked every this many candidates
+_CHECK_EVERY = 256
+# Prefix matches considered per result slot and prefix list
+_PREFIX_SCAN = 20
+
+
+def normalize(text: str) -> str:
+    """Casefold, strip accents and collapse whitespace."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.casefold().split())
+
+
+def trigrams(normalized: str) -> set:
+    """pg_trgm's trigrams of an already normalized string."""
+    grams = set()
+    for word in _WORD.findall(normalized):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+
+class Match(NamedTuple):
+    id: int
+    name: str
+    score: float
+
+
+class SearchResult(NamedTuple):
+    matches: List[Match]
+    truncated: bool
+
+
+class RoomSearchIndex:
+    """Prefix and trigram index over room names (see module docstring)."""
+
+    def __init__(self, ids: Sequence[int], names: Sequence[str], version: Optional[int] = None):
+        self.ids = list(ids)
+        self.names = list(names)
+        self.version = version
+        self._normalized = [normalize(name) for name in self.names]
+
+        # Whole names and the suffixes starting at every later word, each sorted for bisect
+        names_sorted, words_sorted = [], []
+        vocabulary: Dict[str, list] = {}
+        for i, norm in enumerate(self._normalized):
+            names_sorted.append((norm, i))
+            for n, m in enumerate(_WORD.finditer(norm)):
+                if n:
+                    words_sorted.append((norm[m.start():], i))
+                rooms = vocabulary.setdefault(m.group(), [])
+                if not rooms or rooms[-1] != i:
+                    rooms.append(i)
+        names_sorted.sort()
+        words_sorted.sort()
+        self._name_keys = [k for k, _ in names_sorted]
+        self._name_rooms = array('I', (i for _, i in names_sorted))
+        self._word_keys = [k for k, _ in words_sorted]
+        self._word_key_rooms = array('I', (i for _, i in words_sorted))
+
+        # Distinct words, the rooms containing each, and trigram -> word posting lists
+        self._words = sorted(vocabulary)
+        self._word_rooms = [array('I', vocabulary[w]) for w in self._words]
+        self._word_grams = [trigrams(w) for w in self._words]
+        postings: Dict[str, list] = {}
+        for w, grams in enumerate(self._word_grams):
+            for gram in grams:
+                postings.setdefault(gram, []).append(w)
+        self._postings = {gram: array('I', words) for gram, words in postings.items()}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _prefix_range(self, keys: List[str], prefix: str):
+        return bisect.bisect_left(keys, prefix), bisect.bisect_left(keys, prefix + '\U0010ffff')
+
+    def _similar_words(self, word: str, min_similarity: float) -> List[int]:
+        """Vocabulary words starting with `word` or trigram-similar to it."""
+        lo, hi = self._prefix_range(self._words, word)
+        found = set(range(lo, hi))
+        grams = trigrams(word)
+        if grams:
+            # A word with similarity >= t shares at least `needed` trigrams with `word`, so it
+            # appears in one of the `len - needed + 1` rarest posting lists
+            lists = sorted((self._postings.get(g, ()) for g in grams), key=len)
+            needed = max(1, math.ceil(min_similarity * len(grams)))
+            for words in lists[:len(lists) - needed + 1]:
+                for w in words:
+                    if w not in found and similarity(grams, self._word_grams[w]) >= min_similarity:
+                        found.add(w)
+        return list(found)
+
+    def search(self, query: str, limit: int = 10, budget_ms: Optional[float] = None,
+               min_similarity: Optional[float] = None) -> SearchResult:
+        """Top `limit` rooms for `query`, computed within `budget_ms` (best effort)."""
+        q = normalize(query)
+        if not q or limit <= 0:
+            return SearchResult([], False)
+        if budget_ms is None:
+            budget_ms = getattr(settings, 'ROOM_SEARCH_BUDGET_MS', 50)
+        if min_similarity is None:
+            min_similarity = getattr(settings, 'ROOM_SEARCH_MIN_SIMILARITY', 0.3)
+        deadline = time.perf_counter() + budget_ms / 1000.0
+        q_grams = trigrams(q)
+        found: Dict[int, tuple] = {}
+        truncated = False
+
+        # Prefix matches, in alphabetical order (so shorter completions of a stem come
+        # first); a very common prefix only looks at the first `_PREFIX_SCAN` per list
+        cap = limit * _PREFIX_SCAN
+        for keys, rooms in ((self._name_keys, self._name_rooms), (self._word_keys, self._word_key_rooms)):
+            lo, hi = self._prefix_range(keys, q)
+            for pos in range(lo, min(hi, lo + cap)):
+                i = rooms[pos]
+                if i not in found:
+                    norm = self._normalized[i]
+                    kind = EXACT if norm == q else NAME_PREFIX if keys is self._name_keys else WORD_PREFIX
+                    found[i] = (kind, -len(norm))
+
+        # Fuzzy matches, only needed if the prefix matches don't fill the page: rooms that
+        # contain, for every query word, a word it prefixes or that is trigram-similar to it
+        if len(found) < limit and q_grams:
+            candidates = None
+            for word in sorted(set(_WORD.findall(q)), key=len, reverse=True):
+                rooms = set()
+                for w in self._similar_words(word, min_similarity):
+                    rooms.update(self._word_rooms[w])
+                candidates = rooms if candidates is None else candidates & rooms
+                if not candidates:
+                    break
+            for n, i in enumerate(candidates or ()):
+                if n % _CHECK_EVERY == 0 and n and time.perf_counter() > deadline:
+                    truncated = True
+                    break
+                if i not in found:
+                    score = similarity(q_grams, trigrams(self._normalized[i]))
+                    if score >= min_similarity:
+                        found[i] = (SIMILAR + score, -len(self._normalized[i]))
+
+        # nlargest is stable: equal ranks keep alphabetical / discovery order
+        best = heapq.nlargest(limit, found.items(), key=lambda item: item[1])
+        matches = [Match(self.ids[i], self.names[i], round(float(rank), 4)) for i, (rank, _) in best]
+        return SearchResult(matches, truncated)
+
+
+def build_room_search_index() -> RoomSearchIndex:
+    if getattr(settings, 'ROOM_CATALOG', True):
+        # Same data, no extra query
+        catalog = get_room_catalog()
+        rows = [(room_id, name) for room_id, name in zip(catalog.ids, catalog.names) if name]
+        version = catalog.version
+    else:
+        data_version = get_data_version('room_points')
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT ogc_fid, text FROM room_points WHERE text IS NOT NULL AND text <> ''")
+            rows = cursor.fetchall()
+        version = data_version.version if data_version else None
+    started = time.perf_counter()
+    index = RoomSearchIndex([int(r[0]) for r in rows], [r[1] for r in rows], version)
+    logger.info('Built room search index: %d rooms in %.2fs', len(index), time.perf_counter() - started)
+    return index
+
+
+_index_lock = threading.Lock()
+_index: Optional[RoomSearchIndex] = None
+
+
+def get_room_search_index() -> RoomSearchIndex:
+    """Return the worker-wide index, rebuilding it when `room_points` has a new data version.
+
+    While one thread rebuilds, others keep answering from the previous index.
+    """
+    global _index
+    index = _index
+    data_version = get_data_version('room_points')
+    stale = index is not None and data_version is not None and index.version != data_version.version
+    if index is None:
+        with _index_lock:
+            if _index is None:
+                _index = build_room_search_index()
+            return _index
+    if stale and _index_lock.acquire(blocking=False):
+        try:
+            if _index is index:
+                _index = build_room_search_index()
+        finally:
+            _index_lock.release()
+    return _index
+
+
+@on_data_version_change
+def _rebuild_room_search_index(table, data_version):
+    if table == 'room_points' and _index is not None:
+        get_room_search_index()
+
+
+def _query_canceled(error: OperationalError) -> bool:
+    cause = error.__cause__
+    # SQLSTATE 57014 query_canceled (psycopg2: pgcode, psycopg 3: sqlstate)
+    return (getattr(cause, 'pgcode', None) or getattr(cause, 'sqlstate', None)) == '57014'
+
+
+def search_rooms_db(query: str, limit: int = 10, budget_ms: Optional[float] = None) -> SearchResult:
+    """pg_trgm fallback for `RoomSearchIndex.search` with the same scores (word starts are
+    detected at spaces only, and every prefix match is ranked).
+
+    A statement that exceeds the budget is cancelled by Postgres (`statement_timeout`) and
+    yields an empty, truncated result.
+    """
+    if not query.strip() or limit <= 0:
+        return SearchResult([], False)
+    if budget_ms is None:
+        budget_ms = getattr(settings, 'ROOM_SEARCH_BUDGET_MS', 50)
+    pattern = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    sql = """
+        SELECT ogc_fid, text,
+            CASE
+                WHEN lower(text) = lower(%s) THEN 3
+                WHEN text ILIKE %s THEN 2
+                WHEN (' ' || text) ILIKE %s THEN 1
+                ELSE similarity(text, %s)
+            END AS score
+        FROM room_points
+        WHERE text %% %s OR text ILIKE %s
+        ORDER BY score DESC, length(text), ogc_fid
+        LIMIT %s
+    """
+    params = [query, pattern + '%', '% ' + pattern + '%', query, query, '%' + pattern + '%', limit]
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Both settings end with the transaction
+            cursor.execute("SELECT set_config('statement_timeout', %s, true), "
+                           "set_config('pg_trgm.similarity_threshold', %s, true)",
+                           [str(max(1, int(budget_ms))), str(getattr(settings, 'ROOM_SEARCH_MIN_SIMILARITY', 0.3))])
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+    except OperationalError as e:
+        if _query_canceled(e):
+            return SearchResult([], True)
+        raise
+    return SearchResult([Match(int(r[0]), r[1], round(float(r[2]), 4)) for r in rows], False)
@@ -0,0 +1,147 @@
+"""Two-tier cache for computed routes.
+
+Lookups go through a bounded in-process LRU first, then the persistent `route_result`
+table (shared by all workers), and only then does `RouteAPIView` compute the route.
+New results are written through to both tiers. Keys are
+`(start_room_id, end_room_id, simplify_tolerance, graph_version)`, so entries computed
+for an older graph can never be served; when the graph version changes the LRU is
+cleared. Stale `route_result` rows are only unreachable, not deleted on the request path:
+`manage.py prune_route_cache` (`prune_persistent`) removes them.
+
+See docs/routing.sql for the `route_result` table definition.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from django.conf import settings
+from django.db import DatabaseError, ProgrammingError, connection
+
+from .routing import on_graph_version_change
+from .serialization import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+
+class RouteLRUCache:
+    """Thread-safe, size-bounded LRU mapping route keys to response payloads."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+route_lru = RouteLRUCache(getattr(settings, 'ROUTE_CACHE_SIZE', 1024))
+
+# Flipped off for the rest of the process if `route_result` is missing or has an old layout
+_persistent_enabled = True
+
+
+def _persistent_tier_available() -> bool:
+    return _persistent_enabled and getattr(settings, 'ROUTE_CACHE_PERSISTENT', True)
+
+
+def _disable_persistent_tier(exc):
+    global _persistent_enabled
+    _persistent_enabled = False
+    logger.warning('Disabling persistent route cache; route_result is unusable (%s). '
+                   'Create it with the SQL in docs/routing.sql.', exc)
+
+
+def lookup_persistent(start_room_id: int, end_room_id: int, simplify_tolerance: float,
+                      graph_version: str) -> Optional[dict]:
+    """Return `{cache_id, distance_meters, route}` from `route_result`, or None on a miss."""
+    if not _persistent_tier_available():
+        return None
+    sql = """
+        SELECT id, distance_meters, ST_AsGeoJSON(the_geom) AS geojson
+        FROM route_result
+        WHERE start_room_id = %s AND end_room_id = %s AND simplify_tolerance = %s AND graph_version = %s
+        LIMIT 1
+    """
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [start_room_id, end_room_id, simplify_tolerance, graph_version])
+            row = cursor.fetchone()
+    except ProgrammingError as e:
+        _disable_persistent_tier(e)
+        return None
+    except DatabaseError:
+        logger.warning('route_result lookup failed', exc_info=True)
+        return None
+
+    if not row or row[2] is None:
+        return None
+    return {'cache_id': int(row[0]), 'distance_meters': float(row[1] or 0.0), 'route': loads(row[2])}
+
+
+def store_persistent(start_room_id: int, end_room_id: int, simplify_tolerance: float, graph_version: str,
+                     distance_meters: float, route_geojson: dict) -> Optional[int]:
+    """Write a computed route to `route_result` and return its id (None if the tier is unavailable)."""
+    if not _persistent_tier_available():
+        return None
+    # DO UPDATE (instead of DO NOTHING) so RETURNING yields the id when another worker won the race
+    sql = """
+        INSERT INTO route_result (start_room_id, end_room_id, simplify_tolerance, graph_version, distance_meters, the_geom)
+        VALUES (%s, %s, %s, %s, %s, ST_GeomFromGeoJSON(%s))
+        ON CONFLICT (start_room_id, end_room_id, simplify_tolerance, graph_version)
+        DO UPDATE SET distance_meters = EXCLUDED.distance_meters
+        RETURNING id
+    """
+    params = [start_room_id, end_room_id, simplify_tolerance, graph_version, distance_meters,
+              dumps(route_geojson).decode('utf-8')]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return int(cursor.fetchone()[0])
+    except ProgrammingError as e:
+        _disable_persistent_tier(e)
+    except DatabaseError:
+        logger.warning('route_result write-through failed', exc_info=True)
+    return None
+
+
+def prune_persistent(graph_version: str) -> int:
+    """Delete the `route_result` rows of graph versions other than `graph_version`; return how many."""
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM route_result WHERE graph_version IS DISTINCT FROM %s", [graph_version])
+        return cursor.rowcount
+
+
+@on_graph_version_change
+def _invalidate(version):
+    route_lru.clear()
@@ -0,0 +1,463 @@
+"""In-process routing over `nav_edges_final`.
+
+`pgr_dijkstra` rebuilds its graph from `SELECT ... FROM nav_edges_final` on every call.
+This module loads the edge table once per worker into a compact CSR (compressed sparse
+row) adjacency structure backed by `array` buffers and answers shortest-path queries in
+process. The database is then only needed to snap rooms to vertices and to assemble the
+route geometry from the returned edge ids.
+"""
+import heapq
+import logging
+import math
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, NamedTuple, Optional
+
+from django.conf import settings
+from django.db import connection
+
+from .versioning import DataVersion, get_data_version, last_modified_for, on_data_version_change
+
+logger = logging.getLogger(__name__)
+
+_schema_lock = threading.Lock()
+_nav_edges_schema = None
+
+
+def detect_nav_edges_final_schema():
+    """Detect and cache column names for nav_edges_final table.
+
+    Returns a dict: {id_col, source_col, target_col, cost_col, geom_col}
+    Raises RuntimeError with helpful message if required columns are missing.
+    The result is cached for the lifetime of the process.
+    """
+    global _nav_edges_schema
+    if _nav_edges_schema is not None:
+        return _nav_edges_schema
+
+    with _schema_lock:
+        if _nav_edges_schema is not None:
+            return _nav_edges_schema
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT column_name FROM information_schema.columns WHERE table_name = %s",
+                ['nav_edges_final'],
+            )
+            cols = {row[0] for row in cursor.fetchall()}
+
+        # Candidate names
+        id_candidates = ['ogc_fid', 'gid', 'id', 'edge_id']
+        source_candidates = ['source', 'start_vid', 'u', 'from_id', 'from']
+        target_candidates = ['target', 'end_vid', 'v', 'to_id', 'to']
+        cost_candidates = ['cost', 'length', 'distance', 'weight']
+        geom_candidates = ['wkb_geometry', 'geom', 'the_geom', 'geometry']
+
+        def pick(cands):
+            for c in cands:
+                if c in cols:
+                    return c
+            return None
+
+        id_col = pick(id_candidates)
+        source_col = pick(source_candidates)
+        target_col = pick(target_candidates)
+        cost_col = pick(cost_candidates)
+        geom_col = pick(geom_candidates)
+
+        missing = []
+        if id_col is None:
+            missing.append('id column (e.g. ogc_fid, id, gid)')
+        if source_col is None or target_col is None:
+            missing.append('source/target columns (e.g. source, target)')
+        if cost_col is None:
+            missing.append('cost column (e.g. cost, length)')
+        if geom_col is None:
+            missing.append('geometry column (e.g. wkb_geometry, geom)')
+
+        if missing:
+            raise RuntimeError(
+                'nav_edges_final is missing required columns: ' + ', '.join(missing) +
+                ". Columns found: " + ','.join(sorted(cols))
+            )
+
+        _nav_edges_schema = {
+            'id_col': id_col,
+            'source_col': source_col,
+            'target_col': target_col,
+            'cost_col': cost_col,
+            'geom_col': geom_col,
+        }
+        logger.debug('Detected nav_edges_final schema: %s', _nav_edges_schema)
+        return _nav_edges_schema
+
+
+GRAPH_TABLE = 'nav_edges_final'
+
+
+def fingerprint_graph() -> str:
+    """Return a fingerprint (md5) of the routable content of `nav_edges_final`.
+
+    Changes whenever an edge is added, removed, re-wired or re-costed. It scans the whole
+    table, so it is only used when the table has no data version trigger.
+    """
+    schema = detect_nav_edges_final_schema()
+    columns = ', '.join(schema[k] for k in ('id_col', 'source_col', 'target_col', 'cost_col'))
+    sql = (
+        f"SELECT md5(coalesce(string_agg(concat_ws(':', {columns}), ',' ORDER BY {schema['id_col']}), '')) "
+        "FROM nav_edges_final"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+        return cursor.fetchone()[0]
+
+
+def _from_data_version(data_version: DataVersion) -> str:
+    # The counter restarts if `data_version` is recreated; its timestamp does not repeat
+    return f'{data_version.version}.{last_modified_for(data_version)}'
+
+
+def fetch_graph_version() -> str:
+    """Return the version of the routing graph in `nav_edges_final`.
+
+    It is stored next to anything derived from the graph to detect that it is stale. With
+    the trigger from docs/data_version.sql on `nav_edges_final` it is the table's data
+    version, which workers already cache (versioning.py); otherwise `fingerprint_graph`.
+    """
+    data_version = get_data_version(GRAPH_TABLE)
+    if data_version is not None:
+        return _from_data_version(data_version)
+    return fingerprint_graph()
+
+
+_version_lock = threading.Lock()
+_graph_version = None
+_graph_version_checked_at = 0.0
+_graph_version_listeners = []
+
+
+def on_graph_version_change(listener):
+    """Register `listener(new_version)` to run when `current_graph_version` sees a new version."""
+    _graph_version_listeners.append(listener)
+    return listener
+
+
+def _store_graph_version(version: str) -> bool:
+    """Record `version` (caller holds `_version_lock`); return whether it changed."""
+    global _graph_version, _graph_version_checked_at
+    changed = _graph_version is not None and version != _graph_version
+    _graph_version = version
+    _graph_version_checked_at = time.monotonic()
+    return changed
+
+
+def current_graph_version() -> str:
+    """Return the graph version.
+
+    The `nav_edges_final` data version is read on every call (it is cached by versioning.py
+    and costs no query). Without it, the table is re-fingerprinted at most every
+    `ROUTING_GRAPH_VERSION_TTL` seconds. When the version changes, the worker-wide routing
+    graph is dropped (and reloaded on next use) and every listener registered with
+    `on_graph_version_change` is notified.
+    """
+    global _graph
+    data_version = get_data_version(GRAPH_TABLE)
+    if data_version is not None:
+        version = _from_data_version(data_version)
+        if version == _graph_version:
+            return version
+        with _version_lock:
+            changed = _store_graph_version(version)
+    else:
+        ttl = getattr(settings, 'ROUTING_GRAPH_VERSION_TTL', 30)
+        if _graph_version is not None and time.monotonic() - _graph_version_checked_at < ttl:
+            return _graph_version
+
+        with _version_lock:
+            if _graph_version is not None and time.monotonic() - _graph_version_checked_at < ttl:
+                return _graph_version
+            version = fingerprint_graph()
+            changed = _store_graph_version(version)
+
+    if changed:
+        logger.info('Routing graph version changed to %s; invalidating derived data', version)
+        with _graph_lock:
+            _graph = None
+        for listener in _graph_version_listeners:
+            try:
+                listener(version)
+            except Exception:
+                logger.exception('Graph version listener %r failed', listener)
+    return version
+
+
+@on_data_version_change
+def _graph_table_changed(table, data_version):
+    # With `LISTEN data_version`, a graph reload is picked up right away
+    if table == GRAPH_TABLE:
+        current_graph_version()
+
+
+class RoutePath(NamedTuple):
+    """Result of a shortest-path query: total cost plus the ordered edges and vertices."""
+    cost: float
+    edge_ids: List[int]
+    vertex_ids: List[int]
+
+
+# Mean earth radius in meters, used by the A* heuristic on geographic coordinates
+EARTH_RADIUS_METERS = 6371008.8
+
+
+class RoutingGraph:
+    """Undirected graph in CSR form, matching `pgr_dijkstra(..., directed := false)`.
+
+    Vertices are addressed internally by a dense index into `vertex_ids` (kept sorted, so
+    an external vertex id is found with a binary search). The neighbours of vertex `i`
+    are the arcs `offsets[i]:offsets[i + 1]` of `targets` / `costs` / `edge_ids`. Every
+    edge is stored once per direction; edges with a negative cost are skipped, as
+    pgRouting treats them as missing.
+
+    `xs` / `ys` are optional vertex coordinates. When they are geographic (SRID 4326)
+    `shortest_path` can run A* with a great-circle lower bound instead of Dijkstra.
+    """
+
+    def __init__(self, vertex_ids, offsets, targets, costs, edge_ids, xs=None, ys=None, srid=None):
+        self.vertex_ids = vertex_ids
+        self.offsets = offsets
+        self.targets = targets
+        self.costs = costs
+        self.edge_ids = edge_ids
+        self.xs = xs
+        self.ys = ys
+        self.srid = srid
+
+    @classmethod
+    def from_edges(cls, edges, vertex_coords=None, srid=None):
+        """Build the CSR arrays from `(edge_id, source, target, cost)` tuples.
+
+        `vertex_coords` optionally maps vertex id -> (x, y).
+        """
+        edges = [(int(e), int(s), int(t), float(c)) for e, s, t, c in edges if c is not None and c >= 0]
+        vertex_ids = array('q', sorted({s for _, s, _, _ in edges} | {t for _, _, t, _ in edges}))
+        n = len(vertex_ids)
+
+        def index(vid):
+            return bisect_left(vertex_ids, vid)
+
+        degree = [0] * n
+        arcs = []
+        for edge_id, source, target, cost in edges:
+            si, ti = index(source), index(target)
+            arcs.append((si, ti, cost, edge_id))
+            degree[si] += 1
+            if si != ti:
+                arcs.append((ti, si, cost, edge_id))
+                degree[ti] += 1
+
+        offsets = array('q', [0] * (n + 1))
+        for i in range(n):
+            offsets[i + 1] = offsets[i] + degree[i]
+
+        m = len(arcs)
+        targets = array('q', [0] * m)
+        costs = array('d', [0.0] * m)
+        arc_edge_ids = array('q', [0] * m)
+        fill = list(offsets[:n])
+        for si, ti, cost, edge_id in arcs:
+            pos = fill[si]
+            targets[pos] = ti
+            costs[pos] = cost
+            arc_edge_ids[pos] = edge_id
+            fill[si] = pos + 1
+
+        xs = ys = None
+        if vertex_coords:
+            xs = array('d', [float('nan')] * n)
+            ys = array('d', [float('nan')] * n)
+            for i, vid in enumerate(vertex_ids):
+                xy = vertex_coords.get(vid)
+                if xy is not None:
+                    xs[i], ys[i] = xy
+
+        return cls(vertex_ids, offsets, targets, costs, arc_edge_ids, xs=xs, ys=ys, srid=srid)
+
+    @property
+    def vertex_count(self) -> int:
+        return len(self.vertex_ids)
+
+    @property
+    def arc_count(self) -> int:
+        return len(self.targets)
+
+    def index_of(self, vertex_id: int) -> Optional[int]:
+        i = bisect_left(self.vertex_ids, vertex_id)
+        if i < len(self.vertex_ids) and self.vertex_ids[i] == vertex_id:
+            return i
+        return None
+
+    def _heuristic(self, goal: int):
+        """Return an admissible A* heuristic towards `goal`, or None if unavailable."""
+        if self.xs is None or self.srid != 4326 or math.isnan(self.xs[goal]):
+            return None
+        xs, ys = self.xs, self.ys
+        goal_lon = math.radians(xs[goal])
+        goal_lat = math.radians(ys[goal])
+        cos_goal_lat = math.cos(goal_lat)
+        # Slightly under-estimate so floating point noise never makes it inadmissible
+        scale = 2.0 * EARTH_RADIUS_METERS * 0.999
+
+        def h(i):
+            x = xs[i]
+            if math.isnan(x):
+                return 0.0
+            lat = math.radians(ys[i])
+            dlat = goal_lat - lat
+            dlon = goal_lon - math.radians(x)
+            a = math.sin(dlat / 2) ** 2 + math.cos(lat) * cos_goal_lat * math.sin(dlon / 2) ** 2
+            return scale * math.asin(min(1.0, math.sqrt(a)))
+
+        return h
+
+    def shortest_path(self, start_vid: int, end_vid: int, algorithm: str = 'dijkstra') -> Optional[RoutePath]:
+        """Return the cheapest path between two vertex ids, or None if unreachable.
+
+        `algorithm` is 'dijkstra' or 'astar'; A* silently degrades to Dijkstra when the
+        graph has no geographic vertex coordinates.
+        """
+        start = self.index_of(start_vid)
+        goal = self.index_of(end_vid)
+        if start is None or goal is None:
+            return None
+        if start == goal:
+            return RoutePath(0.0, [], [start_vid])
+
+        h = self._heuristic(goal) if algorithm == 'astar' else None
+        offsets, targets, costs = self.offsets, self.targets, self.costs
+
+        dist = {start: 0.0}
+        # prev[v] = (previous vertex index, arc position used to reach v)
+        prev = {}
+        settled = set()
+        heap = [(h(start) if h else 0.0, start)]
+        while heap:
+            _, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            if u == goal:
+                break
+            settled.add(u)
+            du = dist[u]
+            for pos in range(offsets[u], offsets[u + 1]):
+                v = targets[pos]
+                if v in settled:
+                    continue
+                nd = du + costs[pos]
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    prev[v] = (u, pos)
+                    heapq.heappush(heap, (nd + h(v) if h else nd, v))
+
+        if goal not in prev:
+            return None
+
+        edge_path = []
+        vertex_path = [goal]
+        v = goal
+        while v != start:
+            u, pos = prev[v]
+            edge_path.append(self.edge_ids[pos])
+            vertex_path.append(u)
+            v = u
+        edge_path.reverse()
+        vertex_path.reverse()
+        return RoutePath(dist[goal], edge_path, [self.vertex_ids[i] for i in vertex_path])
+
+    def one_to_many(self, start_vid: int, target_vids) -> Dict[int, float]:
+        """Return the cost from `start_vid` to every reachable vertex id in `target_vids`.
+
+        A single Dijkstra search that stops as soon as all targets are settled, instead of
+        one search per target.
+        """
+        start = self.index_of(start_vid)
+        if start is None:
+            return {}
+        pending = {}
+        for vid in target_vids:
+            i = self.index_of(vid)
+            if i is not None:
+                pending[i] = vid
+        found = {}
+        offsets, targets, costs = self.offsets, self.targets, self.costs
+        dist = {start: 0.0}
+        settled = set()
+        heap = [(0.0, start)]
+        while heap and pending:
+            du, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            settled.add(u)
+            if u in pending:
+                found[pending.pop(u)] = du
+            for pos in range(offsets[u], offsets[u + 1]):
+                v = targets[pos]
+                nd = du + costs[pos]
+                if v not in settled and nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return found
+
+
+def load_routing_graph() -> RoutingGraph:
+    """Read `nav_edges_final` (and vertex coordinates, if available) into a RoutingGraph."""
+    schema = detect_nav_edges_final_schema()
+    sql = (
+        f"SELECT {schema['id_col']}, {schema['source_col']}, {schema['target_col']}, {schema['cost_col']} "
+        "FROM nav_edges_final"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+        edges = cursor.fetchall()
+
+    vertex_coords = None
+    srid = None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT id, ST_X(the_geom), ST_Y(the_geom), ST_SRID(the_geom) FROM nav_edges_work_vertices_pgr")
+            rows = cursor.fetchall()
+        vertex_coords = {int(r[0]): (float(r[1]), float(r[2])) for r in rows if r[1] is not None}
+        srids = {r[3] for r in rows}
+        srid = srids.pop() if len(srids) == 1 else None
+    except Exception:
+        # Coordinates only enable A*; Dijkstra works without them
+        logger.warning('Could not load routing vertex coordinates; A* is disabled', exc_info=True)
+
+    graph = RoutingGraph.from_edges(edges, vertex_coords=vertex_coords, srid=srid)
+    logger.info('Loaded routing graph: %d vertices, %d arcs', graph.vertex_count, graph.arc_count)
+    return graph
+
+
+_graph_lock = threading.Lock()
+_graph = None
+
+
+def get_routing_graph() -> RoutingGraph:
+    """Return the worker-wide routing graph, loading it on first use.
+
+    A current `ROUTING_GRAPH_SNAPSHOT` (see graph_snapshot.py) is mapped instead of
+    reading `nav_edges_final`.
+    """
+    global _graph
+    if _graph is None:
+        from .graph_snapshot import get_graph_snapshot
+        snapshot = get_graph_snapshot()
+        with _graph_lock:
+            if _graph is None:
+                _graph = snapshot.graph if snapshot is not None else load_routing_graph()
+    return _graph
+
+
+def routing_algorithm() -> str:
+    return getattr(settings, 'ROUTING_ALGORITHM', 'dijkstra')
@@ -1,21 +1,34 @@
 from rest_framework import serializers
 
 
-class RoomSerializer(serializers.Serializer):
-    id = serializers.IntegerField(source='ogc_fid')
-    name = serializers.CharField(source='text')
-    location = serializers.JSONField()  # expected GeoJSON dict
-
-
 class RouteRequestSerializer(serializers.Serializer):
-    start_room_id = serializers.IntegerField()
+    start_room_id = serializers.IntegerField(required=False)
+    # Alternatively start from a WGS84 position (e.g. the phone's GPS fix)
+    start_lon = serializers.FloatField(required=False, min_value=-180, max_value=180)
+    start_lat = serializers.FloatField(required=False, min_value=-90, max_value=90)
     end_room_id = serializers.IntegerField()
     simplify_tolerance = serializers.FloatField(default=0.0, required=False)
 
+    def validate(self, attrs):
+        has_room = attrs.get('start_room_id') is not None
+        has_point = attrs.get('start_lon') is not None and attrs.get('start_lat') is not None
+        if has_room == has_point:
+            raise serializers.ValidationError('Provide either start_room_id or both start_lon and start_lat.')
+        return attrs
+
 
 class RouteResultSerializer(serializers.Serializer):
     distance_meters = serializers.FloatField()
     route = serializers.JSONField()  # GeoJSON LineString
+    cache_id = serializers.IntegerField(allow_null=True, required=False)  # `route_result` id, if cached
+
+
+class RouteMatrixRequestSerializer(serializers.Serializer):
+    sources = serializers.ListField(child=serializers.IntegerField(), min_length=1, max_length=500)
+    targets = serializers.ListField(child=serializers.IntegerField(), min_length=1, max_length=500)
+    geometry_top_k = serializers.IntegerField(default=0, required=False, min_value=0, max_value=10)
+    simplify_tolerance = serializers.FloatField(default=0.0, required=False)
+    stream = serializers.BooleanField(default=False, required=False)
 
 
 class BaseFloorSerializer(serializers.Serializer):
@@ -0,0 +1,71 @@
+"""Request coalescing ("single-flight") for expensive computations.
+
+When many clients ask for the same thing at the same moment, only the first caller for
+a key (the leader) runs the computation; every concurrent caller with the same key waits
+for and shares the leader's result (or exception). Once the computation finishes the key
+is forgotten, so later calls compute again (and normally hit a cache instead).
+
+`SingleFlight.do` coalesces across threads (sync workers, sync views under ASGI).
+"""
+import threading
+from concurrent.futures import Future
+from typing import Callable, Hashable, TypeVar
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls per key and counts computed vs coalesced calls."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._waiting = {}
+        self.computed = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        """Run `fn()` unless a call for `key` is already in flight, then share its result."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self.computed += 1
+            else:
+                self.coalesced += 1
+                self._waiting[key] = self._waiting.get(key, 0) + 1
+
+        if not leader:
+            try:
+                return future.result()
+            finally:
+                with self._lock:
+                    remaining = self._waiting.pop(key) - 1
+                    if remaining:
+                        self._waiting[key] = remaining
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def waiting(self, key: Hashable) -> int:
+        """Number of callers currently waiting for the leader's call for `key` (see `do`)."""
+        with self._lock:
+            return self._waiting.get(key, 0)
+
+    def stats(self) -> dict:
+        return {
+            'computed': self.computed,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._calls),
+        }
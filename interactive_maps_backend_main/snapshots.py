@@ -0,0 +1,308 @@
+"""Precomputed, versioned snapshots of the whole `base_floor` layer.
+
+`base_floor` only changes when a CAD file is re-imported, so instead of querying and
+serializing the table for every client, `build_base_floor_snapshot()` writes it once as a
+GeoJSON FeatureCollection plus gzip (and, if the `brotli` package is installed, brotli)
+compressed copies into `SNAPSHOT_DIR`:
+
+    base_floor.<version>.geojson
+    base_floor.<version>.geojson.gz
+    base_floor.<version>.geojson.br
+    base_floor.manifest.json          -> {"version": ..., "features": ..., "files": {...}}
+
+`version` is a hash of the GeoJSON bytes, so it only changes when the layer does and can
+be used as a strong ETag. Files are written under temporary names and renamed, and the
+manifest is replaced last, so readers never see a partial snapshot.
+
+`GET /api/base-floor/?snapshot=1` serves the best pre-compressed file for the request's
+`Accept-Encoding` via `serve_snapshot` without touching the layer. The manifest records
+the `base_floor` data version (see versioning.py); when it moves on, the next request
+starts a rebuild in a background thread and clients keep getting the previous snapshot
+(under its own ETag) until the new manifest is in place. Builds hold `build_lock`, a file
+lock in `SNAPSHOT_DIR`, so only one worker process (or the management command) exports
+the layer at a time. Requests only wait for a build when there is no snapshot at all.
+"""
+import fcntl
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+
+from .compression import negotiate_encoding
+from .versioning import get_data_version
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+LAYER = 'base_floor'
+CONTENT_TYPE = 'application/geo+json'
+_SUFFIXES = {'identity': '', 'gzip': '.gz', 'br': '.br'}
+_FETCH_SIZE = 2000
+
+
+def snapshot_dir() -> str:
+    directory = getattr(settings, 'SNAPSHOT_DIR', None)
+    return directory or os.path.join(settings.BASE_DIR, 'var', 'snapshots')
+
+
+def _manifest_path() -> str:
+    return os.path.join(snapshot_dir(), f'{LAYER}.manifest.json')
+
+
+def _write_features(fh, hasher) -> int:
+    """Stream the FeatureCollection into `fh`, one server-side cursor batch at a time."""
+    sql = """
+        SELECT json_build_object(
+            'type', 'Feature',
+            'id', ogc_fid,
+            'properties', json_build_object('layer', layer, 'paperspace', paperspace, 'text', text),
+            'geometry', ST_AsGeoJSON(wkb_geometry)::json
+        )::text
+        FROM base_floor
+        ORDER BY ogc_fid
+    """
+
+    def write(chunk: bytes):
+        fh.write(chunk)
+        hasher.update(chunk)
+
+    count = 0
+    write(b'{"type":"FeatureCollection","features":[')
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(sql)
+        while True:
+            rows = cursor.fetchmany(_FETCH_SIZE)
+            if not rows:
+                break
+            chunk = ','.join(r[0] for r in rows).encode('utf-8')
+            write(b',' + chunk if count else chunk)
+            count += len(rows)
+    write(b']}')
+    return count
+
+
+def _compress(src: str, dst: str, encoding: str, brotli_quality: int):
+    if encoding == 'gzip':
+        with open(src, 'rb') as fin, gzip.open(dst, 'wb', compresslevel=9) as fout:
+            shutil.copyfileobj(fin, fout, 1 << 20)
+    else:
+        compressor = brotli.Compressor(quality=brotli_quality)
+        with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+            for chunk in iter(lambda: fin.read(1 << 20), b''):
+                fout.write(compressor.process(chunk))
+            fout.write(compressor.finish())
+
+
+def _temp_path(directory: str, name: str) -> str:
+    """Hidden per-process, per-thread temporary file for `name`: workers rebuilding the
+    same snapshot at once never write to each other's partial files."""
+    return os.path.join(directory, f'.{name}.{os.getpid()}.{threading.get_ident()}.tmp')
+
+
+def build_base_floor_snapshot(brotli_quality: Optional[int] = None) -> dict:
+    """Materialize `base_floor` into a new snapshot and return its manifest.
+
+    If the layer is unchanged the existing files are kept and only the manifest is
+    refreshed. Files of older versions are removed. `brotli_quality` defaults to
+    `SNAPSHOT_BROTLI_QUALITY`, a moderate level for builds started by requests; the
+    management command uses the slowest, smallest level.
+    """
+    if brotli_quality is None:
+        brotli_quality = getattr(settings, 'SNAPSHOT_BROTLI_QUALITY', 6)
+    directory = snapshot_dir()
+    os.makedirs(directory, exist_ok=True)
+    started = time.perf_counter()
+    # Read before the export: a change during the export then triggers another rebuild
+    data_version = get_data_version(LAYER)
+
+    tmp_path = _temp_path(directory, LAYER)
+    hasher = hashlib.sha256()
+    try:
+        with open(tmp_path, 'wb') as fh:
+            count = _write_features(fh, hasher)
+        version = hasher.hexdigest()[:16]
+        base = f'{LAYER}.{version}.geojson'
+
+        encodings = ['identity', 'gzip'] + (['br'] if brotli is not None else [])
+        files = {}
+        for encoding in encodings:
+            name = base + _SUFFIXES[encoding]
+            path = os.path.join(directory, name)
+            if not os.path.exists(path):
+                if encoding == 'identity':
+                    os.replace(tmp_path, path)
+                else:
+                    partial = _temp_path(directory, name)
+                    try:
+                        _compress(os.path.join(directory, base), partial, encoding, brotli_quality)
+                        os.replace(partial, path)
+                    finally:
+                        if os.path.exists(partial):
+                            os.remove(partial)
+            files[encoding] = name
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    manifest = {
+        'layer': LAYER,
+        'version': version,
+        'data_version': data_version.version if data_version else None,
+        'features': count,
+        'built_at': time.time(),
+        'files': files,
+        'sizes': {enc: os.path.getsize(os.path.join(directory, name)) for enc, name in files.items()},
+    }
+    partial = _temp_path(directory, os.path.basename(_manifest_path()))
+    with open(partial, 'w') as fh:
+        json.dump(manifest, fh)
+    os.replace(partial, _manifest_path())
+
+    # Readers that loaded the old manifest may still be sending those files; unlinking is
+    # safe for open handles on POSIX.
+    current = set(files.values())
+    for name in os.listdir(directory):
+        if name.startswith(f'{LAYER}.') and name.endswith(tuple(f'.geojson{s}' for s in _SUFFIXES.values())) \
+                and name not in current:
+            os.remove(os.path.join(directory, name))
+
+    logger.info('Built %s snapshot %s (%d features) in %.2fs', LAYER, version, count, time.perf_counter() - started)
+    return manifest
+
+
+@contextmanager
+def build_lock(blocking: bool = True):
+    """Cross-process lock around snapshot builds; yields whether it was acquired.
+
+    `flock` locks belong to the open file, so threads of one process exclude each other too.
+    """
+    directory = snapshot_dir()
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f'.{LAYER}.lock'), 'a') as fh:
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+_manifest_cache = (None, None)  # ((manifest path, mtime), manifest)
+
+
+def load_manifest() -> Optional[dict]:
+    """Return the current manifest (re-read only when the file changes), or None."""
+    global _manifest_cache
+    path = _manifest_path()
+    try:
+        stamp = (path, os.stat(path).st_mtime_ns)
+    except FileNotFoundError:
+        return None
+    cached_stamp, manifest = _manifest_cache
+    if cached_stamp != stamp:
+        with open(path) as fh:
+            manifest = json.load(fh)
+        _manifest_cache = (stamp, manifest)
+    return manifest
+
+
+def _is_current(manifest: Optional[dict], data_version) -> bool:
+    if manifest is None:
+        return False
+    # Without a data_version table, rebuilding is left to the management command
+    return data_version is None or manifest.get('data_version') == data_version.version
+
+
+_rebuilding = threading.Lock()
+
+
+def _rebuild_if_stale():
+    try:
+        with build_lock(blocking=False) as acquired:
+            # Another process is already building; it will replace the manifest
+            if acquired and not _is_current(load_manifest(), get_data_version(LAYER)):
+                build_base_floor_snapshot()
+    except Exception:
+        logger.warning('Rebuilding the %s snapshot failed; serving the previous one', LAYER, exc_info=True)
+    finally:
+        close_old_connections()
+        _rebuilding.release()
+
+
+def _start_rebuild():
+    """Rebuild the snapshot in a daemon thread, unless this process already is."""
+    if not _rebuilding.acquire(blocking=False):
+        return None
+    thread = threading.Thread(target=_rebuild_if_stale, name='snapshot-rebuild', daemon=True)
+    thread.start()
+    return thread
+
+
+def get_or_build_manifest() -> dict:
+    """Return the manifest. If `base_floor` changed since it was built (according to its
+    data version) the current one is still returned and a background rebuild started; only
+    when no snapshot exists yet does the caller build it (or wait for another build)."""
+    data_version = get_data_version(LAYER)
+    manifest = load_manifest()
+    if _is_current(manifest, data_version):
+        return manifest
+    if manifest is not None:
+        _start_rebuild()
+        return manifest
+    with build_lock():
+        return load_manifest() or build_base_floor_snapshot()
+
+
+def etag_for(version: str, encoding: str) -> str:
+    # Each content-coding is a different representation and needs its own strong ETag
+    return f'"{version}"' if encoding == 'identity' else f'"{version}-{encoding}"'
+
+
+def serve_snapshot(request) -> HttpResponse:
+    """Serve the current snapshot as static bytes, honouring `If-None-Match`.
+
+    The file is streamed by `FileResponse` (sendfile via `wsgi.file_wrapper` under WSGI).
+    With `SNAPSHOT_X_ACCEL_REDIRECT` set to an nginx `internal` location that maps to
+    `SNAPSHOT_DIR`, nginx sends the file itself and no worker ever reads it.
+    """
+    manifest = get_or_build_manifest()
+    version = manifest['version']
+    encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), manifest['files'])
+    etag = etag_for(version, encoding)
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+    if if_none_match.strip() == '*' or etag in [t.strip() for t in if_none_match.split(',')]:
+        response = HttpResponseNotModified()
+    else:
+        name = manifest['files'][encoding]
+        accel_prefix = getattr(settings, 'SNAPSHOT_X_ACCEL_REDIRECT', '')
+        if accel_prefix:
+            response = HttpResponse(content_type=CONTENT_TYPE)
+            response['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + name
+        else:
+            response = FileResponse(open(os.path.join(snapshot_dir(), name), 'rb'), content_type=CONTENT_TYPE)
+        if encoding != 'identity':
+            response['Content-Encoding'] = encoding
+
+    response['ETag'] = etag
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = f"public, max-age={getattr(settings, 'SNAPSHOT_CACHE_MAX_AGE', 60)}"
+    response['X-Snapshot-Version'] = version
+    return response
@@ -0,0 +1,99 @@
+"""Viewport (`bbox`) and level-of-detail (`zoom`) handling for the listing endpoints.
+
+`bbox=minx,miny,maxx,maxy` (EPSG:4326 lon/lat, like the stored geometries) restricts a
+listing to the features intersecting the viewport. The filter is written as
+`geom && envelope AND ST_Intersects(geom, envelope)` so the GiST index does the coarse
+search and only candidate rows get the exact test. The envelope is built in the column's
+SRID, taken from the table itself: some imports store `room_points` with SRID 0
+(unknown), which PostGIS refuses to compare with a 4326 envelope. Like the routing
+snap, SRID 0 coordinates are assumed to be lon/lat already.
+
+`zoom=` (web map zoom level) reduces what is sent per feature: below
+`GEOJSON_SIMPLIFY_MAX_ZOOM` lines are simplified with `ST_SimplifyPreserveTopology` to
+about one screen pixel, and `ST_AsGeoJSON` only writes as many decimals as a pixel at
+that zoom needs (instead of the default 9).
+"""
+import math
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+
+# Width of a 256px web map tile at zoom 0, in degrees
+_DEGREES_PER_PIXEL_Z0 = 360.0 / 256
+
+MAX_ZOOM = 24
+
+BBox = Tuple[float, float, float, float]
+
+
+def parse_bbox(value: Optional[str]) -> Optional[BBox]:
+    """Parse `minx,miny,maxx,maxy`; raises ValueError for anything else."""
+    if value is None or value == '':
+        return None
+    try:
+        parts = [float(p) for p in value.split(',')]
+    except ValueError:
+        raise ValueError('Invalid bbox; expected minx,miny,maxx,maxy')
+    if len(parts) != 4 or not all(math.isfinite(p) for p in parts):
+        raise ValueError('Invalid bbox; expected minx,miny,maxx,maxy')
+    minx, miny, maxx, maxy = parts
+    if minx > maxx or miny > maxy:
+        raise ValueError('Invalid bbox; min must not exceed max')
+    return minx, miny, maxx, maxy
+
+
+def parse_zoom(value: Optional[str]) -> Optional[int]:
+    """Parse a zoom level in `0..MAX_ZOOM`; raises ValueError otherwise."""
+    if value is None or value == '':
+        return None
+    try:
+        zoom = int(value)
+    except ValueError:
+        raise ValueError('Invalid zoom')
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise ValueError(f'zoom must be between 0 and {MAX_ZOOM}')
+    return zoom
+
+
+def pixel_size(zoom: int) -> float:
+    """Approximate size of one screen pixel at `zoom`, in degrees."""
+    return _DEGREES_PER_PIXEL_Z0 / (2 ** zoom)
+
+
+def geojson_precision(zoom: Optional[int]) -> int:
+    """Decimal digits needed to keep coordinates accurate to about a tenth of a pixel."""
+    if zoom is None:
+        return 9
+    return max(0, min(9, math.ceil(-math.log10(pixel_size(zoom))) + 1))
+
+
+def _bbox_envelope(table: str, column: str) -> str:
+    """SQL for the 4326 envelope `%s, %s, %s, %s` in the SRID of `table.column`.
+
+    The SRID comes from a row-independent subquery, so `column && envelope` still uses the
+    GiST index. SRID 0 is kept as is (the 4326 -> 4326 transform is a no-op).
+    """
+    srid = f"(SELECT ST_SRID({column}) FROM {table} LIMIT 1)"
+    return (f"ST_SetSRID(ST_Transform(ST_MakeEnvelope(%s, %s, %s, %s, 4326), "
+            f"COALESCE(NULLIF({srid}, 0), 4326)), {srid})")
+
+
+def bbox_filter(column: str, bbox: Optional[BBox], table: str) -> Tuple[List[str], List]:
+    """WHERE clauses and params restricting `table.column` to features intersecting `bbox`."""
+    if bbox is None:
+        return [], []
+    envelope = _bbox_envelope(table, column)
+    return [f"{column} && {envelope}", f"ST_Intersects({column}, {envelope})"], list(bbox) + list(bbox)
+
+
+def geojson_expression(column: str, zoom: Optional[int], simplify: bool = True) -> Tuple[str, List]:
+    """`ST_AsGeoJSON` expression (and its params) for `column` at the level of detail of `zoom`."""
+    if zoom is None:
+        return f"ST_AsGeoJSON({column})", []
+    geom = column
+    params = []
+    if simplify and zoom < getattr(settings, 'GEOJSON_SIMPLIFY_MAX_ZOOM', 20):
+        geom = f"ST_SimplifyPreserveTopology({column}, %s)"
+        params.append(pixel_size(zoom))
+    params.append(geojson_precision(zoom))
+    return f"ST_AsGeoJSON({geom}, %s)", params
@@ -0,0 +1,250 @@
+"""In-memory nearest-vertex index for snapping rooms and GPS positions to the routing graph.
+
+`RouteAPIView._find_nearest_vertex` used to run a KNN query (with an SRID `CASE` /
+`ST_Transform` per lookup) twice for every route. `VertexSnapIndex` keeps the vertices of
+`nav_edges_work_vertices_pgr` in a uniform grid and precomputes the nearest vertex of every
+room, so snapping a room id is a dict lookup and snapping an arbitrary point is a grid
+ring search, with no DB round trip. Distances are planar in the vertex SRID, exactly like
+the `<->` operator on geometries used by the SQL lookup.
+
+The index is built once per worker (optionally at startup, see `warmup.py`) and rebuilt
+when the routing graph version changes, or when `room_points` gets a new data version
+(versioning.py), so moved rooms are snapped from their new position and deleted rooms are
+no longer found.
+"""
+import logging
+import math
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+from django.db import connection
+
+from .routing import on_graph_version_change
+from .versioning import get_data_version, on_data_version_change
+
+logger = logging.getLogger(__name__)
+
+ROOMS_TABLE = 'room_points'
+
+# Spherical mercator radius used by EPSG:3857
+WEB_MERCATOR_RADIUS = 6378137.0
+
+
+class GridIndex:
+    """Uniform grid over 2D points answering nearest-neighbour queries.
+
+    Points are bucketed into square cells of `cell_size`; a query scans rings of cells
+    around the query cell until no unscanned cell can hold a closer point.
+    """
+
+    def __init__(self, ids: Sequence[int], xs: Sequence[float], ys: Sequence[float], cell_size: Optional[float] = None):
+        self.ids = list(ids)
+        self.xs = list(xs)
+        self.ys = list(ys)
+        n = len(self.ids)
+        if n and cell_size is None:
+            # Aim for a handful of points per cell
+            width = (max(self.xs) - min(self.xs)) or 1.0
+            height = (max(self.ys) - min(self.ys)) or 1.0
+            cell_size = math.sqrt(width * height / n) * 2.0
+        self.cell_size = cell_size or 1.0
+        self.cells: Dict[Tuple[int, int], list] = {}
+        for i in range(n):
+            self.cells.setdefault(self._cell(self.xs[i], self.ys[i]), []).append(i)
+        if self.cells:
+            cxs = [c[0] for c in self.cells]
+            cys = [c[1] for c in self.cells]
+            self._bounds = (min(cxs), min(cys), max(cxs), max(cys))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+
+    def nearest(self, x: float, y: float) -> Optional[Tuple[int, float]]:
+        """Return `(id, distance)` of the point nearest to `(x, y)`, or None if empty."""
+        if not self.cells:
+            return None
+        cx, cy = self._cell(x, y)
+        min_cx, min_cy, max_cx, max_cy = self._bounds
+        # Rings beyond this radius contain no cells at all
+        max_ring = max(abs(cx - min_cx), abs(cx - max_cx), abs(cy - min_cy), abs(cy - max_cy))
+        best = None
+        best_d2 = math.inf
+        xs, ys = self.xs, self.ys
+        for ring in range(max_ring + 1):
+            # Any point in this ring or beyond is at least (ring - 1) cells away
+            if best is not None and ((ring - 1) * self.cell_size) ** 2 > best_d2:
+                break
+            for cell in self._ring(cx, cy, ring):
+                for i in self.cells.get(cell, ()):
+                    d2 = (xs[i] - x) ** 2 + (ys[i] - y) ** 2
+                    if d2 < best_d2:
+                        best_d2 = d2
+                        best = i
+        return self.ids[best], math.sqrt(best_d2)
+
+    @staticmethod
+    def _ring(cx: int, cy: int, ring: int):
+        if ring == 0:
+            yield cx, cy
+            return
+        for dx in range(-ring, ring + 1):
+            yield cx + dx, cy - ring
+            yield cx + dx, cy + ring
+        for dy in range(-ring + 1, ring):
+            yield cx - ring, cy + dy
+            yield cx + ring, cy + dy
+
+
+def lonlat_to_srid(lon: float, lat: float, srid: int) -> Optional[Tuple[float, float]]:
+    """Project WGS84 lon/lat into `srid` without a DB round trip (None if unsupported)."""
+    if srid == 4326:
+        return lon, lat
+    if srid == 3857:
+        lat = max(min(lat, 85.0511287798), -85.0511287798)
+        x = math.radians(lon) * WEB_MERCATOR_RADIUS
+        y = math.log(math.tan(math.pi / 4 + math.radians(lat) / 2)) * WEB_MERCATOR_RADIUS
+        return x, y
+    return None
+
+
+class VertexSnapIndex:
+    """Grid index over routing vertices plus a precomputed room -> nearest vertex table.
+
+    `rooms_version` is the `room_points` data version the room table was built from.
+    """
+
+    def __init__(self, grid: GridIndex, srid: Optional[int], room_vertices: Dict[int, int],
+                 rooms_version: Optional[int] = None):
+        self.grid = grid
+        self.srid = srid
+        self.room_vertices = room_vertices
+        self.rooms_version = rooms_version
+
+    def vertex_for_room(self, room_id: int) -> Optional[int]:
+        return self.room_vertices.get(room_id)
+
+    def snap_point(self, x: float, y: float) -> Optional[int]:
+        """Nearest vertex to a point given in the vertex SRID."""
+        hit = self.grid.nearest(x, y)
+        return hit[0] if hit else None
+
+    def snap_lonlat(self, lon: float, lat: float) -> Optional[int]:
+        """Nearest vertex to a WGS84 position, e.g. a phone's GPS fix.
+
+        Returns None when the vertex SRID can't be projected in Python; callers then
+        transform the point in the DB and use `snap_point`.
+        """
+        xy = lonlat_to_srid(lon, lat, self.srid) if self.srid is not None else None
+        if xy is None:
+            return None
+        return self.snap_point(*xy)
+
+
+def _snap_rooms(grid: GridIndex, srid: int) -> Dict[int, int]:
+    """Nearest vertex of every room in `room_points`."""
+    room_vertices = {}
+    # Same SRID handling as RouteAPIView._find_nearest_vertex: SRID 0 means "already
+    # in the vertex CRS", anything else is transformed.
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT ogc_fid, ST_X(g), ST_Y(g) FROM (
+                SELECT ogc_fid,
+                    CASE
+                        WHEN ST_SRID(wkb_geometry) IN (0, %s) THEN wkb_geometry
+                        ELSE ST_Transform(wkb_geometry, %s)
+                    END AS g
+                FROM room_points
+            ) rooms
+            """,
+            [srid, srid],
+        )
+        for room_id, x, y in cursor.fetchall():
+            if x is not None:
+                vertex_id = grid.nearest(float(x), float(y))
+                if vertex_id is not None:
+                    room_vertices[int(room_id)] = vertex_id[0]
+    return room_vertices
+
+
+def build_vertex_snap_index(use_snapshot: bool = True) -> VertexSnapIndex:
+    """Load vertices and room positions (in the vertex SRID) and build the index.
+
+    With a current graph snapshot (graph_snapshot.py) the grid is built over the mapped
+    graph vertices, and its room table is used as is if it was built from the current
+    `room_points` data version.
+    """
+    # Version first: rooms changed during the build make the index stale, not wrong
+    data_version = get_data_version(ROOMS_TABLE)
+    rooms_version = data_version.version if data_version else None
+    if use_snapshot:
+        from .graph_snapshot import get_graph_snapshot
+        snapshot = get_graph_snapshot()
+        graph = snapshot.graph if snapshot is not None else None
+        if graph is not None and graph.xs is not None and graph.srid is not None:
+            # Vertices without coordinates are NaN in the graph
+            located = [i for i in range(graph.vertex_count) if not math.isnan(graph.xs[i])]
+            grid = GridIndex([graph.vertex_ids[i] for i in located], [graph.xs[i] for i in located],
+                             [graph.ys[i] for i in located])
+            room_vertices = snapshot.room_vertices
+            if rooms_version is not None and snapshot.rooms_version != rooms_version:
+                room_vertices = _snap_rooms(grid, graph.srid)
+            logger.info('Built vertex snap index from graph snapshot: %d vertices, %d rooms',
+                        len(grid), len(room_vertices))
+            return VertexSnapIndex(grid, graph.srid, room_vertices, rooms_version)
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT id, ST_X(the_geom), ST_Y(the_geom), ST_SRID(the_geom) FROM nav_edges_work_vertices_pgr")
+        vertices = [r for r in cursor.fetchall() if r[1] is not None]
+
+    srids = {r[3] for r in vertices}
+    srid = srids.pop() if len(srids) == 1 else None
+    grid = GridIndex([int(r[0]) for r in vertices], [float(r[1]) for r in vertices], [float(r[2]) for r in vertices])
+
+    room_vertices = _snap_rooms(grid, srid) if srid is not None else {}
+    if srid is None:
+        logger.warning('nav_edges_work_vertices_pgr has mixed or no SRIDs; room snapping falls back to SQL')
+
+    logger.info('Built vertex snap index: %d vertices, %d rooms', len(grid), len(room_vertices))
+    return VertexSnapIndex(grid, srid, room_vertices, rooms_version)
+
+
+_index_lock = threading.Lock()
+_index = None
+
+
+def get_vertex_snap_index() -> VertexSnapIndex:
+    """Return the worker-wide snap index, building it on first use and rebuilding it when
+    `room_points` has a new data version."""
+    global _index
+    index = _index
+    if index is None:
+        with _index_lock:
+            if _index is None:
+                _index = build_vertex_snap_index()
+            return _index
+    data_version = get_data_version(ROOMS_TABLE)
+    if data_version is not None and index.rooms_version != data_version.version and _index_lock.acquire(blocking=False):
+        try:
+            if _index is index:
+                _index = build_vertex_snap_index()
+        finally:
+            _index_lock.release()
+    return _index
+
+
+@on_graph_version_change
+def _reset_vertex_snap_index(version):
+    global _index
+    with _index_lock:
+        _index = None
+
+
+@on_data_version_change
+def _rebuild_vertex_snap_index(table, data_version):
+    # Only refresh an index this worker actually uses; the listener thread pays for the rebuild
+    if table == ROOMS_TABLE and _index is not None:
+        get_vertex_snap_index()
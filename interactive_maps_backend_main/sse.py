@@ -0,0 +1,152 @@
+"""Resumable Server-Sent Events: event ids, `Last-Event-ID`, `retry:` and heartbeats.
+
+When a connection drops, `EventSource` reconnects on its own and sends the `id:` of the
+last event it received in a `Last-Event-ID` header. Every batch event of the SSE streams
+carries as its id a `StreamPosition`: the data version of the table the stream reads, the
+batch number and row count so far, the keyset key of the last row sent, and whether that
+was the last batch. A reconnecting stream continues right after that row instead of
+starting over:
+
+- If the table's data version changed in between, the position may no longer line up
+  with the data, so the stream starts from the beginning and its first batch says
+  `"reset": true` (the client drops what it has).
+- If the last event was the final batch, the response is `204 No Content`, which makes
+  `EventSource` stop reconnecting.
+
+Each stream starts with `retry: SSE_RETRY_MS` (how long `EventSource` waits before
+reconnecting), and `with_heartbeats` sends a `: keepalive` comment whenever no event has
+been sent for `SSE_HEARTBEAT_SECONDS`, so proxies and mobile networks don't close streams
+that are waiting on a slow query.
+"""
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+
+from .pagination import decode_cursor, encode_cursor
+
+HEARTBEAT = b': keepalive\n\n'
+
+
+class StreamPosition(NamedTuple):
+    """Where a stream is after an event (see module docstring)."""
+    version: Optional[int]
+    batch: int
+    fetched: int
+    after: Optional[List[Any]]
+    done: bool
+
+    def encode(self) -> str:
+        return encode_cursor(self)
+
+    @classmethod
+    def decode(cls, token: str, key_width: int) -> 'StreamPosition':
+        """Parse an event id; raises ValueError if it is not a position for a `key_width` key."""
+        return cls.from_list(decode_cursor(token, len(cls._fields)), key_width)
+
+    @classmethod
+    def from_list(cls, values: List, key_width: int) -> 'StreamPosition':
+        if not isinstance(values, list) or len(values) != len(cls._fields):
+            raise ValueError('Invalid event id')
+        version, batch, fetched, after, done = values
+        if not (isinstance(batch, int) and isinstance(fetched, int) and isinstance(done, bool)
+                and (version is None or isinstance(version, int))
+                and (after is None or (isinstance(after, list) and len(after) == key_width))):
+            raise ValueError('Invalid event id')
+        return cls(version, batch, fetched, after, done)
+
+
+def resume_position(last_event_id: Optional[str], key_width: int, version: Optional[int]):
+    """Return `(position, reset)` for a request's `Last-Event-ID`.
+
+    `position` is None when the stream must start from the beginning; `reset` is true if
+    the client sent an id that can't be honoured (malformed, or from another data version).
+    """
+    if not last_event_id:
+        return None, False
+    try:
+        position = StreamPosition.decode(last_event_id, key_width)
+    except ValueError:
+        return None, True
+    if position.version != version:
+        return None, True
+    return position, False
+
+
+def resume_positions(last_event_id: Optional[str], layers: Dict[str, Tuple[int, Optional[int]]]):
+    """`resume_position` for a multiplexed stream, whose ids hold one position per layer.
+
+    `layers` maps each layer, in stream order, to its key width and current data version;
+    returns `{layer: (position, reset)}`.
+    """
+    if not last_event_id:
+        return {name: (None, False) for name in layers}
+    try:
+        values = decode_cursor(last_event_id, len(layers))
+        positions = [StreamPosition.from_list(v, width) for v, (width, _) in zip(values, layers.values())]
+    except ValueError:
+        return {name: (None, True) for name in layers}
+    return {
+        name: (position, False) if position.version == version else (None, True)
+        for (name, (_, version)), position in zip(layers.items(), positions)
+    }
+
+
+def encode_positions(positions) -> str:
+    """Event id of a multiplexed stream (see `resume_positions`)."""
+    return encode_cursor(list(positions))
+
+
+def retry_frame() -> bytes:
+    return b'retry: %d\n\n' % getattr(settings, 'SSE_RETRY_MS', 3000)
+
+
+def format_event(data: bytes, event: Optional[str] = None, event_id: Optional[str] = None) -> bytes:
+    """One SSE event; `data` must be a single line (compact JSON)."""
+    frame = b''
+    if event is not None:
+        frame += b'event: ' + event.encode('ascii') + b'\n'
+    if event_id is not None:
+        frame += b'id: ' + event_id.encode('ascii') + b'\n'
+    return frame + b'data: ' + data + b'\n\n'
+
+
+async def with_heartbeats(stream: AsyncIterator[bytes], interval: Optional[float] = None,
+                          heartbeat: bytes = HEARTBEAT) -> AsyncIterator[bytes]:
+    """Re-yield `stream`, adding `heartbeat` (an SSE comment by default) after every
+    `interval` seconds of silence.
+
+    The pending `__anext__` is never cancelled by a heartbeat, only when the consumer stops.
+    """
+    if interval is None:
+        interval = getattr(settings, 'SSE_HEARTBEAT_SECONDS', 15)
+    if not interval or interval <= 0:
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+        return
+
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(stream.__anext__())
+            done, _ = await asyncio.wait([pending], timeout=interval)
+            if not done:
+                yield heartbeat
+                continue
+            try:
+                chunk = pending.result()
+            except StopAsyncIteration:
+                return
+            finally:
+                pending = None
+            yield chunk
+    finally:
+        if pending is not None:
+            pending.cancel()
+            await asyncio.wait([pending])
+        await stream.aclose()
+
@@ -1,10 +1,61 @@
-from django.test import TestCase, RequestFactory
-from asgiref.sync import async_to_sync
+from django.db import OperationalError
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import SimpleTestCase, TestCase, RequestFactory, override_settings
+from unittest import mock
+from asgiref.sync import async_to_sync, sync_to_async
+from datetime import datetime, timezone
+from decimal import Decimal
+import asyncio
+import gzip
 import json
+import os
+import random
+import tempfile
+import threading
+import time
+import zlib
 
-from .views import base_floor_view
+from . import async_db
+from .binary_geometry import decode_frames, encode_document, wants_protobuf
+from .cancellation import QueryCancellationMiddleware, RequestQueries, query_stats, track_query
+from .changelog import SyncWindow, changes_query
+from .compression import StreamingCompressionMiddleware
+from . import contraction
+from .contraction import ContractionHierarchy, build_contraction_hierarchy
+from .pagination import KeysetQuery, decode_cursor, encode_cursor
+from .prefetch import prefetch
+from .renderers import FastJSONRenderer, ProtobufRenderer
+from . import graph_snapshot, route_cache, room_catalog, routing, spatial_index
+from .room_search import Match, RoomSearchIndex, SearchResult, trigrams
+from .route_cache import RouteLRUCache
+from .routing import RoutingGraph
+from .serializers import RouteRequestSerializer
+from .singleflight import SingleFlight
+from . import snapshots
+from .spatial_filters import bbox_filter, geojson_expression, parse_bbox, parse_zoom
+from .spatial_index import GridIndex
+from .tiles import tile_bounds_valid
+from . import versioning, views
+from .versioning import DataVersion, etag_for
+from .sse import StreamPosition, encode_positions, with_heartbeats
+from .views import (
+    RoomAutocompleteAPIView, RoomsListAPIView, RouteMatrixAPIView, _base_floor_query, _rooms_query, _sse_batch_stream, base_floor_view, layers_stream_view, sync_view,
+    tile_view,
+)
 
 
+def sse_events(frames):
+    """Parse SSE frames into dicts of their fields (`data` decoded as JSON)."""
+    events = []
+    for frame in frames:
+        fields = dict(line.split(': ', 1) for line in frame.decode().splitlines() if line)
+        if 'data' in fields:
+            fields['data'] = json.loads(fields['data'])
+        events.append(fields)
+    return events
+
+
+@override_settings(ASYNC_DB_POOL=False)
 class BaseFloorViewTests(TestCase):
     def setUp(self):
         self.rf = RequestFactory()
@@ -19,22 +70,25 @@ class BaseFloorViewTests(TestCase):
         def fake_execute(sql, params=None):
             return [{
                 'ogc_fid': 1,
-                'layer': 'L1',
-                'paperspace': False,
-                'text': 'floor A',
-                'geometry': json.dumps({'type': 'LineString', 'coordinates': []})
+                'item': json.dumps({
+                    'ogc_fid': 1,
+                    'layer': 'L1',
+                    'paperspace': False,
+                    'text': 'floor A',
+                    'geometry': {'type': 'LineString', 'coordinates': []},
+                }),
             }]
 
-        # Patch the module-level sync_to_async to return an async function that runs fake_execute
-        import interactive_maps_backend_main.views as vmod
-
-        async def fake_async_execute(*a, **k):
-            return fake_execute(*a, **k)
-
-        vmod.sync_to_async = lambda fn: (lambda *a, **k: fake_async_execute(*a, **k))
+        def fake_sync_to_async(fn):
+            async def run(*a, **k):
+                if fn is views.validators_for:
+                    return None, None
+                return fake_execute(*a, **k)
+            return run
 
-        request = self.rf.get('/api/base-floor/')
-        response = async_to_sync(base_floor_view)(request)
+        request = self.rf.get('/api/base-floor/?limit=10')
+        with mock.patch.object(views, 'sync_to_async', fake_sync_to_async):
+            response = async_to_sync(base_floor_view)(request)
 
         self.assertEqual(response.status_code, 200)
         parsed = json.loads(response.content)
@@ -45,3 +99,1205 @@ class BaseFloorViewTests(TestCase):
         self.assertEqual(item['layer'], 'L1')
         self.assertEqual(item['text'], 'floor A')
         self.assertIn('geometry', item)
+
+
+class KeysetQueryTests(SimpleTestCase):
+    def test_page_seeks_after_cursor_instead_of_offset(self):
+        """A cursor from the last row turns the next page into a keyset seek."""
+        query = KeysetQuery("SELECT ogc_fid, text FROM room_points", ['text', 'ogc_fid'],
+                            where=['text ILIKE %s'], params=['%a%'])
+
+        sql, params = query.page(limit=2)
+        self.assertNotIn('OFFSET', sql)
+        self.assertEqual(params, ['%a%', 2])
+
+        cursor = query.cursor_after({'ogc_fid': 7, 'text': 'Lab'})
+        sql, params = query.page(after=query.decode(cursor), limit=2, offset=50)
+        self.assertIn('(text, ogc_fid) > (%s, %s)', sql)
+        self.assertIn('ORDER BY text, ogc_fid', sql)
+        self.assertNotIn('OFFSET', sql)
+        self.assertEqual(params, ['%a%', 'Lab', 7, 2])
+
+    def test_decode_rejects_malformed_cursor(self):
+        with self.assertRaises(ValueError):
+            decode_cursor('not-a-cursor', 1)
+        with self.assertRaises(ValueError):
+            decode_cursor(encode_cursor([1, 2]), 1)
+
+
+class RoutingGraphTests(SimpleTestCase):
+    def setUp(self):
+        # 1 --(10)-- 2 --(10)-- 3
+        #  \______(25)_________/        plus a negative-cost edge that must be ignored
+        self.graph = RoutingGraph.from_edges([
+            (101, 1, 2, 10.0),
+            (102, 2, 3, 10.0),
+            (103, 1, 3, 25.0),
+            (104, 3, 4, -1.0),
+        ])
+
+    def test_shortest_path_is_undirected_and_returns_edge_ids(self):
+        path = self.graph.shortest_path(3, 1)
+        self.assertEqual(path.cost, 20.0)
+        self.assertEqual(path.edge_ids, [102, 101])
+        self.assertEqual(path.vertex_ids, [3, 2, 1])
+
+    def test_unreachable_and_unknown_vertices(self):
+        self.assertIsNone(self.graph.shortest_path(1, 4))
+        self.assertIsNone(self.graph.shortest_path(1, 99))
+
+    def test_graph_version_follows_the_data_version_without_scanning_edges(self):
+        changes = []
+        versions = [DataVersion(4, datetime(2024, 5, 1, tzinfo=timezone.utc))] * 2 \
+            + [DataVersion(5, datetime(2024, 5, 2, tzinfo=timezone.utc))]
+        with mock.patch.object(routing, '_graph_version', None), \
+                mock.patch.object(routing, '_graph_version_listeners', [changes.append]), \
+                mock.patch.object(routing, 'get_data_version', side_effect=versions), \
+                mock.patch.object(routing, 'fingerprint_graph') as fingerprint:
+            first = routing.current_graph_version()
+            self.assertEqual(routing.current_graph_version(), first)
+            second = routing.current_graph_version()
+        self.assertNotEqual(second, first)
+        self.assertEqual(changes, [second])
+        fingerprint.assert_not_called()
+
+
+class ContractionHierarchyTests(SimpleTestCase):
+    def test_matches_dijkstra_and_unpacks_shortcuts(self):
+        # A ring of 6 vertices with one chord: every query must return the same cost as
+        # plain Dijkstra and a path made only of original edge ids.
+        edges = [(100 + i, i, (i + 1) % 6, 1.0 + i) for i in range(6)] + [(200, 0, 3, 4.5)]
+        graph = RoutingGraph.from_edges(edges)
+        ch = ContractionHierarchy.from_dict(build_contraction_hierarchy(graph).to_dict())
+        original_ids = {e[0] for e in edges}
+
+        for s in range(6):
+            for t in range(6):
+                expected = graph.shortest_path(s, t)
+                got = ch.shortest_path(s, t)
+                self.assertAlmostEqual(got.cost, expected.cost)
+                self.assertTrue(set(got.edge_ids) <= original_ids)
+                self.assertEqual(got.vertex_ids[0], s)
+                self.assertEqual(got.vertex_ids[-1], t)
+
+
+    def test_corrupt_file_falls_back_to_dijkstra(self):
+        graph = RoutingGraph.from_edges([(1, 0, 1, 1.0)])
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = f'{tmp.name}/ch.json.gz'
+        build_contraction_hierarchy(graph).save(path)
+        with open(path, 'rb') as fh:
+            data = fh.read()
+        self.addCleanup(contraction._reset_contraction_hierarchy, None)
+        for corrupt in (data[:len(data) // 2], b'not gzip at all', gzip.compress(b'{"format": "other"}'),
+                        gzip.compress(b'{"trunc')):
+            with open(path, 'wb') as fh:
+                fh.write(corrupt)
+            contraction._reset_contraction_hierarchy(None)
+            with override_settings(ROUTING_CH_PATH=path), self.assertLogs(contraction.logger, 'WARNING'):
+                self.assertIsNone(contraction.get_contraction_hierarchy())
+
+
+class GraphSnapshotTests(SimpleTestCase):
+    def setUp(self):
+        edges = [(100 + i, i, (i + 1) % 6, 1.0 + i) for i in range(6)] + [(200, 0, 3, 4.5)]
+        coords = {i: (39.2 + i * 1e-4, -6.77) for i in range(5)}  # vertex 5 has no coordinates
+        self.graph = RoutingGraph.from_edges(edges, vertex_coords=coords, srid=4326)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = f'{self.tmp.name}/routing.graph.bin'
+        graph_snapshot.write_graph_snapshot(self.path, self.graph, {7: 3, 2: 0}, 'v1')
+
+    def test_mapped_graph_matches_original(self):
+        snapshot = graph_snapshot.load_graph_snapshot(self.path)
+        mapped = snapshot.graph
+        self.assertIsInstance(mapped.targets, memoryview)
+        self.assertEqual((snapshot.graph_version, mapped.srid), ('v1', 4326))
+        for s in range(6):
+            for t in range(6):
+                for algorithm in ('dijkstra', 'astar'):
+                    self.assertEqual(mapped.shortest_path(s, t, algorithm), self.graph.shortest_path(s, t, algorithm))
+        self.assertEqual((snapshot.room_vertices.get(7), snapshot.room_vertices.get(2)), (3, 0))
+        self.assertIsNone(snapshot.room_vertices.get(5))
+
+    def test_stale_or_missing_snapshot_is_ignored(self):
+        with override_settings(ROUTING_GRAPH_SNAPSHOT=self.path), \
+                mock.patch.object(graph_snapshot, 'current_graph_version', return_value='v2'):
+            self.assertIsNone(graph_snapshot.get_graph_snapshot())
+        with override_settings(ROUTING_GRAPH_SNAPSHOT=self.path), \
+                mock.patch.object(graph_snapshot, 'current_graph_version', return_value='v1'):
+            self.assertEqual(graph_snapshot.get_graph_snapshot().graph.vertex_count, 6)
+        graph_snapshot._reset_graph_snapshot('v2')
+        with override_settings(ROUTING_GRAPH_SNAPSHOT=f'{self.tmp.name}/missing.bin'):
+            self.assertIsNone(graph_snapshot.get_graph_snapshot())
+        with open(self.path, 'r+b') as fh:
+            fh.write(b'NOTAGRAPH')
+        self.assertIsNone(graph_snapshot.load_graph_snapshot(self.path))
+
+
+    def test_rooms_are_resnapped_when_room_points_changed(self):
+        graph_snapshot.write_graph_snapshot(self.path, self.graph, {7: 3, 2: 0}, 'v1', rooms_version=4)
+        snapshot = graph_snapshot.load_graph_snapshot(self.path)
+        self.assertEqual(snapshot.rooms_version, 4)
+
+        def build(version):
+            with mock.patch.object(graph_snapshot, 'get_graph_snapshot', return_value=snapshot), \
+                    mock.patch.object(spatial_index, 'get_data_version', return_value=DataVersion(version, None)), \
+                    mock.patch.object(spatial_index, '_snap_rooms', return_value={7: 4}) as snap_rooms:
+                return spatial_index.build_vertex_snap_index(), snap_rooms.call_count
+
+        index, queries = build(4)
+        self.assertEqual((index.vertex_for_room(7), index.vertex_for_room(2), queries), (3, 0, 0))
+        # A moved room snaps from its new position, a deleted one is gone
+        index, queries = build(5)
+        self.assertEqual((index.vertex_for_room(7), index.vertex_for_room(2), queries), (4, None, 1))
+        self.assertEqual(index.rooms_version, 5)
+
+    def test_snap_index_is_rebuilt_on_a_new_room_points_version(self):
+        grid = GridIndex([1], [0.0], [0.0])
+        old, new = (spatial_index.VertexSnapIndex(grid, 4326, {}, v) for v in (4, 5))
+        self.addCleanup(setattr, spatial_index, '_index', None)
+        spatial_index._index = old
+        with mock.patch.object(spatial_index, 'build_vertex_snap_index', return_value=new), \
+                mock.patch.object(spatial_index, 'get_data_version', return_value=DataVersion(4, None)):
+            self.assertIs(spatial_index.get_vertex_snap_index(), old)
+        with mock.patch.object(spatial_index, 'build_vertex_snap_index', return_value=new), \
+                mock.patch.object(spatial_index, 'get_data_version', return_value=DataVersion(5, None)):
+            self.assertIs(spatial_index.get_vertex_snap_index(), new)
+
+
+class RouteLRUCacheTests(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        cache = RouteLRUCache(maxsize=2)
+        cache.put((1, 2, 0.0, 'v1'), {'cache_id': 1})
+        cache.put((1, 3, 0.0, 'v1'), {'cache_id': 2})
+        # Touch the first entry so the second becomes the eviction candidate
+        self.assertEqual(cache.get((1, 2, 0.0, 'v1')), {'cache_id': 1})
+        cache.put((1, 4, 0.0, 'v1'), {'cache_id': 3})
+
+        self.assertIsNone(cache.get((1, 3, 0.0, 'v1')))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.stats()['hits'], 1)
+        # A different graph version is a different key
+        self.assertIsNone(cache.get((1, 2, 0.0, 'v2')))
+
+    def test_graph_change_clears_the_lru_without_touching_route_result(self):
+        route_cache.route_lru.put((1, 2, 0.0, 'v1'), {'cache_id': 1})
+        with mock.patch.object(route_cache, 'connection') as connection:
+            route_cache._invalidate('v2')
+        self.assertEqual(len(route_cache.route_lru), 0)
+        connection.cursor.assert_not_called()
+
+    def test_cached_route_lookup_is_limited_to_the_current_graph_version(self):
+        view = views.RouteCacheAPIView.as_view()
+        with mock.patch.object(views, 'current_graph_version', return_value='v2'), \
+                mock.patch.object(views.RouteCacheAPIView, '_execute_and_fetch', return_value=[]) as fetch:
+            response = view(RequestFactory().get('/api/route/cache/7/'), cache_id=7)
+        self.assertEqual(response.status_code, 404)
+        sql, params = fetch.call_args.args
+        self.assertIn('graph_version = %s', sql)
+        self.assertEqual(params, [7, 'v2'])
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_threads_share_one_computation(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {'distance_meters': 1.0}
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do('k', compute)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(flight.do('k', compute))) for _ in range(3)]
+        for t in followers:
+            t.start()
+        # Followers register as coalesced before the leader is released
+        while flight.coalesced < 3:
+            time.sleep(0.001)
+        release.set()
+        for t in [leader] + followers:
+            t.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(flight.stats(), {'computed': 1, 'coalesced': 3, 'in_flight': 0})
+
+
+class GridIndexTests(SimpleTestCase):
+    def test_nearest_matches_brute_force(self):
+        rng = random.Random(7)
+        points = [(i, rng.uniform(0, 100), rng.uniform(0, 100)) for i in range(300)]
+        grid = GridIndex([p[0] for p in points], [p[1] for p in points], [p[2] for p in points])
+
+        for _ in range(200):
+            x, y = rng.uniform(-20, 120), rng.uniform(-20, 120)
+            expected = min(points, key=lambda p: (p[1] - x) ** 2 + (p[2] - y) ** 2)
+            vertex_id, distance = grid.nearest(x, y)
+            self.assertAlmostEqual(distance, ((expected[1] - x) ** 2 + (expected[2] - y) ** 2) ** 0.5)
+
+    def test_route_request_needs_room_or_position(self):
+        self.assertFalse(RouteRequestSerializer(data={'end_room_id': 2}).is_valid())
+        self.assertTrue(RouteRequestSerializer(data={'start_room_id': 1, 'end_room_id': 2}).is_valid())
+        self.assertTrue(RouteRequestSerializer(data={'start_lon': 39.2, 'start_lat': -6.8, 'end_room_id': 2}).is_valid())
+
+
+@override_settings(ASYNC_DB_POOL=False, ROUTING_ENGINE='inprocess', ROUTE_MATRIX_STREAM_CELLS=2500)
+class RouteMatrixViewTests(SimpleTestCase):
+    def setUp(self):
+        rng = random.Random(7)
+        edges = [(100 + i, i, i + 1, rng.uniform(1, 10)) for i in range(1, 8)]
+        edges += [(200 + i, i, i + 3, rng.uniform(5, 30)) for i in range(1, 6)]
+        edges.append((300, 20, 21, 1.0))  # a separate component
+        self.graph = RoutingGraph.from_edges(edges)
+        # Room 10 + v sits on vertex v
+        self.vertices = {10 + v: v for v in (1, 2, 3, 4, 5, 6, 7, 8, 20)}
+        for patcher in (
+                mock.patch.object(views, 'get_routing_graph', return_value=self.graph),
+                mock.patch.object(RouteMatrixAPIView, '_find_nearest_vertices',
+                                  side_effect=lambda rooms: {r: self.vertices[r] for r in rooms if r in self.vertices}),
+                mock.patch.object(RouteMatrixAPIView, '_assemble_route_geometry',
+                                  return_value=('{"type":"LineString","coordinates":[[0,0],[1,1]]}', None))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post(self, body):
+        request = RequestFactory().post('/api/route/matrix/', data=json.dumps(body), content_type='application/json')
+        return RouteMatrixAPIView.as_view()(request)
+
+    def expected_cost(self, source, target):
+        path = self.graph.shortest_path(self.vertices[source], self.vertices[target])
+        return path.cost if path else None
+
+    def test_in_process_matrix_matches_shortest_paths(self):
+        sources, targets = [11, 13, 16], [11, 12, 15, 18, 30]
+        response = self.post({'sources': sources, 'targets': targets, 'geometry_top_k': 2})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.rendered_content)
+        self.assertEqual((data['sources'], data['targets']), (sources, targets))
+        for source, row in zip(sources, data['rows']):
+            self.assertEqual(row['source'], source)
+            for target, distance in zip(targets, row['distances']):
+                expected = self.expected_cost(source, target)
+                if expected is None:
+                    self.assertIsNone(distance)
+                else:
+                    self.assertAlmostEqual(distance, expected)
+            # Geometries for the two nearest reachable targets
+            nearest = sorted((d, t) for d, t in zip(row['distances'], targets) if d is not None)[:2]
+            self.assertEqual([(r['distance_meters'], r['target']) for r in row['routes']], nearest)
+            # A room routed to itself has no edges, hence no geometry
+            self.assertEqual([r['route'] and r['route']['type'] for r in row['routes']],
+                             [None if r['distance_meters'] == 0 else 'LineString' for r in row['routes']])
+
+    @override_settings(ROUTING_ENGINE='db')
+    def test_db_engine_makes_one_pgr_dijkstra_cost_call(self):
+        rows = [{'start_vid': 1, 'end_vid': 5, 'agg_cost': 12.5}, {'start_vid': 2, 'end_vid': 5, 'agg_cost': 4.0}]
+        schema = {'id_col': 'ogc_fid', 'source_col': 'source', 'target_col': 'target', 'cost_col': 'cost',
+                  'geom_col': 'wkb_geometry'}
+        with mock.patch.object(views, '_fetch_rows', return_value=rows) as fetch_rows, \
+                mock.patch.object(RouteMatrixAPIView, '_detect_nav_edges_final_schema', return_value=schema):
+            response = self.post({'sources': [11, 12], 'targets': [15, 11]})
+        self.assertEqual(response.status_code, 200)
+        sql, params = fetch_rows.call_args.args
+        self.assertIn('pgr_dijkstraCost', sql)
+        self.assertEqual((sorted(params[0]), sorted(params[1])), ([1, 2], [1, 5]))
+        data = json.loads(response.rendered_content)
+        # pgr_dijkstraCost leaves out the source == target pair
+        self.assertEqual([row['distances'] for row in data['rows']], [[12.5, 0.0], [4.0, None]])
+
+    def test_invalid_or_oversized_requests_are_rejected(self):
+        for body in ({'sources': [11]}, {'sources': [], 'targets': [12]}, {'sources': ['a'], 'targets': [12]},
+                     {'sources': [11], 'targets': [12], 'geometry_top_k': 11},
+                     {'sources': list(range(501)), 'targets': [12]}):
+            self.assertEqual(self.post(body).status_code, 400, body)
+        response = self.post({'sources': [11, 99], 'targets': [12]})
+        self.assertEqual(response.status_code, 422)
+        self.assertIn('[99]', response.data['detail'])
+
+    @override_settings(ROUTE_MATRIX_STREAM_ROWS=2)
+    def test_large_or_requested_matrices_stream_rows_as_sse(self):
+        sources, targets = [11, 12, 13], [15, 16]
+        with override_settings(ROUTE_MATRIX_STREAM_CELLS=5):
+            self.assertIsInstance(self.post({'sources': sources, 'targets': targets}), StreamingHttpResponse)
+        response = self.post({'sources': sources, 'targets': targets, 'stream': True})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        async def collect():
+            return [chunk async for chunk in response.streaming_content]
+
+        events = sse_events(async_to_sync(collect)())
+        self.assertEqual([(e['data']['batch'], e['data']['fetched'], e['data']['more_pending']) for e in events],
+                         [(1, 2, True), (2, 3, False)])
+        rows = [row for e in events for row in e['data']['items']]
+        self.assertEqual([row['source'] for row in rows], sources)
+        for row in rows:
+            for target, distance in zip(targets, row['distances']):
+                self.assertAlmostEqual(distance, self.expected_cost(row['source'], target))
+
+
+class TileViewTests(SimpleTestCase):
+    def test_tile_coordinates_are_validated(self):
+        self.assertTrue(tile_bounds_valid(0, 0, 0))
+        self.assertTrue(tile_bounds_valid(3, 7, 7))
+        self.assertFalse(tile_bounds_valid(3, 8, 0))
+        self.assertFalse(tile_bounds_valid(25, 0, 0))
+
+        request = RequestFactory().get('/api/tiles/base_floor/3/8/0.mvt')
+        self.assertEqual(async_to_sync(tile_view)(request, 'base_floor', 3, 8, 0).status_code, 400)
+        request = RequestFactory().get('/api/tiles/nav_edges/0/0/0.mvt')
+        self.assertEqual(async_to_sync(tile_view)(request, 'nav_edges', 0, 0, 0).status_code, 404)
+
+    @override_settings(ASYNC_DB_POOL=False, TILE_CACHE_MAX_AGE=3600)
+    def test_tiles_revalidate_on_the_layer_data_version(self):
+        version = DataVersion(3, datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc))
+        etag = etag_for('base_floor', version)
+        with mock.patch('interactive_maps_backend_main.versioning.get_data_version', return_value=version), \
+                mock.patch.object(views, 'build_tile', return_value=b'\x1a\x00') as build_tile:
+            response = async_to_sync(tile_view)(RequestFactory().get('/api/tiles/base_floor/3/4/2.mvt'),
+                                                'base_floor', 3, 4, 2)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['ETag'], etag)
+            self.assertIn('Last-Modified', response)
+            self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+
+            request = RequestFactory().get('/api/tiles/base_floor/3/4/2.mvt', HTTP_IF_NONE_MATCH=etag)
+            response = async_to_sync(tile_view)(request, 'base_floor', 3, 4, 2)
+        self.assertEqual(response.status_code, 304)
+        build_tile.assert_called_once()
+
+
+class SpatialFilterTests(SimpleTestCase):
+    def test_bbox_and_zoom_parsing(self):
+        self.assertEqual(parse_bbox('39.2,-6.8,39.3,-6.7'), (39.2, -6.8, 39.3, -6.7))
+        self.assertIsNone(parse_bbox(None))
+        for bad in ('1,2,3', 'a,b,c,d', '2,0,1,1', 'nan,0,1,1'):
+            with self.assertRaises(ValueError):
+                parse_bbox(bad)
+        self.assertEqual(parse_zoom('18'), 18)
+        with self.assertRaises(ValueError):
+            parse_zoom('30')
+
+    def test_lower_zoom_means_fewer_digits_and_simplification(self):
+        sql, params = geojson_expression('g', 10)
+        self.assertIn('ST_SimplifyPreserveTopology', sql)
+        coarse_digits = params[-1]
+        sql, params = geojson_expression('g', 21)
+        self.assertNotIn('ST_SimplifyPreserveTopology', sql)
+        self.assertGreater(params[-1], coarse_digits)
+
+    def test_select_params_precede_filter_and_keyset_params(self):
+        query = _base_floor_query(bbox=(0.0, 1.0, 2.0, 3.0), zoom=10)
+        sql, params = query.page(after=[5], limit=20)
+        self.assertEqual(sql.count('%s'), len(params))
+        self.assertIn('&& ST_SetSRID(ST_Transform(ST_MakeEnvelope', sql)
+        self.assertEqual(params[2:], [0.0, 1.0, 2.0, 3.0, 0.0, 1.0, 2.0, 3.0, 5, 20])
+
+    def test_bbox_envelope_uses_the_column_srid(self):
+        where, params = bbox_filter('wkb_geometry', (39.2, -6.8, 39.3, -6.7), 'room_points')
+        self.assertEqual(params, [39.2, -6.8, 39.3, -6.7] * 2)
+        self.assertEqual(sum(clause.count('%s') for clause in where), len(params))
+        envelope = ("ST_SetSRID(ST_Transform(ST_MakeEnvelope(%s, %s, %s, %s, 4326), "
+                    "COALESCE(NULLIF((SELECT ST_SRID(wkb_geometry) FROM room_points LIMIT 1), 0), 4326)), "
+                    "(SELECT ST_SRID(wkb_geometry) FROM room_points LIMIT 1))")
+        self.assertEqual(where, [f'wkb_geometry && {envelope}', f'ST_Intersects(wkb_geometry, {envelope})'])
+        self.assertEqual(bbox_filter('wkb_geometry', None, 'room_points'), ([], []))
+
+
+@override_settings(ASYNC_DB_POOL=False)
+class SQLSerializedStreamTests(SimpleTestCase):
+    def test_sse_frames_splice_items_serialized_by_sql(self):
+        features = [{'ogc_fid': i, 'layer': 'L1', 'geometry': {'type': 'LineString', 'coordinates': [[i, 0], [i, 1]]}}
+                    for i in (1, 2, 3)]
+        rows = [{'ogc_fid': f['ogc_fid'], 'item': json.dumps(f)} for f in features]
+        query = _base_floor_query()
+
+        async def collect():
+            return [frame async for frame in _sse_batch_stream(query, batch_size=2)]
+
+        with mock.patch('interactive_maps_backend_main.views._fetch_rows', side_effect=[rows[:2], rows[2:]]):
+            frames = async_to_sync(collect)()
+
+        self.assertTrue(all(f.endswith(b'\n\n') for f in frames))
+        events = sse_events(frames)
+        self.assertEqual(events[0], {'retry': '3000'})
+        payloads = [e['data'] for e in events[1:]]
+        self.assertEqual([p['items'] for p in payloads], [features[:2], features[2:]])
+        self.assertEqual([p['more_pending'] for p in payloads], [True, False])
+        self.assertEqual(query.decode(payloads[0]['cursor']), [2])
+
+
+class PrefetchTests(SimpleTestCase):
+    def test_fetches_ahead_up_to_depth_and_overlaps_sending(self):
+        fetched = []
+
+        async def source():
+            for i in range(6):
+                await asyncio.sleep(0.03)  # "DB" time
+                fetched.append(i)
+                yield i
+
+        async def consume():
+            seen, ahead = [], []
+            started = time.perf_counter()
+            async for item in prefetch(source(), depth=2):
+                await asyncio.sleep(0.03)  # "network" time
+                seen.append(item)
+                ahead.append(len(fetched) - len(seen))
+            return seen, ahead, time.perf_counter() - started
+
+        seen, ahead, elapsed = async_to_sync(consume)()
+        self.assertEqual(seen, list(range(6)))
+        self.assertLessEqual(max(ahead), 2)
+        # Serial would be 6 * (30 + 30) ms; pipelined about 7 * 30 ms
+        self.assertLess(elapsed, 0.3)
+
+    def test_early_close_cancels_the_fetch_and_closes_the_source(self):
+        events = []
+
+        async def source():
+            try:
+                yield 0
+                await asyncio.sleep(10)
+                yield 1
+            except asyncio.CancelledError:
+                events.append('cancelled')
+                raise
+            finally:
+                events.append('closed')
+
+        async def consume():
+            stream = prefetch(source(), depth=1)
+            first = await stream.__anext__()
+            await asyncio.sleep(0.01)  # the producer is now waiting on the next "fetch"
+            await stream.aclose()
+            return first
+
+        self.assertEqual(async_to_sync(consume)(), 0)
+        self.assertEqual(events, ['cancelled', 'closed'])
+
+    def test_source_errors_reach_the_consumer_after_earlier_items(self):
+        async def source():
+            yield 1
+            raise OperationalError('boom')
+
+        async def consume():
+            seen = []
+            with self.assertRaises(OperationalError):
+                async for item in prefetch(source(), depth=3):
+                    seen.append(item)
+            return seen
+
+        self.assertEqual(async_to_sync(consume)(), [1])
+
+
+@override_settings(ASYNC_DB_POOL=False, ROOM_CATALOG=False)
+class LayersStreamTests(SimpleTestCase):
+    def test_interleaves_layers_as_named_events_and_reports_done(self):
+        floor = [{'ogc_fid': i, 'item': json.dumps({'ogc_fid': i})} for i in range(3)]
+        rooms = [{'ogc_fid': 7, 'text': 'Lab', 'item': json.dumps({'ogc_fid': 7, 'text': 'Lab'})}]
+
+        def fetch_rows(sql, params):
+            return floor if 'FROM base_floor' in sql else rooms
+
+        async def collect():
+            response = await layers_stream_view(RequestFactory().get('/api/layers/stream/?layers=rooms,base_floor'))
+            return response, [frame async for frame in response.streaming_content]
+
+        with mock.patch('interactive_maps_backend_main.views._fetch_rows', side_effect=fetch_rows), \
+                mock.patch('interactive_maps_backend_main.views.get_data_version', return_value=None):
+            response, frames = async_to_sync(collect)()
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = [(e['event'], e['data']) for e in sse_events(frames) if 'data' in e]
+        by_layer = {name: [payload for n, payload in events if n == name] for name in ('base_floor', 'rooms')}
+        self.assertEqual([item['ogc_fid'] for item in by_layer['base_floor'][0]['items']], [0, 1, 2])
+        self.assertEqual(by_layer['rooms'][0]['items'], [{'ogc_fid': 7, 'text': 'Lab'}])
+        self.assertEqual(events[-1], ('done', {'layers': {'rooms': {'batches': 1, 'fetched': 1},
+                                                          'base_floor': {'batches': 1, 'fetched': 3}}}))
+
+    def test_reconnect_resumes_every_layer_and_skips_finished_ones(self):
+        floor = [{'ogc_fid': i, 'item': json.dumps({'ogc_fid': i})} for i in range(1, 5)]
+        rooms = [{'ogc_fid': 7, 'text': 'Lab', 'item': json.dumps({'ogc_fid': 7, 'text': 'Lab'})}]
+
+        def fetch_rows(sql, params):
+            if 'FROM room_points' in sql:
+                return rooms
+            after = params[-2] if 'WHERE' in sql else 0
+            return [r for r in floor if r['ogc_fid'] > after][:params[-1]]
+
+        def stream(last_event_id=None):
+            headers = {'HTTP_LAST_EVENT_ID': last_event_id} if last_event_id else {}
+
+            async def collect():
+                response = await layers_stream_view(RequestFactory().get('/api/layers/stream/', **headers))
+                if response.status_code != 200:
+                    return response, []
+                return response, [frame async for frame in response.streaming_content]
+
+            with mock.patch('interactive_maps_backend_main.views._fetch_rows', side_effect=fetch_rows), \
+                    mock.patch('interactive_maps_backend_main.views.get_data_version', return_value=None), \
+                    mock.patch('interactive_maps_backend_main.views.DEFAULT_BATCH_SIZE', 2):
+                response, frames = async_to_sync(collect)()
+            return response, [e for e in sse_events(frames) if 'data' in e]
+
+        _, events = stream()
+        self.assertEqual(len([e for e in events if e['event'] == 'base_floor']), 3)
+        # Resume after the rooms layer finished and base_floor sent its first batch
+        _, resumed = stream(encode_positions([StreamPosition(None, 1, 2, [2], False),
+                                              StreamPosition(None, 1, 1, ['Lab', 7], True)]))
+        self.assertNotIn('rooms', [e['event'] for e in resumed])
+        self.assertEqual([item['ogc_fid'] for e in resumed if e['event'] == 'base_floor' for item in e['data']['items']],
+                         [3, 4])
+        self.assertEqual(resumed[-1]['data']['layers']['base_floor'], {'batches': 3, 'fetched': 4})
+
+        response, _ = stream(events[-2]['id'])
+        self.assertEqual(response.status_code, 204)
+
+    def test_unknown_layer_is_rejected(self):
+        response = async_to_sync(layers_stream_view)(RequestFactory().get('/api/layers/stream/?layers=rooms,walls'))
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(ASYNC_DB_POOL=False, ROOM_CATALOG=False)
+class ResumableStreamTests(SimpleTestCase):
+    def setUp(self):
+        self.rows = [{'ogc_fid': i, 'item': json.dumps({'ogc_fid': i})} for i in range(1, 6)]
+        self.sql = []
+
+        def fetch_rows(sql, params):
+            self.sql.append((sql, params))
+            after = params[-2] if 'WHERE' in sql else 0
+            return [r for r in self.rows if r['ogc_fid'] > after][:params[-1]]
+
+        patcher = mock.patch('interactive_maps_backend_main.views._fetch_rows', side_effect=fetch_rows)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('interactive_maps_backend_main.views.DEFAULT_BATCH_SIZE', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stream(self, last_event_id=None, version=7):
+        headers = {'HTTP_LAST_EVENT_ID': last_event_id} if last_event_id else {}
+
+        async def collect():
+            response = await base_floor_view(RequestFactory().get('/api/base-floor/', **headers))
+            if response.status_code != 200:
+                return response, []
+            return response, [frame async for frame in response.streaming_content]
+
+        data_version = DataVersion(version, datetime(2024, 1, 1, tzinfo=timezone.utc))
+        with mock.patch('interactive_maps_backend_main.views.get_data_version', return_value=data_version):
+            response, frames = async_to_sync(collect)()
+        return response, [e for e in sse_events(frames) if 'data' in e]
+
+    def test_reconnect_continues_after_the_last_event(self):
+        _, events = self.stream()
+        self.assertEqual([e['data']['batch'] for e in events], [1, 2, 3])
+        self.assertEqual(StreamPosition.decode(events[0]['id'], 1), StreamPosition(7, 1, 2, [2], False))
+
+        _, resumed = self.stream(last_event_id=events[0]['id'])
+        self.assertEqual([item['ogc_fid'] for e in resumed for item in e['data']['items']], [3, 4, 5])
+        self.assertEqual([(e['data']['batch'], e['data']['fetched']) for e in resumed], [(2, 4), (3, 5)])
+        self.assertNotIn('reset', resumed[0]['data'])
+
+    def test_finished_stream_answers_204_and_stale_ids_restart_with_reset(self):
+        _, events = self.stream()
+        response, _ = self.stream(last_event_id=events[-1]['id'])
+        self.assertEqual(response.status_code, 204)
+
+        _, restarted = self.stream(last_event_id=events[0]['id'], version=8)
+        self.assertEqual(restarted[0]['data']['batch'], 1)
+        self.assertTrue(restarted[0]['data']['reset'])
+        _, restarted = self.stream(last_event_id='garbage')
+        self.assertTrue(restarted[0]['data']['reset'])
+
+    def test_heartbeats_fill_silences_without_cancelling_the_fetch(self):
+        async def slow():
+            yield b'a'
+            await asyncio.sleep(0.05)
+            yield b'b'
+
+        async def collect():
+            return [chunk async for chunk in with_heartbeats(slow(), interval=0.01)]
+
+        chunks = async_to_sync(collect)()
+        self.assertEqual([c for c in chunks if c != b': keepalive\n\n'], [b'a', b'b'])
+        self.assertGreaterEqual(chunks.count(b': keepalive\n\n'), 2)
+
+
+@override_settings(ASYNC_DB_POOL=False)
+class SyncTests(SimpleTestCase):
+    def sync(self, query_string, window=SyncWindow(100, 250), rows=()):
+        fetched = []
+
+        def fetch_rows(sql, params):
+            fetched.append((sql, params))
+            return list(rows) if 'room_points' in params else []
+
+        async def collect():
+            response = await sync_view(RequestFactory().get(f'/api/sync/{query_string}'))
+            if not response.streaming:
+                return response, []
+            return response, [frame async for frame in response.streaming_content]
+
+        with mock.patch('interactive_maps_backend_main.views.sync_window', return_value=window), \
+                mock.patch('interactive_maps_backend_main.views._fetch_rows', side_effect=fetch_rows):
+            response, frames = async_to_sync(collect)()
+        return response, [e for e in sse_events(frames) if 'data' in e], fetched
+
+    def test_without_since_returns_the_current_version(self):
+        response, _, _ = self.sync('')
+        self.assertEqual(json.loads(response.content), {'version': 250})
+
+    def test_streams_changes_in_the_window_and_ends_with_the_next_version(self):
+        changes = [{'ogc_fid': 3, 'item': json.dumps({'op': 'update', 'ogc_fid': 3, 'item': {'ogc_fid': 3, 'text': 'Lab'}})},
+                   {'ogc_fid': 9, 'item': json.dumps({'op': 'delete', 'ogc_fid': 9, 'item': None})}]
+        _, events, fetched = self.sync('?since=120&layers=rooms,base_floor', rows=changes)
+
+        rooms = [e for e in events if e['event'] == 'rooms']
+        self.assertEqual([c['op'] for c in rooms[0]['data']['items']], ['update', 'delete'])
+        self.assertNotIn('id', rooms[0])
+        self.assertEqual(events[-1]['event'], 'done')
+        self.assertEqual(events[-1]['data']['version'], 250)
+        self.assertEqual(sorted(params[:3] for _, params in fetched), [['base_floor', 120, 250], ['room_points', 120, 250]])
+
+    def test_pruned_or_future_versions_are_rejected(self):
+        self.assertEqual(self.sync('?since=99')[0].status_code, 410)
+        self.assertEqual(self.sync('?since=251')[0].status_code, 400)
+        self.assertEqual(self.sync('?since=abc')[0].status_code, 400)
+
+    def test_changes_query_placeholders_match_params(self):
+        sql, params = changes_query('base_floor', _base_floor_query(), 5, 9).page(after=[4], limit=10)
+        self.assertEqual(sql.count('%s'), len(params))
+        self.assertEqual(params[:3], ['base_floor', 5, 9])
+        self.assertEqual(params[-2:], [4, 10])
+
+
+class FastJSONRendererTests(SimpleTestCase):
+    def test_renders_compact_bytes_like_json_renderer(self):
+        data = {'distance_meters': Decimal('12.5'), 'route': {'type': 'LineString', 'coordinates': [[39.2, -6.8]]},
+                'name': 'Salle é'}
+        body = FastJSONRenderer().render(data)
+        self.assertIsInstance(body, bytes)
+        self.assertEqual(json.loads(body), {'distance_meters': 12.5, 'route': data['route'], 'name': 'Salle é'})
+        self.assertNotIn(b', ', body)
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+
+@override_settings(ASYNC_DB_POOL=False)
+class BinaryGeometryTests(SimpleTestCase):
+    geometries = [
+        {'type': 'Point', 'coordinates': [39.2083751, -6.7712345]},
+        {'type': 'LineString', 'coordinates': [[39.2083751, -6.7712345, 0.0], [39.2084012, -6.7712001, 3.5]]},
+        {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [1, 1], [0, 0]], [[0.2, 0.2], [0.4, 0.2], [0.2, 0.4], [0.2, 0.2]]]},
+        {'type': 'MultiPolygon', 'coordinates': [[[[0, 0], [1, 0], [0, 1], [0, 0]]], [[[5, 5], [6, 5], [5, 6], [5, 5]]]]},
+        {'type': 'GeometryCollection', 'geometries': [{'type': 'MultiPoint', 'coordinates': [[1, 2], [3, 4]]},
+                                                      {'type': 'MultiLineString', 'coordinates': [[[1, 2], [3, 4]]]}]},
+    ]
+
+    def assertCoordinatesAlmostEqual(self, a, b):
+        if isinstance(a, list):
+            self.assertEqual(len(a), len(b))
+            for x, y in zip(a, b):
+                self.assertCoordinatesAlmostEqual(x, y)
+        else:
+            self.assertAlmostEqual(a, b, places=7)
+
+    def test_geometries_round_trip_at_the_quantization_precision(self):
+        items = [{'ogc_fid': i, 'text': 'Lab é', 'geometry': g} for i, g in enumerate(self.geometries)]
+        frames = decode_frames(encode_document(items, 7, 'base_floor'))
+
+        self.assertEqual(frames[0], {'header': {'precision': 7, 'layer': 'base_floor'}})
+        decoded = frames[1]['batch']['items']
+        for item, back in zip(items, decoded):
+            self.assertEqual({k: v for k, v in back.items() if k != 'geometry'}, {'ogc_fid': item['ogc_fid'], 'text': 'Lab é'})
+            self.assertEqual(back['geometry']['type'], item['geometry']['type'])
+        self.assertCoordinatesAlmostEqual(decoded[1]['geometry']['coordinates'], self.geometries[1]['coordinates'])
+        self.assertEqual(decoded[3]['geometry'], self.geometries[3])
+        self.assertEqual(decoded[4]['geometry']['geometries'][1], self.geometries[4]['geometries'][1])
+
+    def test_delta_encoding_is_much_smaller_than_geojson(self):
+        line = {'type': 'LineString', 'coordinates': [[39.2083751 + i * 1e-6, -6.7712345 + i * 2e-6, 0.0] for i in range(500)]}
+        item = {'ogc_fid': 1, 'geometry': line}
+        self.assertLess(len(encode_document(item, 7)) * 5, len(json.dumps(item)))
+
+    def test_base_floor_negotiates_binary_pages_and_streams(self):
+        features = [{'ogc_fid': i, 'layer': 'L1', 'geometry': {'type': 'LineString', 'coordinates': [[i, 0], [i, 1]]}}
+                    for i in (1, 2, 3)]
+        rows = [{'ogc_fid': f['ogc_fid'], 'item': json.dumps(f)} for f in features]
+
+        async def get(url, **headers):
+            response = await base_floor_view(RequestFactory().get(url, **headers))
+            body = b''.join([f async for f in response.streaming_content]) if response.streaming else response.content
+            return response, body
+
+        with mock.patch('interactive_maps_backend_main.views.validators_for', return_value=(None, None)), \
+                mock.patch('interactive_maps_backend_main.views._fetch_rows', side_effect=[rows[:2], rows[:2], rows[2:]]):
+            response, body = async_to_sync(get)('/api/base-floor/?limit=2', HTTP_ACCEPT='application/x-protobuf')
+            self.assertEqual(response['Content-Type'], 'application/x-protobuf')
+            self.assertIn('Accept', response['Vary'])
+            batch = decode_frames(body)[1]['batch']
+            self.assertEqual(batch['items'], features[:2])
+            self.assertEqual(batch['cursor'], response['X-Next-Cursor'])
+
+            with mock.patch('interactive_maps_backend_main.views.DEFAULT_BATCH_SIZE', 2):
+                response, body = async_to_sync(get)('/api/base-floor/', HTTP_ACCEPT='application/x-protobuf')
+            self.assertEqual(response['Content-Type'], 'application/x-protobuf')
+            frames = decode_frames(body)
+            self.assertEqual(frames[0]['header']['layer'], 'base_floor')
+            self.assertEqual([f['batch']['items'] for f in frames[1:]], [features[:2], features[2:]])
+            self.assertEqual([f['batch']['more_pending'] for f in frames[1:]], [True, False])
+
+    def test_json_stays_the_default(self):
+        factory = RequestFactory()
+        self.assertFalse(wants_protobuf(factory.get('/')))
+        self.assertFalse(wants_protobuf(factory.get('/', HTTP_ACCEPT='*/*')))
+        self.assertFalse(wants_protobuf(factory.get('/', HTTP_ACCEPT='application/json, application/x-protobuf;q=0.5')))
+        self.assertTrue(wants_protobuf(factory.get('/', HTTP_ACCEPT='application/x-protobuf')))
+
+    @override_settings(BINARY_GEOMETRY_PRECISION=5)
+    def test_route_renderer(self):
+        data = {'distance_meters': 12.5, 'route': {'type': 'LineString', 'coordinates': [[39.208376, -6.771234]]}}
+        frames = decode_frames(ProtobufRenderer().render(data))
+        self.assertEqual(frames[0]['header']['precision'], 5)
+        self.assertEqual(frames[1]['batch']['items'], [{'distance_meters': 12.5, 'route': {'type': 'LineString', 'coordinates': [[39.20838, -6.77123]]}}])
+
+
+class BaseFloorSnapshotTests(SimpleTestCase):
+    collection = b'{"type":"FeatureCollection","features":[{"type":"Feature","id":1,"geometry":null,"properties":{}}]}'
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        overrides = override_settings(SNAPSHOT_DIR=tmp.name, SNAPSHOT_X_ACCEL_REDIRECT='')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        def fake_write_features(fh, hasher):
+            fh.write(self.collection)
+            hasher.update(self.collection)
+            return 1
+
+        for patcher in (mock.patch.object(snapshots, '_write_features', side_effect=fake_write_features),
+                        mock.patch.object(snapshots, 'get_data_version', return_value=None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_serves_precompressed_file_with_strong_etag(self):
+        manifest = snapshots.build_base_floor_snapshot()
+        self.assertEqual(snapshots.build_base_floor_snapshot()['version'], manifest['version'])
+
+        request = RequestFactory().get('/api/base-floor/?snapshot=1', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        response = snapshots.serve_snapshot(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['ETag'], f'"{manifest["version"]}-gzip"')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.collection)
+        response.close()
+
+        request = RequestFactory().get('/api/base-floor/?snapshot=1', HTTP_IF_NONE_MATCH=f'"{manifest["version"]}"')
+        self.assertEqual(snapshots.serve_snapshot(request).status_code, 304)
+
+    def test_concurrent_rebuilds_do_not_share_temp_files(self):
+        compress = snapshots._compress
+
+        def slow_compress(*args):
+            # Hold the partial file until the other builds have written theirs
+            compress(*args)
+            time.sleep(0.05)
+
+        errors = []
+
+        def build():
+            try:
+                snapshots.build_base_floor_snapshot()
+            except Exception as e:
+                errors.append(e)
+
+        with mock.patch.object(snapshots, '_compress', side_effect=slow_compress):
+            threads = [threading.Thread(target=build) for _ in range(3)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join(5)
+        self.assertEqual(errors, [])
+        self.assertFalse([name for name in os.listdir(snapshots.snapshot_dir()) if name.endswith('.tmp')])
+
+    def test_stale_snapshot_is_served_while_rebuilding_in_background(self):
+        manifest = snapshots.build_base_floor_snapshot()
+        changed = DataVersion(2, datetime(2024, 5, 1, tzinfo=timezone.utc))
+        with mock.patch.object(snapshots, 'get_data_version', return_value=changed), \
+                mock.patch.object(snapshots, '_start_rebuild') as start_rebuild, \
+                mock.patch.object(snapshots, 'build_base_floor_snapshot') as build:
+            self.assertEqual(snapshots.get_or_build_manifest(), manifest)
+        start_rebuild.assert_called_once_with()
+        build.assert_not_called()
+
+        with mock.patch.object(snapshots, 'get_data_version', return_value=changed):
+            # Another process holds the build lock: this one leaves the rebuild to it
+            with snapshots.build_lock():
+                snapshots._rebuilding.acquire()
+                snapshots._rebuild_if_stale()
+            self.assertIsNone(snapshots.load_manifest()['data_version'])
+
+            snapshots._rebuilding.acquire()
+            snapshots._rebuild_if_stale()
+            self.assertEqual(snapshots.load_manifest()['data_version'], 2)
+        self.assertFalse(snapshots._rebuilding.locked())
+
+    def test_negotiates_encoding(self):
+        available = {'identity': 'a', 'gzip': 'b'}
+        self.assertEqual(snapshots.negotiate_encoding('br, gzip', available), 'gzip')
+        self.assertEqual(snapshots.negotiate_encoding('gzip;q=0', available), 'identity')
+        self.assertEqual(snapshots.negotiate_encoding('', available), 'identity')
+
+
+@override_settings(ROOM_CATALOG=False)
+class ConditionalGetTests(SimpleTestCase):
+    def setUp(self):
+        version = DataVersion(7, datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc))
+        patcher = mock.patch('interactive_maps_backend_main.versioning.get_data_version', return_value=version)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.etag = etag_for('room_points', version)
+
+    def test_rooms_page_revalidates_without_querying_rows(self):
+        view = RoomsListAPIView.as_view()
+        rows = [{'text': 'A', 'ogc_fid': 1, 'item': '{"id":1,"name":"A","location":null}'}]
+        with mock.patch.object(RoomsListAPIView, '_execute_and_fetch', return_value=rows) as fetch:
+            response = view(RequestFactory().get('/api/rooms/?limit=10'))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['ETag'], self.etag)
+            self.assertEqual(response['Last-Modified'], 'Wed, 01 May 2024 12:00:00 GMT')
+            self.assertIn('max-age=', response['Cache-Control'])
+
+            response = view(RequestFactory().get('/api/rooms/?limit=10', HTTP_IF_NONE_MATCH=self.etag))
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(fetch.call_count, 1)
+
+            response = view(RequestFactory().get('/api/rooms/?limit=10', HTTP_IF_NONE_MATCH='W/"room_points.6"'))
+            self.assertEqual(response.status_code, 200)
+
+    def test_binary_representation_has_its_own_etag(self):
+        view = RoomsListAPIView.as_view()
+        rows = [{'text': 'A', 'ogc_fid': 1, 'item': '{"id":1,"name":"A","location":null}'}]
+        protobuf = {'HTTP_ACCEPT': 'application/x-protobuf'}
+        with mock.patch.object(RoomsListAPIView, '_execute_and_fetch', return_value=rows):
+            response = view(RequestFactory().get('/api/rooms/?limit=10', **protobuf))
+            self.assertEqual(response['ETag'], 'W/"room_points.7.protobuf"')
+            self.assertIn('Accept', response['Vary'])
+
+            # A cached JSON body must not be revalidated as the binary one, nor the reverse
+            response = view(RequestFactory().get('/api/rooms/?limit=10', HTTP_IF_NONE_MATCH=self.etag, **protobuf))
+            self.assertEqual(response.status_code, 200)
+            response = view(RequestFactory().get('/api/rooms/?limit=10', HTTP_IF_NONE_MATCH='W/"room_points.7.protobuf"'))
+            self.assertEqual(response.status_code, 200)
+
+            response = view(RequestFactory().get('/api/rooms/?limit=10', HTTP_IF_NONE_MATCH='W/"room_points.7.protobuf"',
+                                                 **protobuf))
+            self.assertEqual(response.status_code, 304)
+            self.assertIn('Accept', response['Vary'])
+
+
+class StreamingCompressionTests(SimpleTestCase):
+    def test_sse_events_are_flushed_one_by_one(self):
+        frames = [f"data: {json.dumps({'batch': i, 'items': ['x' * 50] * 20})}\n\n".encode() for i in range(3)]
+
+        async def events():
+            for frame in frames:
+                yield frame
+
+        request = RequestFactory().get('/api/base-floor/', HTTP_ACCEPT_ENCODING='gzip')
+        response = StreamingCompressionMiddleware(lambda r: None).process_response(
+            request, StreamingHttpResponse(events(), content_type='text/event-stream'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+        async def collect():
+            return [chunk async for chunk in response.streaming_content]
+
+        chunks = async_to_sync(collect)()
+        decompressor = zlib.decompressobj(31)
+        # Every chunk decodes to exactly one event without waiting for the next one
+        for frame, chunk in zip(frames, chunks):
+            self.assertEqual(decompressor.decompress(chunk), frame)
+        self.assertLess(sum(len(c) for c in chunks), sum(len(f) for f in frames))
+
+    def test_closing_compressed_stream_closes_the_view_generator(self):
+        closed = []
+
+        async def events():
+            try:
+                for i in range(100):
+                    yield f'data: {i}\n\n'.encode() * 50
+            finally:
+                closed.append(True)  # where the SSE views close their cursor
+
+        # Held here so that only an explicit close, not garbage collection or the event loop
+        # shutting down, runs the `finally`
+        source = events()
+        request = RequestFactory().get('/api/base-floor/', HTTP_ACCEPT_ENCODING='gzip')
+        response = StreamingCompressionMiddleware(lambda r: None).process_response(
+            request, StreamingHttpResponse(source, content_type='text/event-stream'))
+
+        async def disconnect():
+            # The compressed stream the middleware installed; reading `streaming_content`
+            # would wrap it in yet another generator
+            stream = response._iterator
+            await stream.__anext__()
+            await stream.aclose()
+            return list(closed)
+
+        self.assertEqual(async_to_sync(disconnect)(), [True])
+
+    def test_large_json_compressed_small_and_encoded_left_alone(self):
+        middleware = StreamingCompressionMiddleware(lambda r: None)
+        request = RequestFactory().get('/api/rooms/?limit=1000', HTTP_ACCEPT_ENCODING='br;q=0, gzip')
+        body = json.dumps([{'id': i, 'name': f'Room {i}'} for i in range(500)]).encode()
+
+        response = middleware.process_response(request, HttpResponse(body, content_type='application/json'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(zlib.decompress(response.content, 31), body)
+
+        response = middleware.process_response(request, HttpResponse(b'[]', content_type='application/json'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        precompressed = HttpResponse(b'x' * 5000, content_type='application/geo+json')
+        precompressed['Content-Encoding'] = 'br'
+        self.assertEqual(middleware.process_response(request, precompressed).content, b'x' * 5000)
+
+
+class AsyncDBTests(SimpleTestCase):
+    @override_settings(DATABASES={'default': {'NAME': 'maps', 'USER': 'app', 'PASSWORD': '', 'HOST': 'db',
+                                              'PORT': '5432', 'OPTIONS': {'connect_timeout': 5}}})
+    def test_conninfo_from_django_settings(self):
+        if async_db.psycopg is None:
+            self.skipTest('psycopg is not installed')
+        info = dict(part.split('=', 1) for part in async_db.conninfo().split())
+        self.assertEqual(info, {'dbname': 'maps', 'user': 'app', 'host': 'db', 'port': '5432', 'connect_timeout': '5'})
+
+    @override_settings(DATABASES={'default': {'NAME': 'maps', 'USER': 'app', 'HOST': 'db', 'OPTIONS': {
+        'sslmode': 'require', 'isolation_level': 1, 'pool': True, 'server_side_binding': True,
+        'assume_role': 'reader', 'cursor_factory': object}}})
+    def test_conninfo_drops_django_only_options(self):
+        if async_db.psycopg is None:
+            self.skipTest('psycopg is not installed')
+        info = dict(part.split('=', 1) for part in async_db.conninfo().split())
+        self.assertEqual(info, {'dbname': 'maps', 'user': 'app', 'host': 'db', 'sslmode': 'require'})
+
+    def test_keyset_batches_use_the_async_pool_when_enabled(self):
+        rows = [{'ogc_fid': 1, 'item': '{}'}]
+        query = _base_floor_query()
+
+        async def collect():
+            return [frame async for frame in _sse_batch_stream(query, batch_size=10)]
+
+        with mock.patch.object(async_db, 'enabled', return_value=True), \
+                mock.patch.object(async_db, 'fetch_all', new=mock.AsyncMock(return_value=rows)) as fetch_all, \
+                mock.patch('interactive_maps_backend_main.views._fetch_rows') as fetch_rows:
+            frames = async_to_sync(collect)()
+
+        self.assertEqual(len(frames), 2)  # retry hint + one batch
+        fetch_all.assert_awaited_once()
+        fetch_rows.assert_not_called()
+
+
+class QueryCancellationTests(SimpleTestCase):
+    def test_cancel_all_cancels_running_queries_and_counts_saved_time(self):
+        raw = mock.Mock(spec=['cancel'])
+        query_stats.record('SELECT slow()', 10.0)
+        before = query_stats.stats()
+        tracker = RequestQueries()
+        tracker.start(raw.cancel, 'SELECT slow()')
+
+        self.assertEqual(tracker.cancel_all(), 1)
+        raw.cancel.assert_called_once_with()
+        after = query_stats.stats()
+        self.assertEqual(after['cancelled_queries'], before['cancelled_queries'] + 1)
+        self.assertGreater(after['estimated_saved_ms'], before['estimated_saved_ms'])
+        self.assertTrue(tracker.cancelled)
+
+    def test_middleware_cancels_tracked_query_when_request_is_cancelled(self):
+        started, finished = threading.Event(), threading.Event()
+        raw = mock.Mock(spec=['cancel'])
+        raw.cancel.side_effect = finished.set
+
+        def view(request):
+            # A sync view blocked in the database, as RouteAPIView runs under ASGI
+            with track_query(raw, 'SELECT get_route_between_rooms(1, 2)'):
+                started.set()
+                finished.wait(5)
+
+        async def disconnect():
+            middleware = QueryCancellationMiddleware(sync_to_async(view))
+            task = asyncio.ensure_future(middleware(RequestFactory().get('/api/route/')))
+            while not started.is_set():
+                await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        async_to_sync(disconnect)()
+        raw.cancel.assert_called_once_with()
+
+    def test_closing_streaming_response_cancels_query_and_closes_view_generator(self):
+        raw = mock.Mock(spec=['cancel'])
+        closed = []
+
+        async def events():
+            try:
+                for i in range(3):
+                    # Like the SSE views: a batch fetched on a named cursor, then yielded
+                    with track_query(raw, 'FETCH 500 FROM base_floor'):
+                        yield f'data: {i}\n\n'
+            finally:
+                closed.append(True)
+
+        # Held here so that only an explicit close, not garbage collection, runs the `finally`
+        source = events()
+
+        async def view(request):
+            return StreamingHttpResponse(source, content_type='text/event-stream')
+
+        async def disconnect():
+            response = await QueryCancellationMiddleware(view)(RequestFactory().get('/api/base-floor/'))
+            stream = response._iterator
+            await stream.__anext__()
+            await stream.aclose()
+            return list(closed)
+
+        self.assertEqual(async_to_sync(disconnect)(), [True])
+        raw.cancel.assert_called_once_with()
+
+
+class RoomSearchIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = RoomSearchIndex(
+            [1, 2, 3, 4, 5], ['Computer Lab 2', 'Lab 204', 'Laboratory', 'Main Office', 'Lecture Hall A'])
+
+    def test_trigrams_match_pg_trgm(self):
+        # SELECT show_trgm('Lab 2') -> {"  2","  l"," 2 "," la","ab ",lab}
+        self.assertEqual(trigrams('lab 2'), {'  2', '  l', ' 2 ', ' la', 'ab ', 'lab'})
+
+    def test_prefix_matches_rank_names_before_words(self):
+        result = self.index.search('lab', limit=5)
+        self.assertEqual([m.id for m in result.matches], [2, 3, 1])
+        self.assertFalse(result.truncated)
+        self.assertEqual(self.index.search('lab 204').matches[0].score, 3.0)
+
+    def test_misspellings_match_by_trigram_similarity(self):
+        self.assertEqual([m.name for m in self.index.search('labortory').matches], ['Laboratory'])
+        self.assertEqual([m.name for m in self.index.search('main ofice').matches], ['Main Office'])
+        self.assertEqual(self.index.search('zzz').matches, [])
+
+
+@override_settings(ROOM_SEARCH_INDEX=True)
+class RoomAutocompleteViewTests(SimpleTestCase):
+    def setUp(self):
+        self.index = RoomSearchIndex(range(1, 61), [f'Lab {n}' for n in range(1, 61)])
+        version = DataVersion(3, datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc))
+        self.etag = etag_for('room_points', version)
+        for patcher in (mock.patch.object(views, 'get_room_search_index', return_value=self.index),
+                        mock.patch('interactive_maps_backend_main.versioning.get_data_version', return_value=version)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get(self, query, **headers):
+        return RoomAutocompleteAPIView.as_view()(RequestFactory().get('/api/rooms/autocomplete/' + query, **headers))
+
+    def test_response_shape_and_revalidation(self):
+        response = self.get('?q=lab 1&limit=3')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.rendered_content)
+        self.assertEqual(data, {
+            'results': [{'id': 1, 'name': 'Lab 1', 'score': 3.0}, {'id': 10, 'name': 'Lab 10', 'score': 2.0},
+                        {'id': 11, 'name': 'Lab 11', 'score': 2.0}],
+            'truncated': False,
+        })
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertTrue(response['Cache-Control'].startswith('public'))
+        self.assertEqual(self.get('?q=lab 1&limit=3', HTTP_IF_NONE_MATCH=self.etag).status_code, 304)
+
+    def test_limit_is_validated_and_capped(self):
+        for bad in ('abc', '0', '-5'):
+            self.assertEqual(self.get(f'?q=lab&limit={bad}').status_code, 400, bad)
+        self.assertEqual(len(self.get('?q=lab').data['results']), 10)
+        with mock.patch.object(self.index, 'search', wraps=self.index.search) as search:
+            response = self.get('?q=lab&limit=500')
+        search.assert_called_once_with('lab', RoomAutocompleteAPIView.MAX_LIMIT)
+        self.assertEqual(len(response.data['results']), RoomAutocompleteAPIView.MAX_LIMIT)
+        self.assertEqual(self.get('?q=').data, {'results': [], 'truncated': False})
+
+    def test_result_cut_short_by_the_budget_is_not_cacheable(self):
+        partial = SearchResult([Match(7, 'Lab 7', 0.5)], True)
+        with mock.patch.object(self.index, 'search', return_value=partial):
+            response = self.get('?q=lbb')
+        self.assertEqual(response.data, {'results': [{'id': 7, 'name': 'Lab 7', 'score': 0.5}], 'truncated': True})
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertFalse(response.has_header('ETag'))
+
+    @override_settings(ROOM_SEARCH_INDEX=False)
+    def test_database_search_without_the_index(self):
+        result = SearchResult([Match(2, 'Lab 2', 3.0)], False)
+        with mock.patch.object(views, 'search_rooms_db', return_value=result) as search_rooms_db:
+            response = self.get('?q=Lab 2&limit=5')
+        search_rooms_db.assert_called_once_with('Lab 2', 5)
+        self.assertEqual(response.data['results'], [{'id': 2, 'name': 'Lab 2', 'score': 3.0}])
+        with mock.patch.object(views, 'search_rooms_db', side_effect=OperationalError):
+            self.assertEqual(self.get('?q=lab').status_code, 503)
+
+
+class RoomCatalogTests(SimpleTestCase):
+    def setUp(self):
+        point = '{"type":"Point","coordinates":[%s,%s]}'
+        self.catalog = room_catalog.RoomCatalog([
+            (3, 'Lab 1', 39.20, -6.80, point % (39.20, -6.80)),
+            (1, 'Lab 2', 39.21, -6.81, point % (39.21, -6.81)),
+            (2, 'Office', 39.30, -6.90, point % (39.30, -6.90)),
+        ], version=4)
+
+    def test_pages_match_the_sql_keyset_pages(self):
+        query = _rooms_query('lab')
+        first = self.catalog.page('lab', None, None, None, limit=1)
+        self.assertEqual(json.loads(first[0]['item']), {'ogc_fid': 3, 'text': 'Lab 1',
+                                                         'location': {'type': 'Point', 'coordinates': [39.2, -6.8]}})
+        after = query.decode(query.cursor_after(first[-1]))
+        second = self.catalog.page('lab', None, None, after, limit=10, api_keys=True)
+        self.assertEqual([json.loads(r['item'])['id'] for r in second], [1])
+        self.assertEqual([r['ogc_fid'] for r in self.catalog.page('', (39.25, -7, 40, -6), None, None, 10)], [2])
+        self.assertIsNone(self.catalog.page('', None, None, ['Gone', 9], 10))
+
+    def test_rooms_view_is_served_without_queries(self):
+        with mock.patch('interactive_maps_backend_main.views.get_room_catalog', return_value=self.catalog), \
+                mock.patch('interactive_maps_backend_main.views.validators_for', return_value=(None, None)):
+            response = RoomsListAPIView.as_view()(RequestFactory().get('/api/rooms/?limit=2&q=lab'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['name'] for r in json.loads(response.content)], ['Lab 1', 'Lab 2'])
+
+    def test_catalog_is_rebuilt_when_room_points_changes(self):
+        rebuilt = room_catalog.RoomCatalog([], version=5)
+        with mock.patch.object(room_catalog, '_catalog', self.catalog), \
+                mock.patch.object(room_catalog, 'build_room_catalog', return_value=rebuilt), \
+                mock.patch.object(room_catalog, 'get_data_version', return_value=DataVersion(5, datetime.now())):
+            room_catalog._rebuild_room_catalog('room_points', DataVersion(5, datetime.now()))
+            self.assertIs(room_catalog._catalog, rebuilt)
+
+    def test_refresh_notifies_listeners_of_changed_tables(self):
+        old = {'room_points': DataVersion(4, datetime.now()), 'base_floor': DataVersion(1, datetime.now())}
+        new = dict(old, room_points=DataVersion(5, datetime.now()))
+        listener = mock.Mock()
+        with mock.patch.object(versioning, '_versions', old), mock.patch.object(versioning, '_fetched_at', None), \
+                mock.patch.object(versioning, '_listeners', [listener]), \
+                mock.patch.object(versioning, 'fetch_data_versions', return_value=new):
+            versioning.refresh_data_versions()
+        listener.assert_called_once_with('room_points', new['room_points'])
+
@@ -0,0 +1,93 @@
+"""Mapbox Vector Tiles for the map layers, built in PostGIS with `ST_AsMVT`.
+
+A tile only contains the features intersecting its envelope, clipped to it and quantized
+to the tile grid by `ST_AsMVTGeom`. At low zoom levels line work is additionally
+simplified with a tolerance of about one tile pixel, so a client only downloads the
+geometry in its viewport at the level of detail it can display.
+
+Source geometries are stored in EPSG:4326 (see models.py); tiles are in EPSG:3857.
+"""
+from typing import List, Tuple
+
+from django.conf import settings
+from django.db import connection
+
+# Circumference of the EPSG:3857 world, in meters
+WEB_MERCATOR_WORLD_SIZE = 40075016.685578488
+
+# Features are written with these attributes; `id_column` becomes the MVT feature id.
+TILE_LAYERS = {
+    'base_floor': {
+        'table': 'base_floor',
+        'geom_col': 'wkb_geometry',
+        'id_column': 'ogc_fid',
+        'attributes': ['layer', 'text'],
+        'simplify': True,
+    },
+    'room_points': {
+        'table': 'room_points',
+        'geom_col': 'wkb_geometry',
+        'id_column': 'ogc_fid',
+        'attributes': ['text'],
+        'simplify': False,
+    },
+}
+
+MAX_ZOOM = 24
+
+
+def tile_bounds_valid(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def simplify_tolerance(z: int, extent: int) -> float:
+    """About one tile pixel (1/extent of the tile width) in EPSG:3857 meters."""
+    return WEB_MERCATOR_WORLD_SIZE / (2 ** z) / extent
+
+
+def tile_query(layer: str, z: int, x: int, y: int) -> Tuple[str, List]:
+    """Return `(sql, params)` selecting the MVT bytes of one tile."""
+    config = TILE_LAYERS[layer]
+    extent = getattr(settings, 'TILE_EXTENT', 4096)
+    buffer = getattr(settings, 'TILE_BUFFER', 64)
+    geom_col = config['geom_col']
+    id_column = config['id_column']
+    attributes = ''.join(f", t.{c}" for c in config['attributes'])
+
+    geom = f"ST_Force2D(ST_Transform(t.{geom_col}, 3857))"
+    params = [z, x, y, buffer / extent]
+    if config['simplify'] and z < getattr(settings, 'TILE_SIMPLIFY_MAX_ZOOM', 20):
+        geom = f"ST_SimplifyPreserveTopology({geom}, %s)"
+        params.append(simplify_tolerance(z, extent))
+    params += [extent, buffer, layer, extent]
+
+    # The `&&` filter runs on the native 4326 column so the GiST index is used; the
+    # envelope is expanded by the tile buffer so features just outside still render.
+    sql = f"""
+        WITH bounds AS (
+            SELECT ST_TileEnvelope(%s, %s, %s) AS geom
+        ),
+        search AS (
+            SELECT ST_Transform(ST_Expand(geom, (ST_XMax(geom) - ST_XMin(geom)) * %s), 4326) AS geom, geom AS tile
+            FROM bounds
+        ),
+        mvtgeom AS (
+            SELECT
+                ST_AsMVTGeom({geom}, search.tile, %s, %s, true) AS geom,
+                t.{id_column}{attributes}
+            FROM {config['table']} t, search
+            WHERE t.{geom_col} && search.geom
+        )
+        SELECT ST_AsMVT(mvtgeom.*, %s, %s, 'geom', '{id_column}')
+        FROM mvtgeom
+        WHERE geom IS NOT NULL
+    """
+    return sql, params
+
+
+def build_tile(layer: str, z: int, x: int, y: int) -> bytes:
+    """Return the MVT (protobuf) bytes of one tile of `layer`; empty bytes if no features."""
+    with connection.cursor() as cursor:
+        cursor.execute(*tile_query(layer, z, x, y))
+        row = cursor.fetchone()
+    return bytes(row[0]) if row and row[0] is not None else b''
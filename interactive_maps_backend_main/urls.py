@@ -1,14 +1,23 @@
 from django.urls import path
 from rest_framework.schemas import get_schema_view
-from .views import RoomsListAPIView, RouteAPIView, HealthAPIView, RouteCacheAPIView, base_floor_view
+from .views import (
+    RoomAutocompleteAPIView, RoomsListAPIView, RouteAPIView, RouteMatrixAPIView, HealthAPIView, RouteCacheAPIView, StatsAPIView,
+    base_floor_view, layers_stream_view, sync_view, tile_view,
+)
 
 schema_view = get_schema_view(title='Indoor Routing API', description='Schema for routing API')
 
 urlpatterns = [
     path('rooms/', RoomsListAPIView.as_view(), name='rooms-list'),
+    path('rooms/autocomplete/', RoomAutocompleteAPIView.as_view(), name='rooms-autocomplete'),
     path('base-floor/', base_floor_view, name='base-floor-list'),
+    path('layers/stream/', layers_stream_view, name='layers-stream'),
+    path('sync/', sync_view, name='sync'),
+    path('tiles/<str:layer>/<int:z>/<int:x>/<int:y>.mvt', tile_view, name='tile'),
     path('route/', RouteAPIView.as_view(), name='route-create'),
+    path('route/matrix/', RouteMatrixAPIView.as_view(), name='route-matrix'),
     path('route/cache/<int:cache_id>/', RouteCacheAPIView.as_view(), name='route-cache-get'),
     path('health/', HealthAPIView.as_view(), name='health'),
+    path('stats/', StatsAPIView.as_view(), name='stats'),
     path('schema/', schema_view, name='api-schema'),
 ]
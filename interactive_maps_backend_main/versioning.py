@@ -0,0 +1,193 @@
+"""Per-table data versions for conditional GET (ETag / Last-Modified / 304).
+
+Statement-level triggers bump a counter in the `data_version` table whenever
+`room_points` or `base_floor` change (see docs/data_version.sql). Read views build their
+validators from that counter, so they can answer `If-None-Match` / `If-Modified-Since`
+with `304 Not Modified` without touching the row data. Versions are cached per worker for
+`DATA_VERSION_TTL` seconds, so most conditional requests cost no query at all.
+
+The trigger function also sends `NOTIFY data_version, '<table>'`. With
+`DATA_VERSION_LISTEN` on (and psycopg 3 installed), `start_listener` keeps a `LISTEN`
+connection per worker and refreshes the versions as soon as a table changes instead of
+waiting for the TTL. Either way, `on_data_version_change` listeners run when a new version
+is seen (e.g. the room catalog rebuilds itself).
+
+If the `data_version` table does not exist, `get_data_version` returns None and views
+behave as before (no validators, always 200).
+"""
+import calendar
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError, ProgrammingError, close_old_connections, connection
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+logger = logging.getLogger(__name__)
+
+
+class DataVersion(NamedTuple):
+    version: int
+    updated_at: datetime
+
+
+_lock = threading.Lock()
+_versions: Dict[str, DataVersion] = {}
+_fetched_at = None
+# Flipped off for the rest of the process if `data_version` is missing
+_enabled = True
+_listeners = []
+
+CHANNEL = 'data_version'
+
+
+def fetch_data_versions() -> Dict[str, DataVersion]:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT table_name, version, updated_at FROM data_version")
+        return {name: DataVersion(int(version), updated_at) for name, version, updated_at in cursor.fetchall()}
+
+
+def on_data_version_change(listener):
+    """Register `listener(table, data_version)` to run when a table gets a new version."""
+    _listeners.append(listener)
+    return listener
+
+
+def _refresh() -> Optional[List[str]]:
+    """Re-read all versions (caller holds `_lock`); return the tables that changed, or None
+    if the versions are unavailable."""
+    global _versions, _fetched_at, _enabled
+    try:
+        versions = fetch_data_versions()
+    except ProgrammingError as e:
+        _enabled = False
+        logger.warning('Conditional GET disabled; data_version is unusable (%s). '
+                       'Create it with the SQL in docs/data_version.sql.', e)
+        return None
+    except DatabaseError:
+        logger.warning('data_version lookup failed', exc_info=True)
+        return None
+    changed = [t for t, v in versions.items() if t in _versions and _versions[t].version != v.version]
+    _versions, _fetched_at = versions, time.monotonic()
+    return changed
+
+
+def _notify(changed):
+    for table in changed or ():
+        for listener in _listeners:
+            try:
+                listener(table, _versions[table])
+            except Exception:
+                logger.exception('Data version listener %r failed', listener)
+
+
+def get_data_version(table: str) -> Optional[DataVersion]:
+    """Return the version of `table`, refreshed at most every `DATA_VERSION_TTL` seconds."""
+    if not _enabled:
+        return None
+    ttl = getattr(settings, 'DATA_VERSION_TTL', 5)
+    changed = None
+    with _lock:
+        if _fetched_at is None or time.monotonic() - _fetched_at >= ttl:
+            changed = _refresh()
+            if changed is None:
+                return None
+        version = _versions.get(table)
+    _notify(changed)
+    return version
+
+
+def refresh_data_versions():
+    """Re-read the versions now, e.g. after a `NOTIFY`, and run the change listeners."""
+    if not _enabled:
+        return
+    with _lock:
+        changed = _refresh()
+    _notify(changed)
+
+
+def _listen_forever():
+    from . import async_db
+    backoff = 1.0
+    while True:
+        try:
+            with async_db.psycopg.connect(async_db.conninfo(), autocommit=True) as conn:
+                conn.execute(f'LISTEN {CHANNEL}')
+                # Catch up with anything missed while (re)connecting
+                refresh_data_versions()
+                backoff = 1.0
+                for notify in conn.notifies():
+                    logger.debug('data_version NOTIFY for %s', notify.payload)
+                    refresh_data_versions()
+                    close_old_connections()
+        except Exception:
+            logger.warning('data_version listener disconnected; retrying in %.0fs', backoff, exc_info=True)
+        finally:
+            close_old_connections()
+        time.sleep(backoff)
+        backoff = min(backoff * 2, 60.0)
+
+
+def start_listener():
+    """Start the per-worker `LISTEN data_version` thread if `DATA_VERSION_LISTEN` is on."""
+    from . import async_db
+    if not getattr(settings, 'DATA_VERSION_LISTEN', False):
+        return None
+    if async_db.psycopg is None:
+        logger.info('psycopg 3 is not installed; data versions are polled every DATA_VERSION_TTL seconds')
+        return None
+    thread = threading.Thread(target=_listen_forever, name='data-version-listener', daemon=True)
+    thread.start()
+    return thread
+
+
+def etag_for(table: str, data_version: DataVersion, representation: Optional[str] = None) -> str:
+    # Weak: the bytes may differ with the JSON backend or content-coding, the data does not.
+    # Another media type of the same data (e.g. `protobuf`) is another representation.
+    suffix = f'.{representation}' if representation else ''
+    return f'W/"{table}.{data_version.version}{suffix}"'
+
+
+def last_modified_for(data_version: DataVersion) -> int:
+    return calendar.timegm(data_version.updated_at.utctimetuple())
+
+
+def validators_for(table: str, representation: Optional[str] = None) -> Tuple[Optional[str], Optional[int]]:
+    """`(etag, last_modified)` for responses built from `table`; `(None, None)` if unknown.
+
+    `representation` names a non-JSON media type negotiated from `Accept` (see `etag_for`).
+    """
+    data_version = get_data_version(table)
+    if data_version is None:
+        return None, None
+    return etag_for(table, data_version, representation), last_modified_for(data_version)
+
+
+def not_modified(request, etag: Optional[str], last_modified: Optional[int] = None):
+    """Return a 304 (or 412) response if the client's copy is current, else None."""
+    if etag is None and last_modified is None:
+        return None
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def set_validators(response, etag: Optional[str], last_modified: Optional[int] = None, max_age: Optional[int] = None,
+                   vary: Sequence[str] = ()):
+    """Add `ETag`, `Last-Modified` and a public `Cache-Control` to a cacheable response.
+
+    `vary` lists the request headers the representation was negotiated on (e.g. `Accept`);
+    304 responses need them as much as full ones.
+    """
+    if vary:
+        patch_vary_headers(response, vary)
+    if etag is not None:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    if max_age is None:
+        max_age = getattr(settings, 'READ_CACHE_MAX_AGE', 60)
+    response['Cache-Control'] = f'public, max-age={max_age}'
+    return response
@@ -1,99 +1,363 @@
-import json
 import logging
+from itertools import islice
 from typing import List, Optional
 
 from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.db import connection, OperationalError
-from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.db import connection, OperationalError, ProgrammingError
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
-from .serializers import RoomSerializer, RouteRequestSerializer, RouteResultSerializer
+from . import async_db
+from .binary_geometry import (
+    KEEPALIVE, PROTOBUF_CONTENT_TYPE, batch_frame, coordinate_precision, header_frame, wants_protobuf,
+)
+from .cancellation import keep_running_while, query_stats, request_cancelled, track_query
+from .changelog import changes_query, sync_window
+from .contraction import get_contraction_hierarchy
+from .pagination import KeysetQuery
+from .prefetch import merge, prefetch
+from .renderers import FastJSONRenderer, ProtobufRenderer
+from .room_catalog import RoomCatalog, get_room_catalog
+from .room_search import get_room_search_index, search_rooms_db
+from .route_cache import lookup_persistent, route_lru, store_persistent
+from .routing import current_graph_version, detect_nav_edges_final_schema, get_routing_graph, routing_algorithm
+from .serialization import JSON_CONTENT_TYPE, dumps, json_response, loads
+from .serializers import RouteMatrixRequestSerializer, RouteRequestSerializer, RouteResultSerializer
+from .singleflight import SingleFlight
+from .snapshots import serve_snapshot
+from .spatial_filters import BBox, bbox_filter, geojson_expression, parse_bbox, parse_zoom
+from .spatial_index import get_vertex_snap_index
+from .sse import (
+    StreamPosition, encode_positions, format_event, resume_position, resume_positions, retry_frame, with_heartbeats,
+)
+from .tiles import TILE_LAYERS, build_tile, tile_bounds_valid, tile_query
+from .versioning import get_data_version, not_modified, set_validators, validators_for
 
 logger = logging.getLogger(__name__)
 
 # Default batch size per requirements
 DEFAULT_BATCH_SIZE = 500
 
+# Coalesces concurrent identical route computations (see RouteAPIView.post)
+_route_flight = SingleFlight()
+
 
 def _fetch_rows(sql: str, params: Optional[List] = None):
     """Helper to run a SQL query and return dict rows.
 
     Kept synchronous so it can be wrapped with `sync_to_async` when used in async contexts.
-    Uses server-side SQL with LIMIT/OFFSET to avoid loading large resultsets into memory.
+    Callers page with keyset predicates (see `KeysetQuery`) to avoid loading large resultsets into memory.
     """
     with connection.cursor() as cursor:
         cursor.execute(sql, params)
         return _dictfetchall(cursor)
 
 
-async def _sse_batch_stream(sql_template: str, params_template: List, batch_size: int = DEFAULT_BATCH_SIZE):
+class _ServerSideCursor:
+    """A single named (server-side) cursor held open for a whole SSE stream.
+
+    All methods are synchronous and must be called through `sync_to_async` with the
+    default `thread_sensitive=True`, so every call runs on the same thread and therefore
+    on the same Django connection that declared the cursor. The query is planned once
+    and read with one snapshot; rows are pulled with `fetchmany(batch_size)` so memory
+    stays constant however long the stream is.
+    """
+
+    def __init__(self, sql: str, params: Optional[List] = None):
+        self.sql = sql
+        self.params = params
+        self._cursor = None
+        self._columns = None
+
+    def open(self):
+        # chunked_cursor() is Django's named-cursor factory on PostgreSQL; it falls back
+        # to a regular cursor when DISABLE_SERVER_SIDE_CURSORS is set (e.g. pgbouncer
+        # in transaction pooling mode).
+        self._cursor = connection.chunked_cursor()
+        self._cursor.execute(self.sql, self.params)
+        self._columns = [col[0] for col in self._cursor.description]
+
+    def fetch(self, size: int):
+        # Each FETCH runs the query a bit further; let a client disconnect cancel it
+        with track_query(connection.connection, self.sql):
+            rows = self._cursor.fetchmany(size)
+        return [dict(zip(self._columns, row)) for row in rows]
+
+    def close(self):
+        if self._cursor is not None:
+            try:
+                self._cursor.close()
+            finally:
+                self._cursor = None
+
+
+async def _afetch_rows(sql: str, params: Optional[List] = None):
+    """Fetch dict rows from an async view: on the async pool when enabled (see async_db.py),
+    otherwise with `_fetch_rows` on the threadpool so we don't block the event loop."""
+    if async_db.enabled():
+        return await async_db.fetch_all(sql, params)
+    return await sync_to_async(_fetch_rows)(sql, params)
+
+
+async def _iter_keyset_batches(query: KeysetQuery, batch_size: int, after: Optional[List] = None):
+    """Yield row batches, one keyset-seek query per batch.
+
+    On the async pool a connection is only borrowed while a batch is fetched, so slow
+    clients between batches hold no connection at all.
+    """
+    while True:
+        sql, params = query.page(after=after, limit=batch_size)
+
+        rows = await _afetch_rows(sql, params)
+        yield rows
+
+        if len(rows) < batch_size:
+            break
+        after = query.key_of(rows[-1])
+
+
+async def _iter_cursor_batches(query: KeysetQuery, batch_size: int, after: Optional[List] = None):
+    """Yield row batches from one server-side cursor opened for the whole stream.
+
+    The cursor is closed as soon as the consumer stops iterating, including when the
+    client disconnects mid-stream.
+    """
+    sql, params = query.page(after=after)
+    if async_db.enabled():
+        async for rows in async_db.stream_batches(sql, params, batch_size):
+            yield rows
+        return
+
+    stream = _ServerSideCursor(sql, params)
+    try:
+        await sync_to_async(stream.open)()
+        while True:
+            rows = await sync_to_async(stream.fetch)(batch_size)
+            yield rows
+            if len(rows) < batch_size:
+                break
+    finally:
+        await sync_to_async(stream.close)()
+
+
+async def _iter_catalog_batches(rows, batch_size: int):
+    """Yield batches of `RoomCatalog.rows`; no database work at all."""
+    while True:
+        batch = list(islice(rows, batch_size))
+        yield batch
+        if len(batch) < batch_size:
+            break
+
+
+def _batch_source(query: KeysetQuery, batch_size: int, after: Optional[List] = None):
+    """The DB batch source for an SSE stream: one server-side cursor with
+    `SSE_SERVER_SIDE_CURSORS`, keyset queries otherwise."""
+    if getattr(settings, 'SSE_SERVER_SIDE_CURSORS', False):
+        return _iter_cursor_batches(query, batch_size, after)
+    return _iter_keyset_batches(query, batch_size, after)
+
+
+def _batch_payload(query: KeysetQuery, rows, batch_num: int, fetched: int, batch_size: int,
+                   reset: bool = False) -> bytes:
+    """JSON of one SSE batch: metadata, the `cursor` after its last row and the `items`.
+
+    `reset` marks the first batch of a stream restarted because its `Last-Event-ID` could
+    not be honoured (see sse.py).
+    """
+    meta = {
+        'batch': batch_num,
+        'fetched': fetched,
+        'more_pending': len(rows) == batch_size,
+        'cursor': query.cursor_after(rows[-1]) if rows else None,
+    }
+    if reset:
+        meta['reset'] = True
+    return dumps(meta)[:-1] + b',"items":' + _json_array(rows) + b'}'
+
+
+def _next_position(query: KeysetQuery, position: StreamPosition, rows, batch_size: int) -> StreamPosition:
+    """Stream position after sending `rows`."""
+    return StreamPosition(
+        position.version,
+        position.batch + 1,
+        position.fetched + len(rows),
+        query.key_of(rows[-1]) if rows else position.after,
+        len(rows) < batch_size,
+    )
+
+
+async def _sse_batch_stream(query: KeysetQuery, batch_size: int = DEFAULT_BATCH_SIZE, after: Optional[List] = None,
+                            batches=None, start: Optional[StreamPosition] = None, reset: bool = False):
     """Async generator that yields Server-Sent Events (SSE) formatted chunks.
 
     Each chunk contains a small JSON object with metadata and an `items` array.
     Clients can use EventSource (SSE) to receive and append batches as they arrive.
 
     Implementation notes:
-    - Uses `sync_to_async` to perform DB work without blocking the ASGI event loop.
-    - Each DB batch is fetched with LIMIT %s OFFSET %s to stay index-friendly and avoid
-      loading the entire dataset into memory.
+    - DB work runs on the async connection pool (async_db.py), or through `sync_to_async`
+      when the pool is disabled, so the ASGI event loop is never blocked.
+    - By default each DB batch is fetched with a keyset predicate on the query's sort key
+      (`(key) > (last seen key) ... LIMIT %s`), so every batch is an index seek and
+      costs the same no matter how deep into the dataset the stream is. LIMIT/OFFSET
+      would make Postgres scan and discard every earlier row for each batch.
+    - With `settings.SSE_SERVER_SIDE_CURSORS` enabled the whole stream is read from a
+      single named cursor instead (one plan, one snapshot, one connection); see
+      `_ServerSideCursor`.
+    - `batches` replaces the DB source altogether, e.g. with rooms from the in-memory
+      catalog (`_iter_catalog_batches`).
+    - The next `settings.SSE_PREFETCH_DEPTH` batches are fetched in the background while
+      the current one is sent (see prefetch.py); a slow client stops the read-ahead
+      rather than making it buffer, and a disconnect cancels the outstanding fetch.
     - Requires an ASGI-capable server (uvicorn/daphne). WSGI does NOT support streaming
       async generators.
     - Each event is properly formatted as SSE: "data: <json>\n\n"
     - Flushes occur per batch so frontend receives events incrementally.
+    - Each payload carries an opaque `cursor` that can be passed back as `after`
+      to the paginated mode to continue from the same position.
+    - Each event's `id:` is the stream position after it (sse.py). A stream resumed from
+      `Last-Event-ID` gets the decoded position as `start` (its `after` is the key to
+      continue from) and keeps counting batches from there; `reset` flags the first batch
+      of a stream that had to start over.
+    - The first frame is a `retry:` hint for `EventSource`'s reconnection delay.
+    - Every row arrives with its item already serialized by Postgres (`item` column,
+      see `_rooms_query`), so the frame is spliced together from strings; GeoJSON is
+      never decoded and re-encoded in Python.
 
     Why ASGI is required:
     - WSGI is synchronous and cannot yield from async generators.
     - ASGI is async-first and handles async iterators natively.
     - StreamingHttpResponse with async generators only works on ASGI.
 
-    The yielded string is SSE 'data' lines terminated by a blank line, e.g.:
-        data: {json}\n\n
+    The yielded bytes are SSE 'id' and 'data' lines terminated by a blank line, e.g.:
+        id: <position>\ndata: {json}\n\n
     """
-    offset = 0
-    batch_num = 0
+    position = start or StreamPosition(None, 0, 0, after, False)
+    # `batches` may be given by the caller (e.g. rows from the room catalog)
+    if batches is None:
+        batches = _batch_source(query, batch_size, position.after)
+    batches = prefetch(batches, getattr(settings, 'SSE_PREFETCH_DEPTH', 1))
+
     try:
-        while True:
-            # Build params for this batch; SQL template must end with "LIMIT %s OFFSET %s"
-            params = list(params_template) + [batch_size, offset]
-
-            # Run a synchronous fetch on the threadpool so we don't block the event loop
-            rows = await sync_to_async(_fetch_rows)(sql_template, params)
-
-            # Parse GeoJSON strings into objects to avoid sending strings to clients
-            for r in rows:
-                for k in ('location', 'geometry'):
-                    if r.get(k):
-                        try:
-                            r[k] = json.loads(r[k])
-                        except Exception:
-                            # If parsing fails, leave original text
-                            pass
+        yield retry_frame()
+        async for rows in batches:
+            position = _next_position(query, position, rows, batch_size)
+            payload = _batch_payload(query, rows, position.batch, position.fetched, batch_size, reset=reset)
+            reset = False
+            yield format_event(payload, event_id=position.encode())
+    except GeneratorExit:
+        # Client disconnected; stop iteration gracefully.
+        # Do NOT log or raise; this is normal behavior.
+        pass
+    finally:
+        # Release the batch source right away (closes a server-side cursor, if any)
+        await batches.aclose()
 
-            batch_num += 1
-            total_fetched = offset + len(rows)
-            more_pending = len(rows) == batch_size
 
-            payload = {
-                'batch': batch_num,
-                'fetched': total_fetched,
-                'more_pending': more_pending,
-                'items': rows,
-            }
+def _json_array(rows) -> bytes:
+    """Join the pre-serialized `item` of `rows` (JSON text from SQL, or bytes from the room
+    catalog) into a JSON array."""
+    items = [r['item'] for r in rows]
+    if items and isinstance(items[0], bytes):
+        return b'[' + b','.join(items) + b']'
+    return ('[' + ','.join(items) + ']').encode('utf-8')
 
-            # SSE requires 'data:' prefix and blank line separator between events
-            yield f"data: {json.dumps(payload)}\n\n"
 
-            if not more_pending:
-                break
+async def _protobuf_batch_stream(query: KeysetQuery, batch_size: int, after: Optional[List], precision: int,
+                                 layer: str, batches=None):
+    """`_sse_batch_stream` for `Accept: application/x-protobuf`: a header frame, then one
+    length-prefixed `Batch` frame per batch (see binary_geometry.py).
 
-            offset += len(rows)
+    There are no event ids; a client continues an interrupted stream by passing the
+    `cursor` of the last batch it received as `after`.
+    """
+    if batches is None:
+        batches = _batch_source(query, batch_size, after)
+    batches = prefetch(batches, getattr(settings, 'SSE_PREFETCH_DEPTH', 1))
+    batch_num = fetched = 0
+    try:
+        yield header_frame(precision, layer)
+        async for rows in batches:
+            batch_num += 1
+            fetched += len(rows)
+            yield batch_frame([r['item'] for r in rows], precision, batch_num, fetched,
+                              more_pending=len(rows) == batch_size,
+                              cursor=query.cursor_after(rows[-1]) if rows else None)
     except GeneratorExit:
-        # Client disconnected; stop iteration gracefully.
-        # Do NOT log or raise; this is normal behavior.
         pass
+    finally:
+        await batches.aclose()
+
+
+def _page_response(rows, next_cursor: Optional[str], precision: Optional[int] = None,
+                   layer: Optional[str] = None) -> HttpResponse:
+    """Paginated listing response: the rows' items as a JSON array, or as one binary batch
+    when `precision` is given (`Accept: application/x-protobuf`)."""
+    if precision is None:
+        response = HttpResponse(_json_array(rows), content_type=JSON_CONTENT_TYPE)
+    else:
+        body = header_frame(precision, layer) + batch_frame(
+            [r['item'] for r in rows], precision, fetched=len(rows), more_pending=next_cursor is not None,
+            cursor=next_cursor)
+        response = HttpResponse(body, content_type=PROTOBUF_CONTENT_TYPE)
+    if next_cursor:
+        response['X-Next-Cursor'] = next_cursor
+    # The same URL has a JSON and a binary representation
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+def _room_catalog() -> Optional[RoomCatalog]:
+    """The in-memory room catalog (see room_catalog.py), or None when `ROOM_CATALOG` is off."""
+    if not getattr(settings, 'ROOM_CATALOG', True):
+        return None
+    return get_room_catalog()
+
+
+def _rooms_query(q: str, bbox: Optional[BBox] = None, zoom: Optional[int] = None,
+                 api_keys: bool = False) -> KeysetQuery:
+    """Keyset query over `room_points` ordered by `(text, ogc_fid)`.
+
+    `ogc_fid` breaks ties between rooms sharing a name so the sort key is unique.
+    `bbox` and `zoom` restrict and coarsen the result (see spatial_filters.py).
+
+    Besides the sort key, each row carries `item`: the room already serialized to JSON
+    text by Postgres, with the paginated API's keys (`id`, `name`) when `api_keys`
+    is set and the column names otherwise.
+    """
+    location, select_params = geojson_expression('wkb_geometry', zoom, simplify=False)
+    id_key, name_key = ('id', 'name') if api_keys else ('ogc_fid', 'text')
+    select_sql = f"""
+    SELECT ogc_fid, text,
+        json_build_object('{id_key}', ogc_fid, '{name_key}', text, 'location', {location}::json)::text AS item
+    FROM room_points
+    """
+    where, params = bbox_filter('wkb_geometry', bbox, 'room_points')
+    if q:
+        where.insert(0, 'text ILIKE %s')
+        params.insert(0, f"%{q}%")
+    return KeysetQuery(select_sql, ['text', 'ogc_fid'], where=where, params=params, select_params=select_params)
+
+
+def _base_floor_query(bbox: Optional[BBox] = None, zoom: Optional[int] = None) -> KeysetQuery:
+    """Keyset query over `base_floor` ordered by `ogc_fid`, optionally limited to `bbox`.
+
+    Each row is `ogc_fid` plus `item`, the feature serialized to JSON text by Postgres.
+    """
+    geometry, select_params = geojson_expression('wkb_geometry', zoom)
+    select_sql = f"""
+    SELECT ogc_fid,
+        json_build_object(
+            'ogc_fid', ogc_fid, 'layer', layer, 'paperspace', paperspace, 'text', text,
+            'geometry', {geometry}::json
+        )::text AS item
+    FROM base_floor
+    """
+    where, params = bbox_filter('wkb_geometry', bbox, 'base_floor')
+    return KeysetQuery(select_sql, ['ogc_fid'], where=where, params=params, select_params=select_params)
 
 
 def _dictfetchall(cursor):
@@ -108,10 +372,12 @@ class ClientDisconnected(Exception):
 
 
 class RoomsListAPIView(APIView):
-    """GET /api/rooms/?q=&limit=&offset=
+    """GET /api/rooms/?q=&limit=&offset=&after=&bbox=&zoom=
 
     Supports two modes:
       - If `limit` is provided by client: return a normal (paginated) JSON response.
+        Pass the opaque `after` cursor (from the `X-Next-Cursor` header or an SSE
+        batch's `cursor`) instead of `offset` to seek directly to the next page.
       - If `limit` is NOT provided: stream results in batches of `DEFAULT_BATCH_SIZE`
         using Server-Sent Events (SSE). Each SSE event contains a JSON object with
         metadata and an `items` array. This lets the frontend render partial data
@@ -122,41 +388,53 @@ class RoomsListAPIView(APIView):
       - Exits gracefully without logging stack traces (normal behavior when React UI cancels)
       - Closes database cursors immediately
 
+    `bbox=minx,miny,maxx,maxy` limits both modes to rooms in the viewport (GiST index);
+    `zoom=` trims coordinate precision to what that zoom level can display.
+
+    With `Accept: application/x-protobuf` both modes answer in the binary encoding of
+    binary_geometry.py; the stream is then a chunked sequence of frames instead of SSE.
+
     Performance notes (see _sse_batch_stream):
-      - Uses ST_AsGeoJSON to avoid heavy geometry objects in Python
-      - Uses LIMIT/OFFSET to fetch index-friendly batches
+      - Served from the per-worker room catalog (room_catalog.py) when `ROOM_CATALOG` is on;
+        the SQL below is the fallback
+      - Builds each room's JSON in SQL (json_build_object + ST_AsGeoJSON); Python only joins strings
+      - Uses keyset pagination on `(text, ogc_fid)` to fetch index-friendly batches
       - Does not load entire dataset into memory
     """
 
+    renderer_classes = [FastJSONRenderer, ProtobufRenderer]
+
     def get(self, request):
         q = request.query_params.get('q', '').strip()
         limit_param = request.query_params.get('limit')
+        protobuf = request.accepted_renderer.format == ProtobufRenderer.format
+        representation = ProtobufRenderer.format if protobuf else None
+
+        try:
+            bbox = parse_bbox(request.query_params.get('bbox'))
+            zoom = parse_zoom(request.query_params.get('zoom'))
+            # The paginated mode uses the API field names (`id`, `name`, `location`)
+            query = _rooms_query(q, bbox=bbox, zoom=zoom, api_keys=limit_param is not None)
+            after = _parse_after(request.query_params.get('after'), query)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         # If client supplied an explicit limit -> behave like a normal paginated response
         if limit_param is not None:
             limit = min(int(limit_param), 1000)
             offset = int(request.query_params.get('offset', 0))
-
-            if q:
-                sql = """
-                SELECT ogc_fid, text, ST_AsGeoJSON(wkb_geometry) AS location
-                FROM room_points
-                WHERE text ILIKE %s
-                ORDER BY text
-                LIMIT %s OFFSET %s
-                """
-                params = [f"%{q}%", limit, offset]
-            else:
-                sql = """
-                SELECT ogc_fid, text, ST_AsGeoJSON(wkb_geometry) AS location
-                FROM room_points
-                ORDER BY text
-                LIMIT %s OFFSET %s
-                """
-                params = [limit, offset]
+            sql, params = query.page(after=after, limit=limit, offset=offset)
 
             try:
-                rows = self._execute_and_fetch(sql, params)
+                # Answer revalidations from the data version alone, before touching the rows
+                etag, last_modified = validators_for('room_points', representation)
+                cached = not_modified(request, etag, last_modified)
+                if cached is not None:
+                    return set_validators(cached, etag, last_modified, vary=('Accept',))
+                catalog = _room_catalog()
+                rows = catalog.page(q, bbox, zoom, after, limit, offset, api_keys=True) if catalog else None
+                if rows is None:
+                    rows = self._execute_and_fetch(sql, params)
             except OperationalError:
                 return Response({"detail": "Database error"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
             except (BrokenPipeError, ConnectionResetError):
@@ -164,45 +442,37 @@ class RoomsListAPIView(APIView):
                 # Exit gracefully without logging (this is normal behavior).
                 return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            for r in rows:
-                r['location'] = json.loads(r['location']) if r.get('location') else None
+            next_cursor = query.cursor_after(rows[-1]) if rows and len(rows) == limit else None
 
-            serializer = RoomSerializer(rows, many=True)
-            return Response(serializer.data)
+            # Items are serialized by Postgres in the API's shape; just join them
+            response = _page_response(rows, next_cursor, coordinate_precision(zoom) if protobuf else None,
+                                      'room_points')
+            return set_validators(response, etag, last_modified)
 
         # No explicit limit -> start SSE batched streaming with default batch size
-        # Build template SQL with LIMIT/OFFSET placeholders at the end for _sse_batch_stream
-        if q:
-            sql_template = """
-            SELECT ogc_fid, text, ST_AsGeoJSON(wkb_geometry) AS location
-            FROM room_points
-            WHERE text ILIKE %s
-            ORDER BY text
-            LIMIT %s OFFSET %s
-            """
-            params_template = [f"%{q}%"]
-        else:
-            sql_template = """
-            SELECT ogc_fid, text, ST_AsGeoJSON(wkb_geometry) AS location
-            FROM room_points
-            ORDER BY text
-            LIMIT %s OFFSET %s
-            """
-            params_template = []
-
         # StreamingHttpResponse with async iterator requires ASGI.
         # Proper SSE headers ensure client keeps connection and backend continues streaming.
-        response = StreamingHttpResponse(
-            _sse_batch_stream(sql_template, params_template, batch_size=DEFAULT_BATCH_SIZE),
-            content_type='text/event-stream'
-        )
-        # Prevent client-side and CDN caching of SSE streams
-        response['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        # Keep connection alive for streaming
-        response['Connection'] = 'keep-alive'
-        # Disable buffering on reverse proxies (nginx, etc.)
-        response['X-Accel-Buffering'] = 'no'
-        return response
+        if protobuf:
+            # Binary frames are fetched, not read by EventSource: no Last-Event-ID to resume from
+            start, reset = StreamPosition(None, 0, 0, after, False), False
+        else:
+            start, reset = _stream_start(request, query, get_data_version('room_points'), after)
+            if start.done:
+                # Reconnect after the last batch; 204 stops EventSource from retrying
+                return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+        batches = None
+        try:
+            catalog = _room_catalog()
+        except OperationalError:
+            catalog = None
+        pos = catalog.start_after(start.after) if catalog else None
+        if pos is not None:
+            batches = _iter_catalog_batches(catalog.rows(q, bbox, zoom, pos), DEFAULT_BATCH_SIZE)
+        if protobuf:
+            return _protobuf_response(_protobuf_batch_stream(query, DEFAULT_BATCH_SIZE, start.after,
+                                                             coordinate_precision(zoom), 'room_points', batches))
+        return _sse_response(_sse_batch_stream(query, batch_size=DEFAULT_BATCH_SIZE, batches=batches,
+                                               start=start, reset=reset))
 
     def _execute_and_fetch(self, sql: str, params: Optional[List] = None):
         with connection.cursor() as cursor:
@@ -210,13 +480,76 @@ class RoomsListAPIView(APIView):
             return _dictfetchall(cursor)
 
 
+class RoomAutocompleteAPIView(APIView):
+    """GET /api/rooms/autocomplete/?q=<text>&limit=<k>
+
+    Top-K rooms for a search-box prefix or misspelling, ranked exact name > name prefix >
+    word prefix > trigram similarity (see room_search.py). Answered from a per-worker
+    in-memory index within `ROOM_SEARCH_BUDGET_MS`; `truncated` is true when the budget
+    ran out before all candidates were scored.
+    """
+
+    MAX_LIMIT = 50
+
+    def get(self, request):
+        q = request.query_params.get('q', '').strip()
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), self.MAX_LIMIT)
+        except ValueError:
+            return Response({"detail": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({"detail": "limit must be at least 1"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            etag, last_modified = validators_for('room_points')
+            cached = not_modified(request, etag, last_modified)
+            if cached is not None:
+                return set_validators(cached, etag, last_modified)
+            if getattr(settings, 'ROOM_SEARCH_INDEX', True):
+                result = get_room_search_index().search(q, limit)
+            else:
+                result = search_rooms_db(q, limit)
+        except OperationalError:
+            return Response({"detail": "Database error"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        response = Response({
+            "results": [{"id": m.id, "name": m.name, "score": m.score} for m in result.matches],
+            "truncated": result.truncated,
+        })
+        if result.truncated:
+            # A later request may have time to find the complete answer
+            response['Cache-Control'] = 'no-cache'
+            return response
+        return set_validators(response, etag, last_modified)
+
+
+def _parse_after(token: Optional[str], query: KeysetQuery) -> Optional[List]:
+    """Decode the optional `after` query parameter into a sort key for `query`."""
+    if not token:
+        return None
+    return query.decode(token)
+
+
 async def base_floor_view(request):
     """GET /api/base-floor/
 
     Two modes:
       - If `limit` is provided: normal paginated JSON response (limit respected).
+        `after` (opaque cursor) may be passed instead of `offset`; the cursor for the
+        next page is returned in the `X-Next-Cursor` header.
       - If `limit` is NOT provided: stream batches of `DEFAULT_BATCH_SIZE` via SSE.
 
+    Both modes accept `bbox=minx,miny,maxx,maxy` (only lines intersecting the viewport)
+    and `zoom=` (lines simplified to about one pixel, coordinates rounded to match).
+
+    With `snapshot=1` the whole layer is served as a precomputed, pre-compressed GeoJSON
+    FeatureCollection file with a strong ETag (see snapshots.py); other parameters are
+    ignored.
+
+    With `Accept: application/x-protobuf` both modes answer in the binary encoding of
+    binary_geometry.py (quantized, delta-encoded coordinates); the stream is then a
+    chunked sequence of length-prefixed frames instead of SSE.
+
     Async Implementation (ASGI Required):
       - This is an async view that can be used only with ASGI servers (uvicorn, daphne).
       - WSGI servers cannot handle async views or async generators.
@@ -227,119 +560,365 @@ async def base_floor_view(request):
       - Exits gracefully without error logs (normal client disconnect)
       - Closes cursor immediately via context manager
 
-    Uses ST_AsGeoJSON in SQL and parses geometry JSON before sending.
+    Features are serialized to JSON in SQL (`json_build_object` + `ST_AsGeoJSON`) and
+    only joined in Python.
     """
 
+    if request.GET.get('snapshot') in ('1', 'true'):
+        # Whole layer as a precomputed static file; no query, no serialization
+        try:
+            return await sync_to_async(serve_snapshot)(request)
+        except OperationalError:
+            return json_response({"detail": "Database error"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
     limit_param = request.GET.get('limit')
+    precision = None
+
+    try:
+        bbox = parse_bbox(request.GET.get('bbox'))
+        zoom = parse_zoom(request.GET.get('zoom'))
+        query = _base_floor_query(bbox=bbox, zoom=zoom)
+        after = _parse_after(request.GET.get('after'), query)
+    except ValueError as e:
+        return json_response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    if wants_protobuf(request):
+        precision = coordinate_precision(zoom)
 
     if limit_param is not None:
         limit = min(int(limit_param), 1000)
         offset = int(request.GET.get('offset', 0))
-
-        sql = """
-        SELECT ogc_fid, layer, paperspace, text, ST_AsGeoJSON(wkb_geometry) AS geometry
-        FROM base_floor
-        ORDER BY ogc_fid
-        LIMIT %s OFFSET %s
-        """
-        params = [limit, offset]
+        sql, params = query.page(after=after, limit=limit, offset=offset)
 
         try:
-            def _execute_and_fetch(sql_inner, params_inner=None):
-                with connection.cursor() as cursor:
-                    cursor.execute(sql_inner, params_inner)
-                    return _dictfetchall(cursor)
-
-            rows = await sync_to_async(_execute_and_fetch)(sql, params)
+            # Answer revalidations from the data version alone, before touching the rows
+            representation = ProtobufRenderer.format if precision is not None else None
+            etag, last_modified = await sync_to_async(validators_for)('base_floor', representation)
+            cached = not_modified(request, etag, last_modified)
+            if cached is not None:
+                return set_validators(cached, etag, last_modified, vary=('Accept',))
+
+            rows = await _afetch_rows(sql, params)
         except OperationalError:
-            return JsonResponse({"detail": "Database error"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            return json_response({"detail": "Database error"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except (BrokenPipeError, ConnectionResetError):
             # Client disconnected. Exit silently; don't log.
-            return JsonResponse(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return HttpResponse(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        next_cursor = query.cursor_after(rows[-1]) if rows and len(rows) == limit else None
 
-        for r in rows:
-            r['geometry'] = json.loads(r['geometry']) if r.get('geometry') else None
+        response = _page_response(rows, next_cursor, precision, 'base_floor')
+        return set_validators(response, etag, last_modified)
 
-        return JsonResponse(rows, safe=False)
+    if precision is not None:
+        return _protobuf_response(_protobuf_batch_stream(query, DEFAULT_BATCH_SIZE, after, precision, 'base_floor'))
 
     # No explicit limit: stream via SSE in batches
-    sql_template = """
-    SELECT ogc_fid, layer, paperspace, text, ST_AsGeoJSON(wkb_geometry) AS geometry
-    FROM base_floor
-    ORDER BY ogc_fid
-    LIMIT %s OFFSET %s
+    # StreamingHttpResponse with async generator requires ASGI.
+    start, reset = _stream_start(request, query, await sync_to_async(get_data_version)('base_floor'), after)
+    if start.done:
+        return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+    return _sse_response(_sse_batch_stream(query, batch_size=DEFAULT_BATCH_SIZE, start=start, reset=reset))
+
+
+def _stream_start(request, query: KeysetQuery, data_version, after: Optional[List]):
+    """Start position of an SSE stream over `query` and whether its client must reset.
+
+    A stream continues after the position in `Last-Event-ID` (sse.py) if that is from the
+    current data version, and otherwise starts at `after`.
     """
-    params_template: List = []
+    version = data_version.version if data_version else None
+    position, reset = resume_position(request.headers.get('Last-Event-ID'), len(query.key_columns), version)
+    return position or StreamPosition(version, 0, 0, after, False), reset
 
-    # StreamingHttpResponse with async generator requires ASGI.
-    response = StreamingHttpResponse(
-        _sse_batch_stream(sql_template, params_template, batch_size=DEFAULT_BATCH_SIZE),
-        content_type='text/event-stream'
-    )
-    # Prevent caching of SSE streams
+
+# Layers `/api/layers/stream/` can multiplex (in their default order) and their tables
+STREAM_LAYERS = {'base_floor': 'base_floor', 'rooms': 'room_points'}
+
+
+async def layers_stream_view(request):
+    """GET /api/layers/stream/?layers=base_floor,rooms&bbox=&zoom=
+
+    Streams several layers over one SSE connection instead of one `EventSource` per
+    layer. The layers are fetched concurrently (each keyset batch borrows its own
+    connection from the async pool), and their batches are interleaved as they arrive,
+    each as an `event: <layer>` frame with the same payload as that layer's own stream
+    (`cursor` works as `after=` there). At most `LAYERS_STREAM_MAX_IN_FLIGHT` batches per
+    stream are fetched ahead of the one being sent. A final `event: done` frame reports
+    the batches and rows sent per layer.
+
+    Event ids hold the position of every layer, so a reconnecting `EventSource` resumes
+    each layer where it stopped (a layer whose data version changed starts over with
+    `"reset": true`, a finished one is skipped; see sse.py).
+
+    `bbox` and `zoom` apply to every layer. Rooms come from the room catalog when it is
+    enabled, with the column names of `/api/rooms/`'s stream (`ogc_fid`, `text`).
+    """
+    try:
+        names = _parse_layers(request.GET.get('layers'))
+        bbox = parse_bbox(request.GET.get('bbox'))
+        zoom = parse_zoom(request.GET.get('zoom'))
+    except ValueError as e:
+        return json_response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    queries = {name: _layer_query(name, bbox=bbox, zoom=zoom) for name in names}
+    versions = {}
+    for name in queries:
+        data_version = await sync_to_async(get_data_version)(STREAM_LAYERS[name])
+        versions[name] = (len(queries[name].key_columns), data_version.version if data_version else None)
+    resumed = resume_positions(request.headers.get('Last-Event-ID'), versions)
+    positions = {name: resumed[name][0] or StreamPosition(versions[name][1], 0, 0, None, False) for name in queries}
+    if all(position.done for position in positions.values()):
+        return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+    sources = {}
+    for name, query in queries.items():
+        if positions[name].done:
+            continue
+        after = positions[name].after
+        if name == 'rooms':
+            try:
+                catalog = await sync_to_async(_room_catalog)()
+            except OperationalError:
+                catalog = None
+            pos = catalog.start_after(after) if catalog else None
+            if pos is not None:
+                sources[name] = _iter_catalog_batches(catalog.rows('', bbox, zoom, pos), DEFAULT_BATCH_SIZE)
+                continue
+        sources[name] = _batch_source(query, DEFAULT_BATCH_SIZE, after)
+    resets = {name for name, (_, reset) in resumed.items() if reset}
+    return _sse_response(_layers_sse_stream(queries, sources, positions, resets, DEFAULT_BATCH_SIZE))
+
+
+def _parse_layers(value: Optional[str]) -> List[str]:
+    """Layer names from a comma-separated `layers` parameter (all of `STREAM_LAYERS` if omitted)."""
+    names = [n.strip() for n in (value or ','.join(STREAM_LAYERS)).split(',') if n.strip()]
+    if not names or any(n not in STREAM_LAYERS for n in names):
+        raise ValueError(f"layers must be a comma-separated subset of {', '.join(STREAM_LAYERS)}")
+    return list(dict.fromkeys(names))
+
+
+def _layer_query(name: str, bbox: Optional[BBox] = None, zoom: Optional[int] = None) -> KeysetQuery:
+    if name == 'base_floor':
+        return _base_floor_query(bbox=bbox, zoom=zoom)
+    return _rooms_query('', bbox=bbox, zoom=zoom)
+
+
+async def _layers_sse_stream(queries, sources, positions, resets, batch_size: int, event_ids: bool = True,
+                             done: Optional[dict] = None):
+    """Interleave the batches of `sources` as SSE events named after their layer.
+
+    `positions` (every layer's `StreamPosition`, updated as batches are sent) make up the
+    event ids unless `event_ids` is off; layers in `resets` flag their first batch with
+    `reset`. `done` adds fields to the final `done` event.
+    """
+    merged = merge(sources, getattr(settings, 'LAYERS_STREAM_MAX_IN_FLIGHT', 2))
+    try:
+        yield retry_frame()
+        async for name, rows in merged:
+            query = queries[name]
+            position = positions[name] = _next_position(query, positions[name], rows, batch_size)
+            payload = _batch_payload(query, rows, position.batch, position.fetched, batch_size, reset=name in resets)
+            resets.discard(name)
+            yield format_event(payload, event=name,
+                               event_id=encode_positions(positions.values()) if event_ids else None)
+        sent = {name: {'batches': p.batch, 'fetched': p.fetched} for name, p in positions.items()}
+        yield format_event(dumps({**(done or {}), 'layers': sent}), event='done')
+    except GeneratorExit:
+        # Client disconnected; nothing to report
+        pass
+    finally:
+        # Cancels outstanding fetches and closes every layer's source
+        await merged.aclose()
+
+
+async def sync_view(request):
+    """GET /api/sync/?since=<version>&layers=base_floor,rooms
+
+    Delta sync for clients that cache whole layers (see changelog.py). Without `since`
+    the response is `{"version": <current version>}`; take it before a full download.
+    With `since`, the rows changed since that version are streamed like
+    `/api/layers/stream/`. Each `event: <layer>` batch holds changes
+    `{"op": "insert" | "update" | "delete", "ogc_fid": ..., "item": {...} | null}`, in
+    `ogc_fid` order. The final `done` event carries the `version` to pass as `since` next
+    time.
+
+    `410 Gone` means `since` is older than the retained change log; reload the layers.
+    The stream is meant for `fetch()`; its events carry no ids (a new request re-syncs).
+    """
+    try:
+        names = _parse_layers(request.GET.get('layers'))
+        since = request.GET.get('since')
+        since = int(since) if since is not None else None
+    except ValueError as e:
+        return json_response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        window = await sync_to_async(sync_window)()
+    except ProgrammingError:
+        return json_response({"detail": "Delta sync is not set up (see docs/changelog.sql)"},
+                             status=status.HTTP_501_NOT_IMPLEMENTED)
+    except OperationalError:
+        return json_response({"detail": "Database error"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    if since is None:
+        return json_response({"version": window.until})
+    if since > window.until:
+        return json_response({"detail": "since is ahead of the current version"}, status=status.HTTP_400_BAD_REQUEST)
+    if since < window.horizon:
+        return json_response({"detail": "Changes since this version are no longer available; reload the layers",
+                              "horizon": window.horizon}, status=status.HTTP_410_GONE)
+
+    queries = {name: changes_query(STREAM_LAYERS[name], _layer_query(name), since, window.until) for name in names}
+    sources = {name: _batch_source(query, DEFAULT_BATCH_SIZE) for name, query in queries.items()}
+    positions = {name: StreamPosition(None, 0, 0, None, False) for name in names}
+    return _sse_response(_layers_sse_stream(queries, sources, positions, set(), DEFAULT_BATCH_SIZE,
+                                            event_ids=False, done={'version': window.until}))
+
+
+def _sse_response(stream) -> StreamingHttpResponse:
+    """Wrap an async SSE generator in a streaming response (ASGI only), with heartbeats."""
+    response = StreamingHttpResponse(with_heartbeats(stream), content_type='text/event-stream')
+    # Prevent client-side and CDN caching of SSE streams
     response['Cache-Control'] = 'no-cache, no-store, must-revalidate'
     # Keep connection alive for streaming
     response['Connection'] = 'keep-alive'
-    # Disable buffering on reverse proxies
+    # Disable buffering on reverse proxies (nginx, etc.)
     response['X-Accel-Buffering'] = 'no'
     return response
 
 
+def _protobuf_response(stream) -> StreamingHttpResponse:
+    """`_sse_response` for binary frame streams; keepalives are empty frames."""
+    response = StreamingHttpResponse(with_heartbeats(stream, heartbeat=KEEPALIVE), content_type=PROTOBUF_CONTENT_TYPE)
+    response['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+    response['X-Accel-Buffering'] = 'no'
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+async def tile_view(request, layer: str, z: int, x: int, y: int):
+    """GET /api/tiles/<layer>/<z>/<x>/<y>.mvt
+
+    Mapbox Vector Tile of `base_floor` or `room_points` for one XYZ tile, built with
+    ST_AsMVT/ST_AsMVTGeom (see tiles.py). A tile only changes with its layer's data version,
+    so it carries that version's `ETag` / `Last-Modified` and a public `Cache-Control`
+    max-age, and revalidations are answered with a 304 without building the tile. A tile
+    without features is returned as `204 No Content` with the same headers.
+    """
+    if layer not in TILE_LAYERS:
+        return json_response({"detail": f"Unknown layer '{layer}'"}, status=status.HTTP_404_NOT_FOUND)
+    if not tile_bounds_valid(z, x, y):
+        return json_response({"detail": "Tile coordinates out of range"}, status=status.HTTP_400_BAD_REQUEST)
+
+    max_age = getattr(settings, 'TILE_CACHE_MAX_AGE', 3600)
+    try:
+        etag, last_modified = await sync_to_async(validators_for)(TILE_LAYERS[layer]['table'])
+        cached = not_modified(request, etag, last_modified)
+        if cached is not None:
+            return set_validators(cached, etag, last_modified, max_age=max_age)
+
+        if async_db.enabled():
+            tile = bytes(await async_db.fetch_value(*tile_query(layer, z, x, y)) or b'')
+        else:
+            tile = await sync_to_async(build_tile)(layer, z, x, y)
+    except OperationalError:
+        return json_response({"detail": "Database error"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    if tile:
+        response = HttpResponse(tile, content_type='application/vnd.mapbox-vector-tile')
+    else:
+        response = HttpResponse(status=status.HTTP_204_NO_CONTENT)
+    return set_validators(response, etag, last_modified, max_age=max_age)
+
+
 class RouteAPIView(APIView):
     """POST /api/route/
 
-    Body: { start_room_id, end_room_id, simplify_tolerance (optional) }
+    Body: { start_room_id | (start_lon, start_lat), end_room_id, simplify_tolerance (optional) }
+
+    Results are cached per graph version in a per-worker LRU and in the `route_result`
+    table (see `route_cache.py`); the response's `cache_id` can be used with
+    `/api/route/cache/<id>/`.
 
-    Runs all heavy lifting in SQL using pgr_dijkstra on `nav_edges_final`. Returns
-    GeoJSON LineString and total distance in meters.
+    By default runs all heavy lifting in SQL using pgr_dijkstra on `nav_edges_final`.
+    With `settings.ROUTING_ENGINE = 'inprocess'` the shortest path is computed on a
+    per-worker in-memory graph (see `routing.RoutingGraph`) and the DB is only used to
+    snap rooms to vertices and to assemble the geometry; `'ch'` answers from a prebuilt
+    contraction hierarchy instead (see `contraction.py`). Returns GeoJSON LineString and
+    total distance in meters, or with `Accept: application/x-protobuf` the same object in the
+    binary encoding of binary_geometry.py.
     """
 
+    renderer_classes = [FastJSONRenderer, ProtobufRenderer]
+
     def post(self, request):
-        """Compute route by delegating to DB function `get_route_between_rooms`.
+        """Compute route using the configured routing engine.
 
-        The database function is expected to return a JSONB with keys:
+        Both engines produce the contract of the DB function `get_route_between_rooms`,
+        a JSONB with keys:
           - start_vertex, end_vertex
           - total_cost_meters
           - route_geojson (GeoJSON object) or NULL
           - or {"error": "..."}
 
-        Note: this function (provided by the DB) projects room geometries to metric CRS (3857) and runs routing on `nav_edges_work`.
+        Note: the DB function projects room geometries to metric CRS (3857) and runs routing on `nav_edges_work`.
         """
         serializer = RouteRequestSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        start_room_id = serializer.validated_data['start_room_id']
+        start_room_id = serializer.validated_data.get('start_room_id')
         end_room_id = serializer.validated_data['end_room_id']
         simplify_tolerance = serializer.validated_data.get('simplify_tolerance', 0.0)
 
         try:
-            with connection.cursor() as cursor:
-                cursor.execute("SELECT public.get_route_between_rooms(%s, %s)", [start_room_id, end_room_id])
-                row = cursor.fetchone()
+            if start_room_id is None:
+                # Route from a GPS position: snapped in memory, never cached (positions rarely repeat)
+                res = self._compute_route_from_point(serializer.validated_data['start_lon'],
+                                                     serializer.validated_data['start_lat'],
+                                                     end_room_id, simplify_tolerance)
+                if 'error' in res:
+                    return Response({"detail": res['error']}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                if res.get('route_geojson') is None:
+                    return Response({"detail": "No path found between the selected rooms."}, status=status.HTTP_404_NOT_FOUND)
+                result = {"distance_meters": float(res.get('total_cost_meters') or 0.0), "route": res['route_geojson']}
+                return Response(RouteResultSerializer(result).data)
+
+            graph_version = current_graph_version()
+            cache_key = (start_room_id, end_room_id, simplify_tolerance, graph_version)
+
+            # Tier 1: per-worker LRU; tier 2: shared `route_result` table
+            cached = route_lru.get(cache_key)
+            if cached is None:
+                cached = lookup_persistent(start_room_id, end_room_id, simplify_tolerance, graph_version)
+                if cached is not None:
+                    route_lru.put(cache_key, cached)
+            if cached is not None:
+                return Response(RouteResultSerializer(cached).data)
+
+            # Concurrent requests for the same key share one computation (and one write-through);
+            # it is only cancelled on disconnect if no other request is waiting for it
+            with keep_running_while(lambda: _route_flight.waiting(cache_key) > 0):
+                res, result = _route_flight.do(
+                    cache_key,
+                    lambda: self._compute_and_cache(start_room_id, end_room_id, simplify_tolerance, graph_version),
+                )
+            if result is not None:
+                return Response(RouteResultSerializer(result).data)
 
-            if not row or not row[0]:
+            if not res:
                 return Response({"detail": "Route function returned no data"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            res = row[0]
-            # psycopg may return JSON as str or already parsed python object
-            if isinstance(res, str):
-                res = json.loads(res)
-
             if isinstance(res, dict) and 'error' in res:
                 return Response({"detail": res['error']}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
 
-            # Extract fields
-            total_cost = res.get('total_cost_meters')
-            route_geojson = res.get('route_geojson')
-
-            if route_geojson is None:
-                return Response({"detail": "No path found between the selected rooms."}, status=status.HTTP_404_NOT_FOUND)
-
-            result = {"distance_meters": float(total_cost or 0.0), "route": route_geojson}
-            result_serializer = RouteResultSerializer(result)
-            return Response(result_serializer.data)
+            # No error and no result: the engine found no route_geojson
+            return Response({"detail": "No path found between the selected rooms."}, status=status.HTTP_404_NOT_FOUND)
 
         except OperationalError:
-            logger.exception("OperationalError during route computation")
+            if request_cancelled():
+                # The client went away and its query was cancelled; nobody reads this response
+                logger.info("Route computation cancelled after client disconnect")
+            else:
+                logger.exception("OperationalError during route computation")
             return Response({"detail": "Database error"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except Exception as e:
             logger.exception("Route computation failed")
@@ -357,7 +936,124 @@ class RouteAPIView(APIView):
                 return Response({"detail": err_str}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
             return Response({"detail": "Internal server error"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def _compute_and_cache(self, start_room_id: int, end_room_id: int, simplify_tolerance: float, graph_version: str):
+        """Compute a route and write successful results through to both cache tiers.
+
+        Returns `(res, result)`: the raw engine result, plus the response payload when a
+        route was found (None otherwise, so `post` can report the error from `res`).
+        """
+        res = self._compute_route(start_room_id, end_room_id, simplify_tolerance)
+        if not isinstance(res, dict) or 'error' in res or res.get('route_geojson') is None:
+            return res, None
+
+        result = {"distance_meters": float(res.get('total_cost_meters') or 0.0), "route": res['route_geojson']}
+        # `cache_id` lets clients re-fetch the route via /api/route/cache/<id>/
+        result['cache_id'] = store_persistent(start_room_id, end_room_id, simplify_tolerance, graph_version,
+                                              result['distance_meters'], result['route'])
+        route_lru.put((start_room_id, end_room_id, simplify_tolerance, graph_version), result)
+        return res, result
+
+    def _compute_route(self, start_room_id: int, end_room_id: int, simplify_tolerance: float):
+        """Dispatch to the routing engine selected by `settings.ROUTING_ENGINE` ('db', 'inprocess' or 'ch')."""
+        engine = getattr(settings, 'ROUTING_ENGINE', 'db')
+        if engine in ('inprocess', 'ch'):
+            return self._compute_route_inprocess(start_room_id, end_room_id, simplify_tolerance, engine)
+        return self._compute_route_db(start_room_id, end_room_id)
+
+    def _compute_route_db(self, start_room_id: int, end_room_id: int):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT public.get_route_between_rooms(%s, %s)", [start_room_id, end_room_id])
+            row = cursor.fetchone()
+
+        if not row or not row[0]:
+            return None
+
+        res = row[0]
+        # psycopg may return JSON as str or already parsed python object
+        if isinstance(res, str):
+            res = loads(res)
+        return res
+
+    def _compute_route_inprocess(self, start_room_id: int, end_room_id: int, simplify_tolerance: float,
+                                 engine: str = 'inprocess'):
+        try:
+            start_vid = self._find_nearest_vertex(start_room_id)
+            end_vid = self._find_nearest_vertex(end_room_id)
+        except ValueError as e:
+            return {"error": str(e)}
+        return self._route_between_vertices(start_vid, end_vid, simplify_tolerance, engine)
+
+    def _compute_route_from_point(self, lon: float, lat: float, end_room_id: int, simplify_tolerance: float):
+        """Route from a WGS84 position (e.g. GPS) to a room, in the result format of `_compute_route`."""
+        try:
+            start_vid = self._find_nearest_vertex_to_lonlat(lon, lat)
+            end_vid = self._find_nearest_vertex(end_room_id)
+        except ValueError as e:
+            return {"error": str(e)}
+        return self._route_between_vertices(start_vid, end_vid, simplify_tolerance,
+                                            getattr(settings, 'ROUTING_ENGINE', 'db'))
+
+    def _route_between_vertices(self, start_vid: int, end_vid: int, simplify_tolerance: float, engine: str):
+        res = {
+            'start_vertex': start_vid,
+            'end_vertex': end_vid,
+            'total_cost_meters': None,
+            'route_geojson': None,
+        }
+        if engine in ('inprocess', 'ch'):
+            # The contraction hierarchy answers with a bidirectional upward search and unpacks
+            # shortcuts into original edge ids; without a built index fall back to the graph.
+            router = get_contraction_hierarchy() if engine == 'ch' else None
+            if router is None:
+                router = get_routing_graph()
+            path = router.shortest_path(start_vid, end_vid, algorithm=routing_algorithm())
+            edge_ids, cost = (path.edge_ids, path.cost) if path else ([], None)
+        else:
+            edge_ids, cost = self._compute_route_edges(start_vid, end_vid), None
+        if not edge_ids:
+            return res
+
+        geojson, distance = self._assemble_route_geometry(edge_ids, simplify_tolerance)
+        res['total_cost_meters'] = cost if cost is not None else distance
+        res['route_geojson'] = loads(geojson) if geojson else None
+        return res
+
+    def _find_nearest_vertex_to_lonlat(self, lon: float, lat: float) -> int:
+        index = get_vertex_snap_index() if getattr(settings, 'ROUTING_SNAP_INDEX', True) else None
+        if index is not None:
+            vid = index.snap_lonlat(lon, lat)
+            if vid is not None:
+                return vid
+        sql = """
+            SELECT v.id
+            FROM nav_edges_work_vertices_pgr v
+            ORDER BY v.the_geom <-> ST_Transform(ST_SetSRID(ST_MakePoint(%s, %s), 4326), ST_SRID(v.the_geom))
+            LIMIT 1
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [lon, lat])
+            row = cursor.fetchone()
+        if not row:
+            raise ValueError("No routing vertex near the given position")
+        return int(row[0])
+
     def _find_nearest_vertex(self, room_id: int) -> int:
+        # Precomputed room -> vertex table of the in-memory snap index; no DB round trip.
+        if getattr(settings, 'ROUTING_SNAP_INDEX', True):
+            index = get_vertex_snap_index()
+            vid = index.vertex_for_room(room_id)
+            if vid is not None:
+                return vid
+            # Rooms added since the index was built: snap their catalog position in memory
+            catalog = _room_catalog()
+            if catalog is not None:
+                if room_id not in catalog:
+                    raise ValueError(f"Room with id={room_id} not found or no nearby vertex")
+                lonlat = catalog.lonlat(room_id)
+                vid = index.snap_lonlat(*lonlat) if lonlat else None
+                if vid is not None:
+                    return vid
+
         # Robust nearest-vertex lookup that handles missing SRID on room geometries.
         # If the room's geometry has SRID=0 (unknown), we assume it's already in the same
         # coordinate system as the vertex table and set the SRID to the target vertex SRID
@@ -391,66 +1087,12 @@ class RouteAPIView(APIView):
         return int(row[0])
 
     def _detect_nav_edges_final_schema(self):
-        """Detect and cache column names for nav_edges_final table.
+        """Detect column names for nav_edges_final table (cached per process).
 
         Returns a dict: {id_col, source_col, target_col, cost_col, geom_col}
         Raises RuntimeError with helpful message if required columns are missing.
         """
-        if hasattr(self, '_nav_edges_schema'):
-            return self._nav_edges_schema
-
-        with connection.cursor() as cursor:
-            cursor.execute(
-                "SELECT column_name FROM information_schema.columns WHERE table_name = %s",
-                ['nav_edges_final'],
-            )
-            cols = {row[0] for row in cursor.fetchall()}
-
-        # Candidate names
-        id_candidates = ['ogc_fid', 'gid', 'id', 'edge_id']
-        source_candidates = ['source', 'start_vid', 'u', 'from_id', 'from']
-        target_candidates = ['target', 'end_vid', 'v', 'to_id', 'to']
-        cost_candidates = ['cost', 'length', 'distance', 'weight']
-        geom_candidates = ['wkb_geometry', 'geom', 'the_geom', 'geometry']
-
-        def pick(cands):
-            for c in cands:
-                if c in cols:
-                    return c
-            return None
-
-        id_col = pick(id_candidates)
-        source_col = pick(source_candidates)
-        target_col = pick(target_candidates)
-        cost_col = pick(cost_candidates)
-        geom_col = pick(geom_candidates)
-
-        missing = []
-        if id_col is None:
-            missing.append('id column (e.g. ogc_fid, id, gid)')
-        if source_col is None or target_col is None:
-            missing.append('source/target columns (e.g. source, target)')
-        if cost_col is None:
-            missing.append('cost column (e.g. cost, length)')
-        if geom_col is None:
-            missing.append('geometry column (e.g. wkb_geometry, geom)')
-
-        if missing:
-            raise RuntimeError(
-                'nav_edges_final is missing required columns: ' + ', '.join(missing) +
-                ". Columns found: " + ','.join(sorted(cols))
-            )
-
-        schema = {
-            'id_col': id_col,
-            'source_col': source_col,
-            'target_col': target_col,
-            'cost_col': cost_col,
-            'geom_col': geom_col,
-        }
-        self._nav_edges_schema = schema
-        logger.debug('Detected nav_edges_final schema: %s', schema)
-        return schema
+        return detect_nav_edges_final_schema()
 
     def _compute_route_edges(self, start_vid: int, end_vid: int) -> List[int]:
         # Run pgr_dijkstra in DB and return ordered list of edge ids
@@ -496,6 +1138,191 @@ class RouteAPIView(APIView):
                 raise RuntimeError('Failed to assemble route geometry')
             return row[0], row[1]
 
+class RouteMatrixAPIView(RouteAPIView):
+    """POST /api/route/matrix/
+
+    Body: { sources: [room ids], targets: [room ids], geometry_top_k (optional),
+            simplify_tolerance (optional), stream (optional) }
+
+    Returns the shortest distance from every source room to every target room, computed
+    one source row at a time in a single pass: a one-to-many Dijkstra on the in-process
+    graph, or one `pgr_dijkstraCost` call with vertex arrays when `ROUTING_ENGINE='db'`.
+    For each source row, route geometries are attached for the `geometry_top_k` nearest
+    targets (e.g. "nearest restroom / exit").
+
+    Large matrices (more than `ROUTE_MATRIX_STREAM_CELLS` cells, or `stream: true`) are
+    streamed as SSE batches of rows instead of one JSON document.
+    """
+
+    renderer_classes = [FastJSONRenderer]
+
+    def post(self, request):
+        serializer = RouteMatrixRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        sources = serializer.validated_data['sources']
+        targets = serializer.validated_data['targets']
+        top_k = serializer.validated_data.get('geometry_top_k', 0)
+        simplify_tolerance = serializer.validated_data.get('simplify_tolerance', 0.0)
+
+        try:
+            vertices = self._find_nearest_vertices(set(sources) | set(targets))
+        except OperationalError:
+            logger.exception("OperationalError while snapping matrix rooms")
+            return Response({"detail": "Database error"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        missing = sorted((set(sources) | set(targets)) - set(vertices))
+        if missing:
+            return Response({"detail": f"Rooms not found or without a nearby vertex: {missing}"},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        cells = len(sources) * len(targets)
+        if serializer.validated_data.get('stream') or cells > getattr(settings, 'ROUTE_MATRIX_STREAM_CELLS', 2500):
+            response = StreamingHttpResponse(
+                self._sse_matrix_stream(sources, targets, vertices, top_k, simplify_tolerance),
+                content_type='text/event-stream'
+            )
+            response['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+            response['Connection'] = 'keep-alive'
+            response['X-Accel-Buffering'] = 'no'
+            return response
+
+        try:
+            rows = self._matrix_rows(sources, targets, vertices, top_k, simplify_tolerance)
+        except OperationalError:
+            logger.exception("OperationalError during matrix computation")
+            return Response({"detail": "Database error"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({"sources": sources, "targets": targets, "rows": rows})
+
+    async def _sse_matrix_stream(self, sources, targets, vertices, top_k, simplify_tolerance):
+        """Yield SSE events with `ROUTE_MATRIX_STREAM_ROWS` source rows each."""
+        chunk = getattr(settings, 'ROUTE_MATRIX_STREAM_ROWS', 16)
+        batch_num = 0
+        if async_db.enabled() and getattr(settings, 'ROUTING_ENGINE', 'db') == 'db':
+            # Detected once per process; later calls from the event loop hit the cache
+            await sync_to_async(self._detect_nav_edges_final_schema)()
+        try:
+            for start in range(0, len(sources), chunk):
+                part = sources[start:start + chunk]
+                if async_db.enabled() and getattr(settings, 'ROUTING_ENGINE', 'db') == 'db':
+                    # Costs come straight from the async pool; only top-K geometries need a thread
+                    sql, params = self._matrix_costs_query([vertices[s] for s in part], [vertices[t] for t in targets])
+                    costs = self._costs_from_rows(
+                        await async_db.fetch_all(sql, params), [vertices[s] for s in part], [vertices[t] for t in targets])
+                    if top_k:
+                        rows = await sync_to_async(self._matrix_rows)(
+                            part, targets, vertices, top_k, simplify_tolerance, costs=costs)
+                    else:
+                        rows = self._matrix_rows(part, targets, vertices, 0, simplify_tolerance, costs=costs)
+                else:
+                    rows = await sync_to_async(self._matrix_rows)(part, targets, vertices, top_k, simplify_tolerance)
+                batch_num += 1
+                payload = {
+                    'batch': batch_num,
+                    'fetched': start + len(part),
+                    'more_pending': start + len(part) < len(sources),
+                    'items': rows,
+                }
+                yield b'data: ' + dumps(payload) + b'\n\n'
+        except GeneratorExit:
+            # Client disconnected; stop computing further rows.
+            pass
+
+    def _matrix_rows(self, sources, targets, vertices, top_k, simplify_tolerance, costs=None):
+        """Build one result row per source room: distances to all targets plus top-K routes.
+
+        `costs` may be passed in when they were already fetched (see `_sse_matrix_stream`).
+        """
+        if costs is None:
+            costs = self._matrix_costs([vertices[s] for s in sources], [vertices[t] for t in targets])
+        rows = []
+        for source in sources:
+            sv = vertices[source]
+            distances = [costs.get((sv, vertices[t])) for t in targets]
+            reachable = sorted((d, t) for d, t in zip(distances, targets) if d is not None)
+            routes = []
+            for distance, target in reachable[:top_k]:
+                edge_ids = self._pair_route_edges(sv, vertices[target])
+                geojson = self._assemble_route_geometry(edge_ids, simplify_tolerance)[0] if edge_ids else None
+                routes.append({
+                    'target': target,
+                    'distance_meters': distance,
+                    'route': loads(geojson) if geojson else None,
+                })
+            rows.append({'source': source, 'distances': distances, 'routes': routes})
+        return rows
+
+    def _matrix_costs(self, source_vids, target_vids):
+        """Return {(source_vid, target_vid): cost} for every reachable pair."""
+        if getattr(settings, 'ROUTING_ENGINE', 'db') in ('inprocess', 'ch'):
+            graph = get_routing_graph()
+            costs = {}
+            for sv in set(source_vids):
+                for tv, cost in graph.one_to_many(sv, target_vids).items():
+                    costs[(sv, tv)] = cost
+            return costs
+
+        sql, params = self._matrix_costs_query(source_vids, target_vids)
+        return self._costs_from_rows(_fetch_rows(sql, params), source_vids, target_vids)
+
+    def _matrix_costs_query(self, source_vids, target_vids):
+        schema = self._detect_nav_edges_final_schema()
+        inner_sql = f"SELECT {schema['id_col']} AS id, {schema['source_col']} AS source, {schema['target_col']} AS target, {schema['cost_col']} AS cost FROM nav_edges_final"
+        sql = f"""
+            SELECT start_vid, end_vid, agg_cost
+            FROM pgr_dijkstraCost('{inner_sql}', %s::bigint[], %s::bigint[], directed := false)
+        """
+        return sql, [list(set(source_vids)), list(set(target_vids))]
+
+    @staticmethod
+    def _costs_from_rows(rows, source_vids, target_vids):
+        costs = {(int(r['start_vid']), int(r['end_vid'])): float(r['agg_cost']) for r in rows}
+        # pgr_dijkstraCost omits pairs where start == end
+        for sv in source_vids:
+            if sv in target_vids:
+                costs[(sv, sv)] = 0.0
+        return costs
+
+    def _pair_route_edges(self, start_vid: int, end_vid: int) -> List[int]:
+        if getattr(settings, 'ROUTING_ENGINE', 'db') in ('inprocess', 'ch'):
+            path = get_routing_graph().shortest_path(start_vid, end_vid, algorithm=routing_algorithm())
+            return path.edge_ids if path else []
+        return self._compute_route_edges(start_vid, end_vid)
+
+    def _find_nearest_vertices(self, room_ids) -> dict:
+        """Snap many rooms to their nearest vertex in one query; returns {room_id: vertex_id}."""
+        vertices = {}
+        if getattr(settings, 'ROUTING_SNAP_INDEX', True):
+            index = get_vertex_snap_index()
+            for room_id in room_ids:
+                vid = index.vertex_for_room(room_id)
+                if vid is not None:
+                    vertices[room_id] = vid
+            room_ids = [r for r in room_ids if r not in vertices]
+            if not room_ids:
+                return vertices
+
+        sql = """
+            SELECT r.ogc_fid, (
+                SELECT v.id
+                FROM nav_edges_work_vertices_pgr v
+                ORDER BY v.the_geom <-> (
+                    CASE
+                        WHEN ST_SRID(r.wkb_geometry) = 0 THEN ST_SetSRID(r.wkb_geometry, ST_SRID(v.the_geom))
+                        WHEN ST_SRID(r.wkb_geometry) = ST_SRID(v.the_geom) THEN r.wkb_geometry
+                        ELSE ST_Transform(r.wkb_geometry, ST_SRID(v.the_geom))
+                    END
+                )
+                LIMIT 1
+            ) AS vertex_id
+            FROM room_points r
+            WHERE r.ogc_fid = ANY(%s)
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [list(room_ids)])
+            vertices.update({int(room_id): int(vid) for room_id, vid in cursor.fetchall() if vid is not None})
+        return vertices
+
+
 class HealthAPIView(APIView):
     def get(self, request):
         try:
@@ -511,13 +1338,47 @@ class HealthAPIView(APIView):
             return bool(cursor.fetchone())
 
 
+class StatsAPIView(APIView):
+    """GET /api/stats/ — per-worker counters for the route cache, request coalescing, the async DB pool
+    and queries cancelled after client disconnects."""
+
+    def get(self, request):
+        return Response({
+            "route_cache": route_lru.stats(),
+            "route_singleflight": _route_flight.stats(),
+            "async_db_pool": async_db.pool_stats(),
+            "query_cancellation": query_stats.stats(),
+        })
+
+
 class RouteCacheAPIView(APIView):
-    """Optional endpoint to fetch cached route geometry from `route_result` table by id."""
+    """Optional endpoint to fetch cached route geometry from `route_result` table by id.
+
+    A `route_result` row never changes, and only rows of the current graph version are
+    served (older ones are 404 until `prune_route_cache` deletes them), so the ETag is
+    derived from the id and the graph version and revalidations are answered without
+    reading the row.
+
+    Like `/api/route/`, answers in the binary encoding of binary_geometry.py with
+    `Accept: application/x-protobuf`; the ETag then names that representation.
+    """
+
+    renderer_classes = [FastJSONRenderer, ProtobufRenderer]
 
     def get(self, request, cache_id: int):
-        sql = "SELECT ST_AsGeoJSON(the_geom) as geojson, distance_meters FROM route_result WHERE id = %s"
+        sql = """
+            SELECT ST_AsGeoJSON(the_geom) as geojson, distance_meters
+            FROM route_result
+            WHERE id = %s AND graph_version = %s
+        """
+        suffix = f'.{ProtobufRenderer.format}' if request.accepted_renderer.format == ProtobufRenderer.format else ''
         try:
-            rows = self._execute_and_fetch(sql, [cache_id])
+            graph_version = current_graph_version()
+            etag = f'W/"route-{cache_id}.{graph_version}{suffix}"'
+            cached = not_modified(request, etag)
+            if cached is not None:
+                return set_validators(cached, etag, vary=('Accept',))
+            rows = self._execute_and_fetch(sql, [cache_id, graph_version])
         except OperationalError:
             return Response({"detail": "Database error"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
@@ -525,7 +1386,8 @@ class RouteCacheAPIView(APIView):
             return Response({"detail": "Cache not found"}, status=status.HTTP_404_NOT_FOUND)
 
         item = rows[0]
-        return Response({"distance_meters": float(item.get('distance_meters') or 0.0), "route": json.loads(item.get('geojson') or '{"type":"LineString","coordinates":[]}')})
+        response = Response({"distance_meters": float(item.get('distance_meters') or 0.0), "route": loads(item.get('geojson') or '{"type":"LineString","coordinates":[]}')})
+        return set_validators(response, etag, vary=('Accept',))
 
     def _execute_and_fetch(self, sql: str, params: Optional[List] = None):
         with connection.cursor() as cursor:
@@ -0,0 +1,48 @@
+"""Warm per-worker in-memory indexes at startup so the first requests aren't slow.
+
+Called from the ASGI/WSGI entry points when `settings.WARM_UP_ON_STARTUP` is enabled.
+The work runs in a daemon thread (after app loading, so it doesn't trip Django's
+"database access during app initialization" warning) and failures are only logged: every
+index is also built lazily on first use.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+def _warm_up():
+    from .room_catalog import get_room_catalog
+    from .room_search import get_room_search_index
+    from .routing import get_routing_graph
+    from .spatial_index import get_vertex_snap_index
+
+    tasks = []
+    if getattr(settings, 'ROUTING_SNAP_INDEX', True):
+        tasks.append(('vertex snap index', get_vertex_snap_index))
+    if getattr(settings, 'ROOM_CATALOG', True):
+        tasks.append(('room catalog', get_room_catalog))
+    if getattr(settings, 'ROOM_SEARCH_INDEX', True):
+        tasks.append(('room search index', get_room_search_index))
+    if getattr(settings, 'ROUTING_ENGINE', 'db') in ('inprocess', 'ch'):
+        tasks.append(('routing graph', get_routing_graph))
+
+    try:
+        for name, build in tasks:
+            try:
+                build()
+            except Exception:
+                logger.warning('Warm-up of %s failed; it will be built on first use', name, exc_info=True)
+    finally:
+        close_old_connections()
+
+
+def start_warm_up():
+    if not getattr(settings, 'WARM_UP_ON_STARTUP', False):
+        return None
+    thread = threading.Thread(target=_warm_up, name='warm-up', daemon=True)
+    thread.start()
+    return thread